@@ -0,0 +1,576 @@
+# IoT Parking Meter Simulation - benchmarks
+# By Aussie Schnore
+#
+# Stand alone benchmarks for the simulation. Run one with
+#   python bench.py <name> [options]
+# or everything with
+#   python bench.py suite --json results.jsonl
+# Results are printed one line per measurement and, with --json, appended to
+# a JSON lines file so runs can be compared for regressions. Benchmarks that
+# run the simulation do each case in a forked child process so the reported
+# peak RSS belongs to that case alone.
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from encoder import SpotEncoder
+from fake_mqtt import FakeBroker, FakeMqttConnection
+from lotconfig import load_lots, synthetic_city, write_lots
+from lotreport import REPORT_MODES, LotReporter
+from pacing import NoPacing, TokenBucketPacer
+from parky_sim import DEFAULT_START, Lot, Parking, Spot, parking_config, percent_occupied_table
+from publisher import MqttPublisher, QueuedPublisher
+from randomgroup import report_schedule
+
+# Where report() appends JSON lines, set by --json
+_json_path = None
+
+
+def report(benchmark, **fields):
+    # Print one measurement and record it
+    print(benchmark + " " + " ".join(f"{key}={value}" for key, value in fields.items()))
+    if _json_path:
+        record = {'benchmark': benchmark, 'time': int(time.time())}
+        record.update(fields)
+        with open(_json_path, "a") as out:
+            out.write(json.dumps(record) + "\n")
+
+
+def peak_rss_kb():
+    # High water mark of this process's resident memory in KB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _isolated_child(conn, func, args):
+    result = func(*args)
+    result['peak_rss_kb'] = peak_rss_kb()
+    conn.send(result)
+    conn.close()
+
+
+def isolated(func, *args):
+    # Run func(*args) -> dict in a forked child and add the child's peak RSS.
+    # Runs in process where fork isn't available, then the RSS is the
+    # process's high water mark so far.
+    if "fork" not in multiprocessing.get_all_start_methods():
+        result = func(*args)
+        result['peak_rss_kb'] = peak_rss_kb()
+        return result
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    child = context.Process(target=_isolated_child, args=(child_conn, func, args))
+    child.start()
+    child_conn.close()
+    result = parent_conn.recv()
+    child.join()
+    return result
+
+
+# The baseline Spot, before it moved to __slots__ and a shared Lot record,
+# kept here only to compare against
+class _DictSpot(object):
+    def __init__(self, address, location, number, isOccupied):
+        self.address = address
+        self.location = location
+        self.number = number
+        self.isOccupied = isOccupied
+
+
+def _build_dict_spots(spot_cnt):
+    spots = []
+    while len(spots) < spot_cnt:
+        for lot in parking_config:
+            for i in range(lot['meter_count']):
+                # The old _make_spots took the address and location per spot
+                spots.append(_DictSpot(lot['address'], lot['location'], i + 1, False))
+    return spots[:spot_cnt]
+
+
+def _build_slot_spots(spot_cnt):
+    spots = []
+    lot_id = 0
+    while len(spots) < spot_cnt:
+        for lot_config in parking_config:
+            lot = Lot(lot_id, lot_config['address'], lot_config['location'])
+            lot_id += 1
+            for i in range(lot_config['meter_count']):
+                spots.append(Spot(lot, i + 1, False))
+    return spots[:spot_cnt]
+
+
+def _measure(build, spot_cnt):
+    tracemalloc.start()
+    start = time.perf_counter()
+    spots = build(spot_cnt)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del spots
+    return current, elapsed
+
+
+def bench_spot_memory(args):
+    # Memory held by 'spots' Spot objects in the old and new layouts
+    for spot_cnt in args.spots or [1000000]:
+        for name, build in [("dict", _build_dict_spots), ("slots", _build_slot_spots)]:
+            used, elapsed = _measure(build, spot_cnt)
+            report("spot-memory", layout=name, spots=spot_cnt, bytes=used,
+                   bytes_per_spot=round(used / spot_cnt, 1), build_s=round(elapsed, 2))
+
+
+# The re-report grouping before it was replaced, kept here only to compare
+# against: pad with sentinels and take the first partition from a recursive
+# generator
+def _sum_to_n(n, size, limit=None):
+    if size == 1:
+        yield [n]
+        return
+    if limit is None:
+        limit = n
+    start = (n + size - 1) // size
+    stop = min(limit, n - size + 1) + 1
+    for i in range(start, stop):
+        for tail in _sum_to_n(n - i, size - 1, i):
+            yield [i] + tail
+
+
+def _legacy_group_list(report_list, group_cnt, rng):
+    report_list = report_list + (group_cnt * 2) * [-200]
+    rng.shuffle(report_list)
+    groupings = next(_sum_to_n(len(report_list), group_cnt))
+    report_shedule = []
+    index = 0
+    for this_group_size in groupings:
+        report_shedule.append(report_list[index:index+this_group_size])
+        index = index+this_group_size
+    return report_shedule
+
+
+def bench_group_list(args):
+    # Time to build the re-report schedule for 'spots' spots
+    rng = random.Random(0)
+    for spot_cnt in args.spots or [1000000]:
+        start = time.perf_counter()
+        report_order = list(range(spot_cnt))
+        rng.shuffle(report_order)
+        _legacy_group_list(report_order, 60, rng)
+        report("group-list", impl="legacy", spots=spot_cnt, interval=60,
+               seconds=round(time.perf_counter() - start, 3))
+        for interval in [5, 15, 60]:
+            start = time.perf_counter()
+            report_schedule(spot_cnt, interval, rng)
+            report("group-list", impl="direct", spots=spot_cnt, interval=interval,
+                   seconds=round(time.perf_counter() - start, 3))
+
+
+def scaled_config(spot_cnt):
+    # The sample parking_config repeated until it has at least 'spot_cnt' meters
+    meters = sum(lot['meter_count'] for lot in parking_config)
+    return parking_config * max(1, -(-spot_cnt // meters))
+
+
+def bench_sinks(args):
+    # Events/s and file size writing the same run to each file format
+    from sinks import make_sink, run_to_sink
+    formats = ["ndjson", "ndjson.gz", "ndjson.zst", "csv", "csv.gz", "csv.zst", "parquet", "arrow", "evlog"]
+    for spot_cnt in args.spots or [100000]:
+        config = scaled_config(spot_cnt)
+        with tempfile.TemporaryDirectory() as work_dir:
+            for file_format in formats:
+                path = os.path.join(work_dir, "events." + file_format)
+                parking = Parking(None, config, percent_occupied_table, DEFAULT_START, None, seed=0)
+                try:
+                    events, seconds = run_to_sink(parking, args.hours, make_sink("file:" + path))
+                except ImportError as e:
+                    print(f"sinks format={file_format} skipped ({e})")
+                    continue
+                report("sinks", format=file_format, spots=parking.spots_cnt, hours=args.hours, events=events,
+                       seconds=round(seconds, 2), events_per_sec=round(events / seconds),
+                       bytes=os.path.getsize(path))
+
+
+# Sinks for the walk benchmark. Each takes a scratch directory and returns
+# (conn, callback, finish) for Parking, finish being called once the walk is done
+def _null_sink(work_dir):
+    return None, lambda conn, obj, mil_time, source: None, lambda: None
+
+
+def _memory_sink(work_dir):
+    return [], lambda conn, obj, mil_time, source: conn.append(obj), lambda: None
+
+
+def _file_sink(work_dir):
+    out = open(os.path.join(work_dir, "events.ndjson"), "w", buffering=1024 * 1024)
+    return out, lambda conn, obj, mil_time, source: conn.write(json.dumps(obj) + "\n"), out.close
+
+
+def _fake_mqtt_sink(work_dir):
+    connection = FakeMqttConnection(FakeBroker(), "bench")
+    connection.connect()
+    publisher = MqttPublisher(connection, "bench/topic", 1)
+
+    def finish():
+        publisher.close()
+        connection.disconnect()
+    return publisher, lambda conn, obj, mil_time, source: conn.publish(obj), finish
+
+
+WALK_SINKS = {
+    'null': _null_sink,
+    'memory': _memory_sink,
+    'file': _file_sink,
+    'mqtt-fake': _fake_mqtt_sink,
+}
+
+
+def _walk_case(spot_cnt, hours, sink_name):
+    # One walk_through_sim run, called in a child process by isolated()
+    events = [0]
+    with tempfile.TemporaryDirectory() as work_dir:
+        conn, callback, finish = WALK_SINKS[sink_name](work_dir)
+
+        def counting_callback(conn, obj, mil_time, source):
+            events[0] += 1
+            callback(conn, obj, mil_time, source)
+        start = time.perf_counter()
+        parking = Parking(conn, scaled_config(spot_cnt), percent_occupied_table, DEFAULT_START,
+                          counting_callback, seed=0, pacer=NoPacing())
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        parking.walk_through_sim(hours)
+        finish()
+        seconds = time.perf_counter() - start
+    result = {}
+    result['sink'] = sink_name
+    result['spots'] = parking.spots_cnt
+    result['hours'] = hours
+    result['events'] = events[0]
+    result['build_s'] = round(build_s, 3)
+    result['seconds'] = round(seconds, 3)
+    result['events_per_sec'] = round(events[0] / seconds) if seconds > 0 else 0
+    return result
+
+
+def bench_walk(args):
+    # Whole simulation runs into each sink, one child process per case
+    for spot_cnt in args.spots or [10, 1000, 100000, 1000000]:
+        for sink_name in args.sinks:
+            report("walk", **isolated(_walk_case, spot_cnt, args.hours, sink_name))
+
+
+def _sample_spots(spot_cnt):
+    # Spots from a freshly built Parking, half of them occupied
+    parking = Parking(None, scaled_config(spot_cnt), percent_occupied_table, DEFAULT_START, None, seed=0)
+    for spot in parking.spots[::2]:
+        spot.occupy()
+    return parking.spots
+
+
+def _encode_methods():
+    methods = [
+        ("produce+dumps", lambda spot, ts: json.dumps(spot.produce(ts))),
+    ]
+    for backend in ["json", "orjson", "msgpack"]:
+        try:
+            encoder = SpotEncoder(backend)
+        except ImportError as e:
+            print(f"encode method=encoder-{backend} skipped ({e})")
+            continue
+        methods.append(("encoder-" + backend, encoder.encode_spot))
+    return methods
+
+
+def bench_encode(args):
+    # Cost of turning one spot event into a message, per method
+    spots = _sample_spots(min(args.spots[0] if args.spots else 10000, args.events))
+    rounds = max(1, args.events // len(spots))
+    for name, encode in _encode_methods():
+        size = 0
+        start = time.perf_counter()
+        for ts in range(DEFAULT_START, DEFAULT_START + rounds):
+            for spot in spots:
+                size += len(encode(spot, ts))
+        seconds = time.perf_counter() - start
+        events = rounds * len(spots)
+        report("encode", method=name, events=events, seconds=round(seconds, 3),
+               events_per_sec=round(events / seconds), bytes_per_event=round(size / events, 1))
+
+
+def _publish_case(events, window, batch_size, ack_delay, use_encoder):
+    # Events straight into MqttPublisher over the fake broker
+    spots = _sample_spots(min(events, 10000))
+    objs = [spot.produce(DEFAULT_START) for spot in spots]
+    connection = FakeMqttConnection(FakeBroker(), "bench", ack_delay=ack_delay)
+    connection.connect()
+    publisher = MqttPublisher(connection, "bench/topic", 1, window=window, batch_size=batch_size,
+                              encoder=SpotEncoder("auto") if use_encoder else None)
+    for i in range(events):
+        publisher.publish(objs[i % len(objs)])
+    publisher.close()
+    connection.disconnect()
+    result = {}
+    result['window'] = window
+    result['batch'] = batch_size
+    result['ack_delay_ms'] = ack_delay * 1000
+    result['encoder'] = use_encoder
+    result.update(publisher.stats())
+    return result
+
+
+def bench_publish(args):
+    # The publish path alone, from event object to acked message
+    for window, batch_size, use_encoder in [(1, 1, False), (100, 1, False), (100, 1, True), (100, 50, True)]:
+        report("publish", **isolated(_publish_case, args.events, window, batch_size, args.ack_delay, use_encoder))
+
+
+def _queue_case(spot_cnt, hours, ack_delay, workers, policy, max_queue, rate):
+    # A simulation publishing to a slow fake broker, inline (workers=0) or
+    # through a QueuedPublisher, unpaced or paced at 'rate' events a second.
+    # sim_seconds is how long the simulation loop took, total_seconds
+    # includes draining the queues and the last acks. The lots are spread
+    # over the workers by address, so they come from a synthetic city where
+    # every lot has its own.
+    config = list(synthetic_city(spot_cnt, seed=0))
+    connection = FakeMqttConnection(FakeBroker(), "bench", ack_delay=ack_delay)
+    connection.connect()
+    publishers = [MqttPublisher(connection, "bench/topic", 1, window=8, encoder=SpotEncoder("auto"))
+                  for _ in range(max(1, workers))]
+    if workers:
+        publisher = QueuedPublisher(publishers, config, [n % workers for n in range(len(config))], max_queue, policy)
+    else:
+        publisher = publishers[0]
+    calls = dict(events=0, slowest=0.0)
+
+    def publish_callback(conn, obj, mil_time, source):
+        start = time.perf_counter()
+        publisher.publish(obj)
+        calls['events'] += 1
+        calls['slowest'] = max(calls['slowest'], time.perf_counter() - start)
+
+    parking = Parking(None, config, percent_occupied_table, DEFAULT_START, publish_callback, seed=0,
+                      pacer=TokenBucketPacer(rate) if rate else NoPacing())
+    start = time.perf_counter()
+    parking.walk_through_sim(hours)
+    sim_seconds = time.perf_counter() - start
+    publisher.close()
+    total_seconds = time.perf_counter() - start
+    connection.disconnect()
+    stats = publisher.stats()
+    result = {}
+    result['workers'] = workers
+    result['policy'] = policy if workers else "inline"
+    result['target_rate'] = rate or "unpaced"
+    result['sim_events'] = calls['events']
+    result['sim_seconds'] = round(sim_seconds, 3)
+    result['sim_events_per_sec'] = round(calls['events'] / sim_seconds)
+    result['published'] = stats['events']
+    result['total_seconds'] = round(total_seconds, 3)
+    result['max_publish_call_ms'] = round(calls['slowest'] * 1000, 2)
+    result['dropped'] = stats.get('dropped', 0)
+    result['queue_depth_max'] = stats.get('queue_depth_max', 0)
+    return result
+
+
+def bench_queue(args):
+    # Whether a slow broker (8 acks in flight, --ack-delay each) holds up the
+    # simulation, publishing inline against worker threads behind bounded
+    # queues, flat out and paced at --rate
+    ack_delay = args.ack_delay or 0.002
+    for spot_cnt in args.spots or [10000]:
+        for rate in [None, args.rate]:
+            for workers, policy in [(0, "block"), (1, "block"), (4, "block"), (4, "drop-oldest")]:
+                report("queue", spots=spot_cnt, ack_delay_ms=ack_delay * 1000,
+                       **isolated(_queue_case, spot_cnt, args.hours, ack_delay, workers, policy, 1000, rate))
+
+
+def _distinct_profiles(config, rng):
+    # Every lot gets its own occupancy table, the sample table scaled and
+    # shifted by a random amount
+    config = [dict(lot) for lot in config]
+    for lot in config:
+        scale = rng.uniform(0.5, 1.2)
+        shift = rng.randrange(24)
+        lot['occupancy'] = [min(100.0, percent_occupied_table[(hour + shift) % 24] * scale) for hour in range(24)]
+    return config
+
+
+def bench_profiles(args):
+    # Cost of a simulated minute's occupancy step with one shared occupancy
+    # table against a distinct table per lot
+    for spot_cnt in args.spots or [100000]:
+        config = scaled_config(spot_cnt)
+        for name, lot_config in [("shared", config), ("per-lot", _distinct_profiles(config, random.Random(0)))]:
+            parking = Parking(None, lot_config, percent_occupied_table, DEFAULT_START, None, seed=0)
+            minutes = int(args.hours * 60)
+            events = 0
+            start = time.perf_counter()
+            for minute in range(minutes):
+                for event in parking._simulate_spot_occupancy(DEFAULT_START + minute * 60):
+                    events += 1
+            seconds = time.perf_counter() - start
+            report("profiles", tables=name, lots=len(lot_config), spots=parking.spots_cnt, minutes=minutes,
+                   events=events, ms_per_minute=round(seconds * 1000 / max(1, minutes), 3))
+
+
+def _startup_case(path):
+    start = time.perf_counter()
+    parking = Parking(None, load_lots(path), percent_occupied_table, DEFAULT_START, None, seed=0)
+    seconds = time.perf_counter() - start
+    return dict(lots=len(parking.lots), spots=parking.spots_cnt, seconds=round(seconds, 3),
+                spots_per_s=round(parking.spots_cnt / seconds))
+
+
+def bench_startup(args):
+    # Building a Parking from a synthetic city streamed from a JSON lines
+    # file, spots_per_s should stay flat as the city grows
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "city.jsonl")
+        for spot_cnt in args.spots or [100000, 1000000]:
+            write_lots(synthetic_city(spot_cnt, seed=0), path)
+            report("startup", **isolated(_startup_case, path))
+
+
+def _report_mode_case(spot_cnt, hours, mode, report_interval):
+    # Messages and bytes of compact JSON sent for the regular reports alone
+    # and for every event, with one report mode
+    lot_reports = LotReporter(mode) if mode != "meter" else None
+    parking = Parking(None, scaled_config(spot_cnt), percent_occupied_table, DEFAULT_START, None, seed=0,
+                      report_interval=report_interval, lot_reports=lot_reports)
+    encoder = SpotEncoder("json")
+    counts = dict(report_messages=0, report_bytes=0, messages=0, bytes=0)
+    for timestamp, source, obj in parking.iter_events(hours):
+        size = len(encoder.encode(obj))
+        counts['messages'] += 1
+        counts['bytes'] += size
+        if source in ("Report", "LotReport"):
+            counts['report_messages'] += 1
+            counts['report_bytes'] += size
+    return dict(mode=mode, report_interval=report_interval, spots=parking.spots_cnt, lots=len(parking.lots),
+                hours=hours, **counts)
+
+
+def bench_report_modes(args):
+    # Broker traffic of per meter reports against per lot bitmaps and deltas,
+    # the reduction is relative to the per meter mode. Deltas only pay off
+    # when reports come often enough that few meters change in between.
+    for spot_cnt, report_interval in [(spot_cnt, report_interval) for spot_cnt in args.spots or [10000]
+                                      for report_interval in (60, 5)]:
+        baseline = None
+        for mode in REPORT_MODES:
+            result = isolated(_report_mode_case, spot_cnt, max(args.hours, 2), mode, report_interval)
+            if baseline is None:
+                baseline = result
+            result['report_bytes_saved_pcnt'] = round(
+                100.0 * (1 - result['report_bytes'] / max(1, baseline['report_bytes'])), 1)
+            result['bytes_saved_pcnt'] = round(100.0 * (1 - result['bytes'] / max(1, baseline['bytes'])), 1)
+            result['messages_saved_pcnt'] = round(
+                100.0 * (1 - result['messages'] / max(1, baseline['messages'])), 1)
+            report("report-modes", **result)
+
+
+# Command line for each sink in the cold start benchmark. The MQTT sinks use
+# the fake broker, whether the transport loads is measured on its own.
+COLD_START_SINKS = {
+    'null': ["--sink", "null"],
+    'stdout': ["--sink", "stdout"],
+    'file': ["--sink", "file:{work_dir}/events.ndjson"],
+    'mqtt-local': ["--sink", "mqtt-local://localhost", "--fake-broker", "--pace", "fast"],
+    'mqtt-aws': ["--sink", "mqtt-aws://example-ats.iot.us-east-1.amazonaws.com", "--fake-broker", "--pace", "fast"],
+}
+SDK_IMPORT = "from awscrt import io, mqtt, auth, http; from awsiot import mqtt_connection_builder"
+
+
+def _wall_seconds(command, runs):
+    # Wall time of 'command' in a fresh interpreter, 'runs' times
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_cold_start(args):
+    # Process start to exit of a short parkingspot.py run per sink, against a
+    # bare interpreter, for CI jobs that launch many short lived simulators
+    runs = 5
+    python = sys.executable
+    baseline = _wall_seconds([python, "-c", "pass"], runs)
+    report("cold-start", sink="python -c pass", runs=runs, ms_median=round(statistics.median(baseline) * 1000, 1))
+    sdk = subprocess.run([python, "-c", SDK_IMPORT], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if sdk.returncode == 0:
+        times = _wall_seconds([python, "-c", SDK_IMPORT], runs)
+        report("cold-start", sink="aws sdk import", runs=runs, ms_median=round(statistics.median(times) * 1000, 1))
+    else:
+        print("cold-start sink=aws sdk import skipped (awscrt/awsiot not installed)")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for sink, sink_args in COLD_START_SINKS.items():
+            command = [python, "parkingspot.py", "--hours", "0.1", "--timezone", "UTC"]
+            command += [arg.format(work_dir=work_dir) for arg in sink_args]
+            times = _wall_seconds(command, runs)
+            report("cold-start", sink=sink, runs=runs, ms_median=round(statistics.median(times) * 1000, 1),
+                   ms_min=round(min(times) * 1000, 1),
+                   ms_over_python=round((statistics.median(times) - statistics.median(baseline)) * 1000, 1))
+
+
+def bench_suite(args):
+    # Every benchmark, for regression tracking with --json
+    bench_walk(args)
+    bench_group_list(args)
+    bench_encode(args)
+    bench_publish(args)
+    bench_spot_memory(args)
+
+
+BENCHMARKS = {
+    'spot-memory': bench_spot_memory,
+    'group-list': bench_group_list,
+    'sinks': bench_sinks,
+    'walk': bench_walk,
+    'encode': bench_encode,
+    'publish': bench_publish,
+    'queue': bench_queue,
+    'profiles': bench_profiles,
+    'report-modes': bench_report_modes,
+    'startup': bench_startup,
+    'cold-start': bench_cold_start,
+    'suite': bench_suite,
+}
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parking simulation benchmarks.")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS), help="Benchmark to run")
+    parser.add_argument('--spots', type=_int_list,
+                        help="Comma separated spot counts, e.g. 10,1000,100000 (each benchmark has its own default)")
+    parser.add_argument('--hours', default=1, type=float, help="Simulated hours for benchmarks that run the simulation")
+    parser.add_argument('--sinks', default=sorted(WALK_SINKS), type=lambda value: value.split(","),
+                        help=f"Comma separated sinks for the walk benchmark, from {sorted(WALK_SINKS)}")
+    parser.add_argument('--events', default=200000, type=int, help="Events for the encode and publish benchmarks")
+    parser.add_argument('--ack-delay', default=0.0, type=float, help="Fake broker ack delay in seconds for publish " +
+                        "and queue")
+    parser.add_argument('--rate', default=2000.0, type=float, help="Target events per second for the paced queue runs")
+    parser.add_argument('--json', help="Append results as JSON lines to this file")
+    args = parser.parse_args()
+    for sink_name in args.sinks:
+        if sink_name not in WALK_SINKS:
+            print(f"Unknown sink {sink_name}, expected one of {sorted(WALK_SINKS)}")
+            raise ValueError(f"Unknown sink {sink_name}")
+    _json_path = args.json
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,230 @@
+# IoT Parking Meter Simulation - snapshots and resume
+# By Aussie Schnore
+#
+# Saves the state of a Parking between two simulated minutes so a long run
+# that dies can carry on from the last snapshot instead of starting over.
+# Layout:
+#
+#   header    see HEADER, includes a digest of the lots (parking_digest)
+#   random    the Parking's random state, then the state the re-report
+#             schedule was built from (the schedule is rebuilt from it)
+#   occupancy one bit per spot in spot order, see pack_bits
+#   index     the order of the occupancy index: every spot's position on
+#             its side of the index in spot order, then with per lot
+#             profiles its position on its side of its lot's index
+#
+# A snapshot is restored into a Parking built with the same parking_config
+# and start timestamp. The random picks are made from the index, so it is
+# saved and restored in its current order rather than rebuilt. Taking a
+# snapshot doesn't change the running Parking, and the resumed run sends
+# exactly the events the original run sent after the snapshot.
+# Snapshots are written to a temporary file and renamed into place, so a
+# crash while writing leaves the previous one intact.
+
+import array
+import hashlib
+import json
+import operator
+import os
+import random
+import struct
+import sys
+import time
+
+from profiles import load_numpy
+from randomgroup import report_schedule
+
+MAGIC = b"PKSNAP01"
+VERSION = 2
+# magic, version, report interval, spot count, start timestamp, next minute, config digest
+HEADER = struct.Struct("<8sIIQqQ32s")
+# random.Random state: version, 625 words, whether there is a gauss_next, gauss_next
+RNG_STATE = struct.Struct("<i625I?d")
+
+
+def parking_digest(parking):
+    # Digest of the lots a Parking was built from, their meter counts and
+    # occupancy profiles. Taken from the Parking as the config may have been
+    # streamed from a file and not kept.
+    digest = hashlib.sha256()
+    for lot, meter_count, profile in zip(parking.lots, parking.lot_meters, parking.lot_profile):
+        digest.update(json.dumps([lot.address, lot.location, meter_count, profile]).encode())
+    return digest.digest()
+
+
+# 0/1 flag bytes to and from the ASCII digits of a binary number
+_FLAG_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+_DIGIT_FLAGS = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def pack_bits(flags):
+    # bytes of 0/1 flags to a little endian bitset, 8 flags a byte
+    numpy = load_numpy()
+    if numpy is not None:
+        return numpy.packbits(numpy.frombuffer(flags, dtype=numpy.uint8), bitorder="little").tobytes()
+    if not flags:
+        return b""
+    # Flag n is bit n of one big integer
+    return int(flags.translate(_FLAG_DIGITS)[::-1], 2).to_bytes((len(flags) + 7) // 8, "little")
+
+
+def unpack_bits(packed, count):
+    # Inverse of pack_bits, 'count' flags
+    numpy = load_numpy()
+    if numpy is not None:
+        bits = numpy.unpackbits(numpy.frombuffer(packed, dtype=numpy.uint8), count=count, bitorder="little")
+        return bits.tobytes()
+    if not count:
+        return b""
+    number = int.from_bytes(packed[:(count + 7) // 8], "little")
+    return format(number, "0%db" % count).encode()[::-1][:count].translate(_DIGIT_FLAGS)
+
+
+def _pack_rng(state):
+    version, words, gauss_next = state
+    return RNG_STATE.pack(version, *words, gauss_next is not None, gauss_next or 0.0)
+
+
+def _unpack_rng(data, offset):
+    values = RNG_STATE.unpack_from(data, offset)
+    gauss_next = values[-1] if values[-2] else None
+    return (values[0], tuple(values[1:626]), gauss_next)
+
+
+def _pack_positions(spots, attr):
+    # Little endian uint32 'attr' (index_pos or lot_pos) of every spot
+    positions = array.array("I", map(operator.attrgetter(attr), spots))
+    if sys.byteorder == "big":
+        positions.byteswap()
+    return positions.tobytes()
+
+
+def _unpack_positions(data, offset, count):
+    positions = array.array("I")
+    positions.frombytes(data[offset:offset + count * positions.itemsize])
+    if sys.byteorder == "big":
+        positions.byteswap()
+    return positions
+
+
+def _restore_index(index, spots, flags, positions, pos_attr):
+    # Set the occupancy of 'spots' from 'flags' and put them back on the sides
+    # of 'index' at their saved positions
+    occupied_cnt = flags.count(1)
+    index.occupied = [None] * occupied_cnt
+    index.vacant = [None] * (len(spots) - occupied_cnt)
+    sides = (index.vacant, index.occupied)
+    for spot, flag, pos in zip(spots, flags, positions):
+        spot.isOccupied = flag == 1
+        sides[flag][pos] = spot
+        setattr(spot, pos_attr, pos)
+    return occupied_cnt
+
+
+def save_snapshot(parking, path, digest=None):
+    # Write the state of 'parking' at the start of minute parking.next_minute.
+    # 'digest' is parking_digest(parking) when already known.
+    spots = parking.spots
+    flags = bytes(map(operator.attrgetter("isOccupied"), spots))
+    header = HEADER.pack(MAGIC, VERSION, parking.report_interval, parking.spots_cnt, parking.start_timestamp,
+                         parking.next_minute, digest or parking_digest(parking))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(header)
+        out.write(_pack_rng(parking.random.getstate()))
+        out.write(_pack_rng(parking.schedule_rng_state))
+        out.write(pack_bits(flags))
+        out.write(_pack_positions(spots, "index_pos"))
+        if parking.per_lot:
+            out.write(_pack_positions(spots, "lot_pos"))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(parking, path):
+    # Restore a snapshot into 'parking', built with the same parking_config
+    # and start timestamp as the run that wrote it. Returns the minute the
+    # run resumes at.
+    with open(path, "rb") as f:
+        data = f.read()
+    (magic, version, report_interval, spots_cnt, start_timestamp, next_minute,
+     digest) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} parking snapshot")
+    if (spots_cnt != parking.spots_cnt or start_timestamp != parking.start_timestamp or
+            digest != parking_digest(parking)):
+        print(f"ERROR: {path} was taken from a run with a different parking_config or start timestamp")
+        raise ValueError(f"{path} doesn't match this Parking")
+    offset = HEADER.size
+    parking.random.setstate(_unpack_rng(data, offset))
+    offset += RNG_STATE.size
+    parking.schedule_rng_state = _unpack_rng(data, offset)
+    offset += RNG_STATE.size
+    schedule_rng = random.Random()
+    schedule_rng.setstate(parking.schedule_rng_state)
+    parking.report_interval = report_interval
+    parking.re_report_schedule_list = report_schedule(spots_cnt, report_interval, schedule_rng)
+    packed_len = (spots_cnt + 7) // 8
+    flags = unpack_bits(data[offset:offset + packed_len], spots_cnt)
+    offset += packed_len
+    spots = parking.spots
+    positions = _unpack_positions(data, offset, spots_cnt)
+    offset += len(positions) * positions.itemsize
+    _restore_index(parking.index, spots, flags, positions, "index_pos")
+    if parking.per_lot:
+        positions = _unpack_positions(data, offset, spots_cnt)
+        # Each lot's spots are built in a row
+        first = 0
+        for lot, meter_count in zip(parking.lots, parking.lot_meters):
+            last = first + meter_count
+            parking.lot_occupied[lot.lot_id] = _restore_index(lot.index, spots[first:last], flags[first:last],
+                                                              positions[first:last], "lot_pos")
+            first = last
+    parking.next_minute = next_minute
+    return next_minute
+
+
+class Checkpointer(object):
+    # Hand to Parking(checkpoint=) to snapshot every 'interval_minutes'
+    # simulated minutes and/or every 'interval_seconds' of wall clock time
+    def __init__(self, path, interval_minutes=60, interval_seconds=None, clock=time.monotonic):
+        self.path = path
+        self.interval_minutes = interval_minutes
+        self.interval_seconds = interval_seconds
+        self.clock = clock
+        self.last_minute = None
+        self.last_time = clock()
+        self.snapshots = 0
+        self.seconds = 0.0  # Time spent writing snapshots
+        self.digest = None  # The lots don't change during a run
+
+    def minute_done(self, parking):
+        # Called by Parking before each simulated minute starts
+        minute = parking.next_minute
+        if self.last_minute is None:
+            # Nothing new to save at the first minute of a run or resume
+            self.last_minute = minute
+            return
+        due = self.interval_minutes and minute - self.last_minute >= self.interval_minutes
+        if self.interval_seconds and self.clock() - self.last_time >= self.interval_seconds:
+            due = True
+        if due:
+            self.save(parking)
+
+    def save(self, parking):
+        start = time.perf_counter()
+        if self.digest is None:
+            self.digest = parking_digest(parking)
+        save_snapshot(parking, self.path, self.digest)
+        self.seconds += time.perf_counter() - start
+        self.snapshots += 1
+        self.last_minute = parking.next_minute
+        self.last_time = self.clock()
+
+    def restore(self, parking):
+        # Load the snapshot at 'path' into parking if there is one, returns
+        # the minute resumed at or None
+        if not os.path.exists(self.path):
+            return None
+        return load_snapshot(parking, self.path)
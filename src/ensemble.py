@@ -0,0 +1,365 @@
+# IoT Parking Meter Simulation - Monte Carlo ensembles
+# By Aussie Schnore
+#
+# One trace says little about capacity. run_ensemble() simulates N replicas
+# of the same parking_config and occupancy table, each with its own seed,
+# over a process pool. Replicas pull their events with iter_events(raw=True),
+# so no messages are built and nothing is paced, and keep only counters and
+# histograms in arrays allocated before the run:
+#   events in each simulated minute by source
+#   spots occupied at the start of each minute
+#   seconds each lot spends at each tenth of its occupancy
+#   the most events sent in one second
+# EnsembleStats merges the replicas as they finish and summary() gives
+# p50/p95/p99 across them: events per minute for each hour of the run, per
+# minute rates by source, the peak second and minute, and each lot's
+# occupancy.
+#
+#   python ensemble.py --replicas 200 --hours 24 --scale 10 --timezone America/Chicago
+#   python ensemble.py --config city.csv --table weekday.json --profiles profiles.json
+#
+# Replica seeds come from --seed the same way shard seeds do
+# (parky_shards.derive_seed), so the same seed gives the same tables.
+
+import argparse
+import array
+import collections
+import concurrent.futures
+import json
+import sys
+import time
+
+from lotconfig import load_lots
+from parky_events import DWELL_DISTRIBUTIONS, EventParking
+from parky_shards import derive_seed
+from parky_sim import (DEFAULT_START, EVENT_SOURCES, SECONDS_PER_MINUTE, Parking, parking_config,
+                       percent_occupied_table)
+from profiles import load_profiles, load_table
+from simtime import MilTimeConverter, parse_time
+
+ENGINES = ["minute", "event"]
+PERCENTILES = [50, 95, 99]
+# Lot occupancy histogram bins, 0-9%, 10-19%, ... 90-99% and full
+OCCUPANCY_BINS = 11
+# Sources that report a spot's state without changing it
+REPORT_SOURCES = ("Report", "LotReport")
+
+
+def _zeros(typecode, count):
+    return array.array(typecode, bytes(array.array(typecode).itemsize * count))
+
+
+def make_parking(config, table, timestamp, seed, tz=None, engine="minute", profiles=None, report_interval=60,
+                 dwell="lognormal", mean_dwell=90.0):
+    # A Parking with no connection or callback, only iter_events is used
+    if engine == "event":
+        return EventParking(None, config, table, timestamp, None, seed=seed, tz=tz, profiles=profiles,
+                            report_interval=report_interval, dwell=dwell, mean_dwell=mean_dwell)
+    if engine != "minute":
+        raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
+    return Parking(None, config, table, timestamp, None, seed=seed, tz=tz, profiles=profiles,
+                   report_interval=report_interval)
+
+
+def run_replica(replica, config, table, timestamp, hours, seed, tz=None, engine="minute", profiles=None,
+                report_interval=60, dwell="lognormal", mean_dwell=90.0):
+    # Runs in a worker process, returns the replica's counters
+    started = time.perf_counter()
+    parking = make_parking(config, table, timestamp, derive_seed(seed, replica), tz, engine, profiles,
+                           report_interval, dwell, mean_dwell)
+    minutes = int(hours * 60)
+    end = timestamp + minutes * SECONDS_PER_MINUTE
+    source_cnt = len(EVENT_SOURCES)
+    source_index = {source: position for position, source in enumerate(EVENT_SOURCES)}
+    lot_cnt = len(parking.lots)
+    lot_meters = parking.lot_meters
+    events = _zeros('q', minutes * source_cnt)  # [minute * sources + source]
+    occupied = _zeros('q', minutes)
+    lot_seconds = _zeros('d', lot_cnt * OCCUPANCY_BINS)  # [lot * bins + bin]
+    lot_occupied = _zeros('q', lot_cnt)
+    for spot in parking.index.occupied:
+        lot_occupied[spot.lot.lot_id] += 1
+    lot_since = array.array('q', [timestamp]) * lot_cnt  # When each lot last changed
+    total_occupied = sum(lot_occupied)
+    next_minute = 0
+    second = None
+    second_events = 0
+    peak_second = 0
+    event_cnt = 0
+    for event_timestamp, source, spot in parking.iter_events(hours, raw=True):
+        minute = (event_timestamp - timestamp) // SECONDS_PER_MINUTE
+        if minute >= minutes:
+            break
+        while next_minute <= minute:
+            occupied[next_minute] = total_occupied
+            next_minute += 1
+        events[minute * source_cnt + source_index[source]] += 1
+        event_cnt += 1
+        if event_timestamp != second:
+            second = event_timestamp
+            second_events = 0
+        second_events += 1
+        if second_events > peak_second:
+            peak_second = second_events
+        if source in REPORT_SOURCES:
+            continue
+        # Every other event follows a spot changing state, close the lot's
+        # time at its old occupancy
+        lot_id = spot.lot.lot_id
+        count = lot_occupied[lot_id]
+        lot_seconds[lot_id * OCCUPANCY_BINS + count * 10 // lot_meters[lot_id]] += event_timestamp - lot_since[lot_id]
+        lot_since[lot_id] = event_timestamp
+        change = 1 if spot.isOccupied else -1
+        lot_occupied[lot_id] = count + change
+        total_occupied += change
+    while next_minute < minutes:
+        occupied[next_minute] = total_occupied
+        next_minute += 1
+    for lot_id in range(lot_cnt):
+        # A lot without meters has no occupancy to bin
+        if lot_meters[lot_id]:
+            lot_seconds[lot_id * OCCUPANCY_BINS + lot_occupied[lot_id] * 10 // lot_meters[lot_id]] += (
+                end - lot_since[lot_id])
+    result = {}
+    result['replica'] = replica
+    result['spots'] = parking.spots_cnt
+    result['events'] = events
+    result['occupied'] = occupied
+    result['lot_seconds'] = lot_seconds
+    result['peak_second'] = peak_second
+    result['event_count'] = event_cnt
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def histogram_percentile(histogram, pcnt):
+    # Nearest rank percentile of the values counted in a {value: count}
+    # histogram: the value at rank round(pcnt% of (count - 1)), counting from
+    # the smallest, as publisher.bucket_percentile does for its buckets
+    total = sum(histogram.values())
+    if not total:
+        return 0
+    rank = int(round((pcnt / 100.0) * (total - 1)))
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen > rank:
+            return value
+    return value
+
+
+def _bin_percentile(bins, pcnt):
+    # Percentile occupancy (0-100, the bottom of its bin) of a lot from its
+    # time weighted histogram
+    total = sum(bins)
+    if not total:
+        return 0
+    target = (pcnt / 100.0) * total
+    seen = 0.0
+    for position, seconds in enumerate(bins):
+        seen += seconds
+        if seen >= target:
+            return position * 10
+    return (len(bins) - 1) * 10
+
+
+class EnsembleStats(object):
+    # Merged counters of all the replicas. Events per minute and occupancy are
+    # kept as {value: count} histograms for each hour of the run, so memory
+    # doesn't grow with the number of replicas.
+    def __init__(self, config, timestamp, hours, tz=None):
+        self.lots = [lot['address'] for lot in config]
+        self.lot_meters = [lot['meter_count'] for lot in config]
+        self.spots = sum(self.lot_meters)
+        self.start_timestamp = timestamp
+        self.minutes = int(hours * 60)
+        self.hour_cnt = -(-self.minutes // 60)
+        self.clock = MilTimeConverter(tz)
+        self.replicas = 0
+        self.event_count = 0
+        self.replica_seconds = 0.0
+        self.hour_events = [collections.Counter() for _ in range(self.hour_cnt)]
+        self.hour_occupied = [collections.Counter() for _ in range(self.hour_cnt)]
+        self.source_events = {source: collections.Counter() for source in EVENT_SOURCES}
+        self.source_totals = dict.fromkeys(EVENT_SOURCES, 0)
+        self.peak_minute = collections.Counter()
+        self.peak_second = collections.Counter()
+        self.lot_seconds = _zeros('d', len(self.lots) * OCCUPANCY_BINS)
+
+    def add(self, result):
+        source_cnt = len(EVENT_SOURCES)
+        events = result['events']
+        occupied = result['occupied']
+        busiest = 0
+        for minute in range(self.minutes):
+            counts = events[minute * source_cnt:(minute + 1) * source_cnt]
+            total = sum(counts)
+            busiest = max(busiest, total)
+            self.hour_events[minute // 60][total] += 1
+            self.hour_occupied[minute // 60][occupied[minute]] += 1
+            for source, count in zip(EVENT_SOURCES, counts):
+                self.source_events[source][count] += 1
+                self.source_totals[source] += count
+        self.peak_minute[busiest] += 1
+        self.peak_second[result['peak_second']] += 1
+        lot_seconds = self.lot_seconds
+        for position, seconds in enumerate(result['lot_seconds']):
+            lot_seconds[position] += seconds
+        self.replicas += 1
+        self.event_count += result['event_count']
+        self.replica_seconds += result['seconds']
+
+    @staticmethod
+    def _add_percentiles(row, prefix, histogram):
+        for pcnt in PERCENTILES:
+            row[f"{prefix}p{pcnt}"] = histogram_percentile(histogram, pcnt)
+        row[f"{prefix}max"] = max(histogram, default=0)
+
+    def hour_rows(self):
+        # Events per minute and percent of spots occupied for each hour
+        rows = []
+        for hour in range(self.hour_cnt):
+            row = {}
+            row['hour'] = hour
+            row['local_time'] = f"{self.clock.mil_time(self.start_timestamp + hour * 3600):04d}"
+            self._add_percentiles(row, "events_", self.hour_events[hour])
+            for pcnt in PERCENTILES:
+                value = histogram_percentile(self.hour_occupied[hour], pcnt)
+                row[f"occupied_pct_p{pcnt}"] = round(100.0 * value / max(1, self.spots), 1)
+            rows.append(row)
+        return rows
+
+    def source_rows(self):
+        # Events per minute of each source that sent any
+        rows = []
+        for source in EVENT_SOURCES:
+            if not self.source_totals[source]:
+                continue
+            row = {}
+            row['source'] = source
+            row['mean_per_replica'] = round(self.source_totals[source] / max(1, self.replicas))
+            self._add_percentiles(row, "", self.source_events[source])
+            rows.append(row)
+        return rows
+
+    def burst_rows(self):
+        # The most events of each replica in one minute and in one second
+        rows = []
+        for name, histogram in [("minute", self.peak_minute), ("second", self.peak_second)]:
+            row = {}
+            row['peak_per'] = name
+            self._add_percentiles(row, "", histogram)
+            rows.append(row)
+        return rows
+
+    def lot_rows(self):
+        # Occupancy percentiles of each lot with meters over the run and all
+        # replicas, to the 10% bin
+        rows = []
+        for lot_id, address in enumerate(self.lots):
+            if not self.lot_meters[lot_id]:
+                continue
+            bins = self.lot_seconds[lot_id * OCCUPANCY_BINS:(lot_id + 1) * OCCUPANCY_BINS]
+            row = {}
+            row['lot'] = lot_id
+            row['address'] = address
+            row['meters'] = self.lot_meters[lot_id]
+            for pcnt in PERCENTILES:
+                row[f"occupied_pct_p{pcnt}"] = _bin_percentile(bins, pcnt)
+            row['full_pct'] = round(100.0 * bins[-1] / max(1.0, sum(bins)), 1)
+            rows.append(row)
+        return rows
+
+    def summary(self):
+        result = {}
+        result['replicas'] = self.replicas
+        result['spots'] = self.spots
+        result['lots'] = len(self.lots)
+        result['minutes'] = self.minutes
+        result['events'] = self.event_count
+        result['hours'] = self.hour_rows()
+        result['sources'] = self.source_rows()
+        result['bursts'] = self.burst_rows()
+        result['lot_occupancy'] = self.lot_rows()
+        return result
+
+
+def format_table(rows, out=sys.stdout):
+    # Rows of dicts with the same keys as an aligned text table
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[position]) for line in cells)) for position, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)), file=out)
+    for line in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(line, widths)), file=out)
+
+
+def run_ensemble(config, table, timestamp, hours, replicas, seed=0, processes=None, tz=None, engine="minute",
+                 profiles=None, report_interval=60, dwell="lognormal", mean_dwell=90.0):
+    # Simulate 'replicas' seeded runs of 'config' over a process pool and
+    # return their merged EnsembleStats. 'config' must be a list, it is sent
+    # to every worker.
+    config = list(config)
+    stats = EnsembleStats(config, timestamp, hours, tz)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(run_replica, replica, config, table, timestamp, hours, seed, tz, engine, profiles,
+                               report_interval, dwell, mean_dwell)
+                   for replica in range(replicas)]
+        for future in concurrent.futures.as_completed(futures):
+            stats.add(future.result())
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many seeded replicas of the parking simulation and print " +
+                                                 "percentile tables of their events and occupancy.")
+    parser.add_argument('--replicas', default=100, type=int, help="Number of seeded runs")
+    parser.add_argument('--processes', default=None, type=int, help="Worker processes (defaults to the core count)")
+    parser.add_argument('--hours', default=24, type=float, help="Number of hours to simulate")
+    parser.add_argument('--start', default=str(DEFAULT_START), help="When the runs start, an epoch timestamp or " +
+                        "a local date/time like 2019-10-14T17:00")
+    parser.add_argument('--seed', default=0, type=int, help="Ensemble seed, replica seeds are derived from it")
+    parser.add_argument('--scale', default=1, type=int, help="Repeat the sample parking_config this many times")
+    parser.add_argument('--config', help="Lots from a .jsonl/.csv file (optionally .gz) instead of the sample")
+    parser.add_argument('--table', help="Occupancy table JSON file, 24 hourly percentages or a weekday/weekend " +
+                        "mapping, instead of percent_occupied_table")
+    parser.add_argument('--profiles', help="JSON file of named occupancy tables, {name: table}, for lots with " +
+                        "a profile")
+    parser.add_argument('--timezone', help="Time zone of the simulated city, defaults to the host's zone")
+    parser.add_argument('--engine', choices=ENGINES, default="minute", help="Minute stepped or discrete event engine")
+    parser.add_argument('--dwell', choices=DWELL_DISTRIBUTIONS, default="lognormal",
+                        help="Dwell time distribution of the event engine")
+    parser.add_argument('--mean-dwell', default=90.0, type=float, help="Mean dwell minutes of the event engine")
+    parser.add_argument('--report-interval', default=60, type=int, help="Minutes between a meter's regular reports")
+    parser.add_argument('--lots', default=10, type=int, help="Show the N lots most often full")
+    parser.add_argument('--json', help="Also write the full summary, every lot included, to this JSON file")
+    args = parser.parse_args()
+
+    config = list(load_lots(args.config)) if args.config else parking_config * args.scale
+    table = load_table(args.table) if args.table else percent_occupied_table
+    profiles = load_profiles(args.profiles) if args.profiles else None
+    timestamp = parse_time(args.start, args.timezone)
+    started = time.time()
+    stats = run_ensemble(config, table, timestamp, args.hours, args.replicas, args.seed, args.processes,
+                         args.timezone, args.engine, profiles=profiles, report_interval=args.report_interval,
+                         dwell=args.dwell, mean_dwell=args.mean_dwell)
+    seconds = time.time() - started
+    summary = stats.summary()
+
+    print(f"{stats.replicas} replicas of {stats.spots} spots in {len(stats.lots)} lots, {args.hours} hours each, "
+          f"{stats.event_count} events in {seconds:.2f}s ({stats.event_count / max(seconds, 1e-9):.0f} events/s)")
+    print("\nEvents per minute and spots occupied, by hour of the run")
+    format_table(summary['hours'])
+    print("\nEvents per minute by source")
+    format_table(summary['sources'])
+    print("\nPeak events per replica")
+    format_table(summary['bursts'])
+    if args.lots > 0:
+        print("\nLots most often full (occupancy to the 10% bin)")
+        busiest = sorted(summary['lot_occupancy'], key=lambda row: (-row['full_pct'], -row['occupied_pct_p95']))
+        format_table(busiest[:args.lots])
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(summary, out)
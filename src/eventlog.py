@@ -0,0 +1,166 @@
+# IoT Parking Meter Simulation - binary event log and replay
+# By Aussie Schnore
+#
+# Records a run as fixed width binary records so the exact same traffic can be
+# replayed later without re-running the simulation. Layout:
+#
+#   header   64 bytes, see HEADER
+#   records  record_count x RECORD (timestamp, spot id, isOccupied, source code)
+#   dictionary  JSON with the lots, the (lot, meter number) of each spot id
+#               and the source names, written at the end once every spot
+#               seen is known
+#
+# Replay memory maps the file and walks the records in place, encoding each
+# message straight to bytes from a per spot template.
+
+import json
+import mmap
+import struct
+
+from encoder import SpotEncoder
+from parky_sim import EVENT_SOURCES
+
+MAGIC = b"PKEVLOG1"
+VERSION = 1
+# magic, version, record size, record count, records offset, dictionary offset, dictionary length
+HEADER = struct.Struct("<8sIIQQQQ")
+HEADER_SIZE = 64
+# timestamp, spot id, isOccupied, source code (padded to 16 bytes)
+RECORD = struct.Struct("<qIBB2x")
+
+
+class EventLogWriter(object):
+    # A sink (see sinks.py) writing raw (timestamp, source, spot) events
+    def __init__(self, path, chunk_events=65536):
+        self.out = open(path, "wb")
+        self.out.write(b"\0" * HEADER_SIZE)
+        self.chunk_events = chunk_events
+        self.records = []
+        self.events = 0
+        # Spot ids and lot indexes are handed out in the order first seen
+        self.spot_ids = {}
+        self.spot_table = []
+        self.lot_ids = {}
+        self.lot_table = []
+        self.source_codes = {source: code for code, source in enumerate(EVENT_SOURCES)}
+
+    def _spot_id(self, spot):
+        lot = spot.lot
+        lot_index = self.lot_ids.get(lot)
+        if lot_index is None:
+            lot_index = self.lot_ids[lot] = len(self.lot_table)
+            self.lot_table.append([lot.address, lot.location])
+        spot_id = self.spot_ids[spot] = len(self.spot_table)
+        self.spot_table.append([lot_index, spot.number])
+        return spot_id
+
+    def write(self, timestamp, source, spot):
+        spot_id = self.spot_ids.get(spot)
+        if spot_id is None:
+            spot_id = self._spot_id(spot)
+        self.records.append(RECORD.pack(timestamp, spot_id, spot.isOccupied, self.source_codes[source]))
+        if len(self.records) >= self.chunk_events:
+            self.flush()
+
+    def flush(self):
+        if self.records:
+            self.out.write(b"".join(self.records))
+            self.events += len(self.records)
+            self.records = []
+
+    def close(self):
+        self.flush()
+        dictionary = {}
+        dictionary['lots'] = self.lot_table
+        dictionary['spots'] = self.spot_table
+        dictionary['sources'] = EVENT_SOURCES
+        dictionary_json = json.dumps(dictionary, separators=(',', ':')).encode()
+        dictionary_offset = self.out.tell()
+        self.out.write(dictionary_json)
+        self.out.seek(0)
+        self.out.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.events, HEADER_SIZE,
+                                   dictionary_offset, len(dictionary_json)))
+        self.out.close()
+
+
+class EventLogReader(object):
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, record_size, self.record_count, self.records_offset,
+         dictionary_offset, dictionary_len) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} parking event log")
+        dictionary = json.loads(self.map[dictionary_offset:dictionary_offset + dictionary_len])
+        self.lots = dictionary['lots']
+        self.spots = dictionary['spots']
+        self.sources = dictionary['sources']
+
+    def records(self):
+        # (timestamp, spot id, isOccupied, source code) straight off the map
+        end = self.records_offset + self.record_count * RECORD.size
+        view = memoryview(self.map)[self.records_offset:end]
+        try:
+            yield from RECORD.iter_unpack(view)
+        finally:
+            view.release()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def log_parking_config(path):
+    # The lots recorded in a log, in parking_config form
+    reader = EventLogReader(path)
+    try:
+        config = [{'address': address, 'location': location, 'meter_count': 0}
+                  for address, location in reader.lots]
+        for lot_index, number in reader.spots:
+            config[lot_index]['meter_count'] += 1
+    finally:
+        reader.close()
+    return config
+
+
+# Turns log records into encoded messages, building each lot's fragment the
+# first time one of its spots comes up
+class LogEncoder(object):
+    def __init__(self, reader, encoder=None):
+        self.reader = reader
+        self.encoder = encoder or SpotEncoder("auto")
+        self.fragments = [None] * len(reader.lots)
+
+    def encode(self, timestamp, spot_id, isOccupied):
+        lot_index, number = self.reader.spots[spot_id]
+        fragment = self.fragments[lot_index]
+        if fragment is None:
+            address, location = self.reader.lots[lot_index]
+            fragment = self.fragments[lot_index] = self.encoder.lot_fragment(location, address)
+        return self.encoder.encode_meter(timestamp, isOccupied, number, fragment)
+
+    def address(self, spot_id):
+        return self.reader.lots[self.reader.spots[spot_id][0]][0]
+
+
+def replay(path, publisher, pacer=None, encoder=None):
+    # Publish every event in the log through 'publisher' (publisher.py), paced
+    # by 'pacer' (pacing.py), e.g. RealTimePacer(speed) for N x real time.
+    # Returns the number of events sent.
+    reader = EventLogReader(path)
+    log_encoder = LogEncoder(reader, encoder)
+    records = reader.records()
+    events = 0
+    try:
+        for timestamp, spot_id, isOccupied, source_code in records:
+            if pacer is not None:
+                pacer.wait(timestamp)
+            publisher.publish_encoded(log_encoder.encode(timestamp, spot_id, isOccupied),
+                                      log_encoder.address(spot_id))
+            events += 1
+    finally:
+        # Let go of the view on the map before closing it
+        records.close()
+        reader.close()
+    return events
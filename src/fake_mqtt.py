@@ -0,0 +1,94 @@
+# IoT Parking Meter Simulation - in-process MQTT broker stand-in
+# By Aussie Schnore
+#
+# Mimics the parts of the awscrt mqtt.Connection interface the simulation
+# uses (connect, publish, disconnect) so the publishing code can be run and
+# load tested without a broker or AWS credentials. Each publish is acked
+# 'ack_delay' seconds after it was sent, however many are in flight, like
+# PUBACKs coming back from a real broker, so pipelining and sharding over
+# connections show up as they would against one.
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+
+# Shared by all connections made in the process, holds what was published
+class FakeBroker(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+        self.by_client = {}
+
+    def receive(self, client_id, topic, payload):
+        with self.lock:
+            self.messages += 1
+            self.bytes += len(payload)
+            self.by_client[client_id] = self.by_client.get(client_id, 0) + 1
+
+
+class FakeMqttConnection(object):
+    def __init__(self, broker, client_id, ack_delay=0.0):
+        self.broker = broker
+        self.client_id = client_id
+        self.ack_delay = ack_delay
+        self.packet_id = 0
+        self.lock = threading.Lock()  # Publishes may come from several threads
+        self.connected = False
+        # (due time, future, packet id) of the publishes not acked yet. The
+        # delay is fixed, so they fall due in the order they were sent and
+        # one thread can ack them all on time.
+        self.pending = collections.deque()
+        self.pending_added = threading.Condition(self.lock)
+        self.acker = None
+
+    def _done(self, result):
+        future = concurrent.futures.Future()
+        future.set_result(result)
+        return future
+
+    def connect(self):
+        self.connected = True
+        if self.acker is None:
+            self.acker = threading.Thread(target=self._ack_loop, daemon=True)
+            self.acker.start()
+        return self._done({'session_present': False})
+
+    def _ack_loop(self):
+        # Acks each pending publish once it falls due, until disconnected and
+        # every publish is acked
+        while True:
+            with self.pending_added:
+                while not self.pending and self.connected:
+                    self.pending_added.wait()
+                if not self.pending:
+                    return
+                due, future, packet_id = self.pending.popleft()
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            future.set_result({'packet_id': packet_id})
+
+    def publish(self, topic, payload, qos, retain=False):
+        if not self.connected:
+            raise RuntimeError(f"{self.client_id} is not connected")
+        self.broker.receive(self.client_id, topic, payload)
+        future = concurrent.futures.Future()
+        with self.pending_added:
+            self.packet_id += 1
+            packet_id = self.packet_id
+            self.pending.append((time.monotonic() + self.ack_delay, future, packet_id))
+            self.pending_added.notify()
+        return future, packet_id
+
+    def disconnect(self):
+        # Acks whatever is still pending before returning
+        with self.pending_added:
+            self.connected = False
+            self.pending_added.notify()
+        if self.acker is not None:
+            self.acker.join()
+            self.acker = None
+        return self._done({})
@@ -0,0 +1,180 @@
+# IoT Parking Meter Simulation - lot config files and synthetic cities
+# By Aussie Schnore
+#
+# parking_config in parky_sim.py is a small hand written sample. For large
+# fleets the lots can come from a file instead, read one lot at a time so the
+# whole config never has to sit in memory as dicts:
+#   .jsonl / .ndjson  one parking_config style lot object per line
+#   .csv              address,latitude,longitude,meter_count[,profile]
+# with an optional .gz on either. Parking reads its parking_config once, so
+# the iterators here can be handed to it directly.
+#
+# synthetic_city() generates a repeatable city of any size: lot sizes follow
+# a chosen distribution and lots are scattered around a centre point, dense
+# downtown and thinning out toward the edge.
+#
+#   python lotconfig.py --meters 1000000 --seed 1 --out city.jsonl.gz
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import math
+import random
+
+SIZE_DISTRIBUTIONS = ["lognormal", "uniform", "fixed"]
+CONFIG_FORMATS = ["jsonl", "csv"]
+
+# Downtown Chicago, the default centre of a synthetic city
+CITY_CENTER = (41.8781, -87.6298)
+KM_PER_DEGREE = 111.32
+
+STREET_NAMES = ["Main", "Oak", "Pine", "Maple", "Cedar", "Elm", "Washington", "Lake", "Hill", "Park",
+                "Walnut", "Spring", "Ridge", "Church", "Willow", "Mill", "River", "Market", "Grand", "State",
+                "Madison", "Jackson", "Franklin", "Jefferson", "Lincoln", "Adams", "Monroe", "Clark", "Wells", "Union"]
+STREET_SUFFIXES = ["Street", "Avenue", "Boulevard", "Road", "Lane", "Drive", "Court", "Place", "Way", "Terrace"]
+
+
+def _open_text(path, mode="r"):
+    if path.lower().endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, mode + "b"), encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def config_format(path):
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".jsonl") or name.endswith(".ndjson"):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    raise ValueError(f"Can't tell the config format of {path}, expected one of {CONFIG_FORMATS}")
+
+
+def iter_jsonl(path):
+    with _open_text(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            lot = json.loads(line)
+            if 'address' not in lot or 'meter_count' not in lot:
+                print(f"ERROR: {path} line {line_number} needs an address and a meter_count")
+                raise ValueError(f"Bad lot on line {line_number} of {path}")
+            lot.setdefault('location', ["0", "0"])
+            yield lot
+
+
+def iter_csv(path):
+    with _open_text(path) as f:
+        for line_number, row in enumerate(csv.DictReader(f), 2):
+            try:
+                lot = {}
+                lot['address'] = row['address']
+                lot['location'] = [row['latitude'], row['longitude']]
+                lot['meter_count'] = int(row['meter_count'])
+            except (KeyError, TypeError, ValueError):
+                print(f"ERROR: {path} line {line_number} needs address, latitude, longitude and meter_count")
+                raise ValueError(f"Bad lot on line {line_number} of {path}")
+            if row.get('profile'):
+                lot['profile'] = row['profile']
+            yield lot
+
+
+def load_lots(path):
+    # Lots from a config file, lazily
+    if config_format(path) == "csv":
+        return iter_csv(path)
+    return iter_jsonl(path)
+
+
+def write_lots(lots, path):
+    # Stream lots to a config file, returns (lots, meters) written
+    lot_cnt = 0
+    meter_cnt = 0
+    with _open_text(path, "w") as out:
+        if config_format(path) == "csv":
+            writer = csv.writer(out)
+            writer.writerow(["address", "latitude", "longitude", "meter_count", "profile"])
+            for lot in lots:
+                writer.writerow([lot['address'], lot['location'][0], lot['location'][1], lot['meter_count'],
+                                 lot.get('profile', "")])
+                lot_cnt += 1
+                meter_cnt += lot['meter_count']
+        else:
+            for lot in lots:
+                out.write(json.dumps(lot) + "\n")
+                lot_cnt += 1
+                meter_cnt += lot['meter_count']
+    return lot_cnt, meter_cnt
+
+
+def lot_sizes(lots):
+    # Just the address and meter count of each lot, what partition_lots and
+    # ShardedPublisher need
+    return [{'address': lot['address'], 'meter_count': lot['meter_count']} for lot in lots]
+
+
+def _size_sampler(rng, distribution, mean_size, sigma):
+    if mean_size < 1:
+        raise ValueError(f"mean_size must be at least 1, got {mean_size}")
+    if distribution == "lognormal":
+        mu = math.log(mean_size) - sigma * sigma / 2
+        return lambda: max(1, int(round(rng.lognormvariate(mu, sigma))))
+    if distribution == "uniform":
+        top = max(1, int(round(2 * mean_size)) - 1)
+        return lambda: rng.randint(1, top)
+    if distribution == "fixed":
+        size = max(1, int(round(mean_size)))
+        return lambda: size
+    raise ValueError(f"Unknown lot size distribution {distribution}, expected one of {SIZE_DISTRIBUTIONS}")
+
+
+def synthetic_city(meters, seed=0, size_distribution="lognormal", mean_size=12.0, size_sigma=0.9,
+                   center=CITY_CENTER, radius_km=10.0, profiles=None):
+    # Lazily yields lots totalling exactly 'meters' meters. The same arguments
+    # always give the same city. 'profiles' is an optional {name: weight}
+    # mapping to tag lots with occupancy profile names, see profiles.py.
+    rng = random.Random(seed)
+    lot_size = _size_sampler(rng, size_distribution, mean_size, size_sigma)
+    center_lat, center_lon = center
+    km_per_lon_degree = KM_PER_DEGREE * math.cos(math.radians(center_lat))
+    profile_names = list(profiles) if profiles else None
+    profile_weights = list(profiles.values()) if profiles else None
+    remaining = meters
+    lot_number = 0
+    while remaining > 0:
+        meter_count = min(lot_size(), remaining)
+        remaining -= meter_count
+        # Half normal distance from the centre, most lots downtown
+        distance = min(abs(rng.gauss(0.0, radius_km / 2)), radius_km)
+        bearing = rng.uniform(0.0, 2 * math.pi)
+        lat = center_lat + distance * math.cos(bearing) / KM_PER_DEGREE
+        lon = center_lon + distance * math.sin(bearing) / km_per_lon_degree
+        lot_number += 1
+        street = f"{rng.choice(STREET_NAMES)} {rng.choice(STREET_SUFFIXES)}"
+        lot = {}
+        lot['address'] = f"{rng.randint(1, 99999)} {street}, Lot {lot_number}, XYZ, AB"
+        lot['location'] = [f"{lat:.4f}", f"{lon:.4f}"]
+        lot['meter_count'] = meter_count
+        if profile_names:
+            lot['profile'] = rng.choices(profile_names, profile_weights)[0]
+        yield lot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic city's lots to a config file.")
+    parser.add_argument('--meters', default=1000000, type=int, help="Total meters in the city")
+    parser.add_argument('--seed', default=0, type=int, help="Same seed, same city")
+    parser.add_argument('--sizes', choices=SIZE_DISTRIBUTIONS, default="lognormal", help="Lot size distribution")
+    parser.add_argument('--mean-size', default=12.0, type=float, help="Mean meters per lot")
+    parser.add_argument('--radius', default=10.0, type=float, help="City radius in km")
+    parser.add_argument('--center', default=f"{CITY_CENTER[0]},{CITY_CENTER[1]}", help="City centre as lat,lon")
+    parser.add_argument('--out', required=True, help="Config file to write (.jsonl or .csv, optionally .gz)")
+    args = parser.parse_args()
+
+    center = tuple(float(value) for value in args.center.split(","))
+    lots = synthetic_city(args.meters, args.seed, args.sizes, args.mean_size, center=center, radius_km=args.radius)
+    lot_cnt, meter_cnt = write_lots(lots, args.out)
+    print(f"Wrote {lot_cnt} lots with {meter_cnt} meters to {args.out}")
@@ -0,0 +1,124 @@
+# IoT Parking Meter Simulation - lot level status reports
+# By Aussie Schnore
+#
+# By default every meter sends its own Report event once per report interval,
+# each one repeating the lot's address and location. With a LotReporter
+# (Parking(lot_reports=)) the regular reports are sent per lot instead, one
+# message per lot per interval, with a "LotReport" source:
+#
+#   lot    {"timestamp": 1571005498, "address": "...", "meters": 12,
+#           "occupied": 5, "bitmap": "kQI="}
+#   delta  as lot but with a "seq" number, and "changed" (the meter numbers
+#          that flipped since report seq - 1) in place of "bitmap" except on
+#          the first report of a lot, every keyframe_every reports and
+#          whenever the full bitmap would be shorter
+#
+# "bitmap" is the base64 of the occupancy of meters 1..meters, one bit per
+# meter, least significant bit first (checkpoint.pack_bits). Grow, Shrink and
+# Swap events are still sent per meter. Lot ids spread the lots over the
+# minutes of the interval, lot n reports at the minutes where
+# local minute % report_interval == n % report_interval.
+#
+# The delta state isn't part of a snapshot, a resumed run starts every lot
+# again with a full bitmap.
+
+import base64
+
+from checkpoint import pack_bits
+
+REPORT_MODES = ["meter", "lot", "delta"]
+
+
+class LotStatus(object):
+    # Payload of a LotReport event, in place of the Spot of meter events
+    __slots__ = ('lot', 'meters', 'occupied', 'bitmap', 'changed', 'seq')
+
+    def __init__(self, lot, meters, occupied, bitmap=None, changed=None, seq=None):
+        self.lot = lot
+        self.meters = meters
+        self.occupied = occupied
+        self.bitmap = bitmap  # Packed occupancy bits, None for a delta
+        self.changed = changed  # Meter numbers flipped since the last report
+        self.seq = seq  # Report number of the lot, delta mode only
+
+    @property
+    def address(self):
+        return self.lot.address
+
+    def produce(self, timestamp):
+        result = {}
+        result['timestamp'] = timestamp
+        result['address'] = self.lot.address
+        result['meters'] = self.meters
+        result['occupied'] = self.occupied
+        if self.seq is not None:
+            result['seq'] = self.seq
+        if self.bitmap is not None:
+            result['bitmap'] = base64.b64encode(self.bitmap).decode()
+        else:
+            result['changed'] = self.changed
+        return result
+
+
+def _changed_numbers(bits):
+    # Meter numbers of the set bits of 'bits', bit 0 being meter 1
+    numbers = []
+    while bits:
+        low = bits & -bits
+        numbers.append(low.bit_length())
+        bits ^= low
+    return numbers
+
+
+class LotReporter(object):
+    def __init__(self, mode="lot", keyframe_every=24):
+        if mode not in REPORT_MODES or mode == "meter":
+            raise ValueError(f"Unknown lot report mode {mode}, expected lot or delta")
+        if keyframe_every < 1:
+            raise ValueError(f"keyframe_every must be at least 1, got {keyframe_every}")
+        self.mode = mode
+        self.keyframe_every = keyframe_every
+        self.schedule = None  # Lot ids reporting at each minute of the interval
+        self.first_spot = None  # Position in Parking.spots of each lot's meter 1
+        self.last_bits = {}  # lot id: occupancy bits of its last report, delta mode
+        self.seq = {}  # lot id: number of its last report, delta mode
+
+    def _setup(self, parking):
+        self.schedule = [[] for _ in range(parking.report_interval)]
+        self.first_spot = []
+        first = 0
+        for lot_id, meter_count in enumerate(parking.lot_meters):
+            self.schedule[lot_id % parking.report_interval].append(lot_id)
+            self.first_spot.append(first)
+            first += meter_count
+
+    def reports(self, parking, timestamp):
+        # Yields (timestamp, "LotReport", LotStatus) for the lots reporting in
+        # the minute at 'timestamp'
+        if self.schedule is None:
+            self._setup(parking)
+        slot = parking.clock.local_minute(timestamp) % parking.report_interval
+        for lot_id in self.schedule[slot]:
+            yield timestamp, "LotReport", self.status(parking, lot_id)
+
+    def status(self, parking, lot_id):
+        meters = parking.lot_meters[lot_id]
+        first = self.first_spot[lot_id]
+        flags = bytes(spot.isOccupied for spot in parking.spots[first:first + meters])
+        bitmap = pack_bits(flags)
+        occupied = sum(flags)
+        lot = parking.lots[lot_id]
+        if self.mode == "lot":
+            return LotStatus(lot, meters, occupied, bitmap)
+        bits = int.from_bytes(bitmap, "little")
+        last = self.last_bits.get(lot_id)
+        seq = self.seq.get(lot_id, -1) + 1
+        self.last_bits[lot_id] = bits
+        self.seq[lot_id] = seq
+        if last is None or seq % self.keyframe_every == 0:
+            return LotStatus(lot, meters, occupied, bitmap, seq=seq)
+        changed = _changed_numbers(bits ^ last)
+        # Send the bitmap when it is no longer than the list of changes
+        if 4 * -(-len(bitmap) // 3) <= sum(len(str(number)) + 1 for number in changed):
+            return LotStatus(lot, meters, occupied, bitmap, seq=seq)
+        return LotStatus(lot, meters, occupied, changed=changed, seq=seq)
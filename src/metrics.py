@@ -0,0 +1,209 @@
+# IoT Parking Meter Simulation - run metrics
+# By Aussie Schnore
+#
+# Optional instrumentation for long runs. Pass a SimMetrics to Parking
+# (metrics=) and walk_through_sim times each phase of the minute loop, counts
+# events by source, times the callback (the publish) and tracks how far
+# simulated time is ahead of or behind the wall clock. Every 'interval'
+# seconds a JSON stats line is written and the Prometheus text is refreshed,
+# in a file (for the node exporter textfile collector) and/or over HTTP.
+# Without a SimMetrics the simulation takes its plain, uninstrumented path.
+
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+
+from parky_sim import EVENT_SOURCES
+from publisher import ACK_BUCKETS, bucket_percentile
+
+PHASES = ["occupancy", "re_report", "swaps", "callback"]
+# Upper bounds in seconds of the callback latency histogram
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+
+
+class SimMetrics(object):
+    def __init__(self, interval=10.0, stats_out=sys.stderr, prom_path=None, publisher=None, speed=None,
+                 clock=time.perf_counter):
+        self.interval = interval  # Seconds between reports, 0 only reports at the end
+        self.stats_out = stats_out  # Where the JSON stats lines go, None for nowhere
+        self.prom_path = prom_path
+        self.publisher = publisher  # publisher.*Publisher for ack latency and queue depth
+        self.speed = speed  # Target multiple of real time, enables lag_seconds
+        self.clock = clock
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.events = dict.fromkeys(EVENT_SOURCES, 0)
+        self.event_total = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sim_start = None
+        self.sim_now = None
+        self.wall_start = None
+        self.next_report = None
+        self.acks_seen = {}  # id(publisher): its ack histogram at the last report
+        self.prom_text = ""
+        self.server = None
+
+    def timed_phase(self, phase, simulate):
+        # Wrap a _simulate_* generator function so the time spent producing
+        # its events, but not handling them, is added to 'phase'
+        clock = self.clock
+        phase_seconds = self.phase_seconds
+
+        def timed(timestamp):
+            elapsed = 0.0
+            start = clock()
+            try:
+                for event in simulate(timestamp):
+                    elapsed += clock() - start
+                    yield event
+                    start = clock()
+                elapsed += clock() - start
+            finally:
+                phase_seconds[phase] += elapsed
+        return timed
+
+    def start(self, timestamp):
+        self.sim_start = self.sim_now = timestamp
+        self.wall_start = self.clock()
+        if self.interval > 0:
+            self.next_report = self.wall_start + self.interval
+
+    def event(self, source, timestamp, callback_seconds):
+        # Called by walk_through_sim after each callback
+        self.events[source] = self.events.get(source, 0) + 1
+        self.event_total += 1
+        self.sim_now = timestamp
+        self.phase_seconds['callback'] += callback_seconds
+        self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, callback_seconds)] += 1
+        if self.next_report is not None and self.clock() >= self.next_report:
+            self.report()
+            self.next_report += self.interval
+
+    def _publishers(self):
+        if self.publisher is None:
+            return []
+        return getattr(self.publisher, 'publishers', [self.publisher])
+
+    def _ack_stats(self):
+        # Ack latency of the publishes acked since the last report, the
+        # difference between the histograms now and then
+        counts = [0] * (len(ACK_BUCKETS) + 1)
+        result = {}
+        for publisher in self._publishers():
+            now = publisher.ack_latency.snapshot()
+            seen = self.acks_seen.get(id(publisher), [0] * len(now))
+            self.acks_seen[id(publisher)] = now
+            for position, (count, before) in enumerate(zip(now, seen)):
+                counts[position] += count - before
+        result['acks'] = sum(counts)
+        result['ack_ms_p50'] = round(bucket_percentile(counts, 50) * 1000, 2)
+        result['ack_ms_p99'] = round(bucket_percentile(counts, 99) * 1000, 2)
+        result['in_flight'] = sum(len(publisher.in_flight) for publisher in self._publishers())
+        result['failures'] = sum(publisher.failures for publisher in self._publishers())
+        if hasattr(self.publisher, 'queue_depth'):
+            # publisher.QueuedPublisher
+            result['queue_depth'] = self.publisher.queue_depth()
+            result['dropped'] = self.publisher.dropped()
+        return result
+
+    def snapshot(self):
+        wall_elapsed = self.clock() - self.wall_start if self.wall_start is not None else 0.0
+        sim_elapsed = self.sim_now - self.sim_start if self.sim_start is not None else 0
+        result = {}
+        result['events'] = self.event_total
+        result['by_source'] = dict(self.events)
+        result['wall_seconds'] = round(wall_elapsed, 3)
+        result['sim_seconds'] = sim_elapsed
+        result['events_per_sec'] = round(self.event_total / wall_elapsed, 1) if wall_elapsed > 0 else 0.0
+        result['sim_speed'] = round(sim_elapsed / wall_elapsed, 2) if wall_elapsed > 0 else 0.0
+        if self.speed:
+            # Positive when the run has fallen behind the target speed
+            result['lag_seconds'] = round(wall_elapsed - sim_elapsed / self.speed, 3)
+        result['phase_seconds'] = {phase: round(seconds, 3) for phase, seconds in self.phase_seconds.items()}
+        if self.publisher is not None:
+            result['publish'] = self._ack_stats()
+        return result
+
+    def prometheus_text(self, snapshot):
+        lines = []
+        lines.append("# TYPE parky_events_total counter")
+        for source, count in self.events.items():
+            lines.append(f'parky_events_total{{source="{source}"}} {count}')
+        lines.append("# TYPE parky_phase_seconds_total counter")
+        for phase, seconds in self.phase_seconds.items():
+            lines.append(f'parky_phase_seconds_total{{phase="{phase}"}} {seconds:.6f}')
+        lines.append("# TYPE parky_callback_seconds histogram")
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_counts):
+            cumulative += count
+            lines.append(f'parky_callback_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'parky_callback_seconds_bucket{{le="+Inf"}} {self.event_total}')
+        lines.append(f"parky_callback_seconds_sum {self.phase_seconds['callback']:.6f}")
+        lines.append(f"parky_callback_seconds_count {self.event_total}")
+        lines.append("# TYPE parky_sim_seconds gauge")
+        lines.append(f"parky_sim_seconds {snapshot['sim_seconds']}")
+        lines.append("# TYPE parky_wall_seconds gauge")
+        lines.append(f"parky_wall_seconds {snapshot['wall_seconds']}")
+        if 'lag_seconds' in snapshot:
+            lines.append("# TYPE parky_lag_seconds gauge")
+            lines.append(f"parky_lag_seconds {snapshot['lag_seconds']}")
+        if 'publish' in snapshot:
+            publish = snapshot['publish']
+            lines.append("# TYPE parky_publish_in_flight gauge")
+            lines.append(f"parky_publish_in_flight {publish['in_flight']}")
+            lines.append("# TYPE parky_publish_failures_total counter")
+            lines.append(f"parky_publish_failures_total {publish['failures']}")
+            # Percentiles of the acks since the last report, plain gauges as
+            # a summary's quantiles would need a running sum and count
+            lines.append("# TYPE parky_publish_ack_ms_p50 gauge")
+            lines.append(f"parky_publish_ack_ms_p50 {publish['ack_ms_p50']}")
+            lines.append("# TYPE parky_publish_ack_ms_p99 gauge")
+            lines.append(f"parky_publish_ack_ms_p99 {publish['ack_ms_p99']}")
+            if 'queue_depth' in publish:
+                lines.append("# TYPE parky_publish_queue_depth gauge")
+                lines.append(f"parky_publish_queue_depth {publish['queue_depth']}")
+                lines.append("# TYPE parky_publish_dropped_total counter")
+                lines.append(f"parky_publish_dropped_total {publish['dropped']}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        snapshot = self.snapshot()
+        if self.stats_out is not None:
+            self.stats_out.write(json.dumps(snapshot) + "\n")
+            self.stats_out.flush()
+        self.prom_text = self.prometheus_text(snapshot)
+        if self.prom_path:
+            # Write then rename so a scrape never sees half a file
+            tmp_path = self.prom_path + ".tmp"
+            with open(tmp_path, "w") as out:
+                out.write(self.prom_text)
+            os.replace(tmp_path, self.prom_path)
+        return snapshot
+
+    def finish(self):
+        # Final report once the walk is done
+        return self.report()
+
+    def serve(self, port, host=""):
+        # Serve the latest Prometheus text at http://host:port/metrics from a
+        # daemon thread
+        import http.server
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prom_text.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
@@ -0,0 +1,94 @@
+# IoT Parking Meter Simulation - event pacing
+# By Aussie Schnore
+#
+# A pacer decides how long to hold each event before it is handed to the
+# callback. The simulation calls wait(timestamp) with the simulated epoch
+# timestamp of the event about to be sent.
+
+import time
+
+
+# Send events as fast as the callback can take them
+class NoPacing(object):
+    def wait(self, timestamp):
+        pass
+
+
+# Fixed sleep between events, the original behaviour of the simulation
+class FixedPause(object):
+    def __init__(self, pause=0.01):
+        self.pause = pause
+
+    def wait(self, timestamp):
+        if self.pause > 0:
+            time.sleep(self.pause)
+
+
+# Replay simulated time against the wall clock at 'speed' times real time.
+# Each event is held until its simulated timestamp comes due, so quiet
+# periods are slept through and bursts go out together.
+class RealTimePacer(object):
+    def __init__(self, speed=1.0, clock=time.monotonic, sleep=time.sleep):
+        if speed <= 0:
+            raise ValueError(f"speed must be greater than 0, got {speed}")
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        self.sim_start = None
+        self.wall_start = None
+
+    def wait(self, timestamp):
+        if self.sim_start is None:
+            # First event anchors simulated time to the wall clock
+            self.sim_start = timestamp
+            self.wall_start = self.clock()
+            return
+        due = self.wall_start + (timestamp - self.sim_start) / self.speed
+        delay = due - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+
+# Token bucket limiting the send rate to 'rate' events per second with
+# bursts of up to 'burst' events
+class TokenBucketPacer(object):
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError(f"rate must be greater than 0, got {rate}")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.last = None
+
+    def wait(self, timestamp):
+        now = self.clock()
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            # Sleep just long enough for the next token
+            delay = (1 - self.tokens) / self.rate
+            self.sleep(delay)
+            # Credit the whole time slept, sleep can run over
+            after = self.clock()
+            self.tokens = min(self.burst, self.tokens + (after - now) * self.rate)
+            self.last = after
+        self.tokens -= 1
+
+
+PACE_MODES = ["fixed", "fast", "realtime", "rate"]
+
+
+def make_pacer(mode, pause=0.01, speed=1.0, rate=100.0, burst=1):
+    # Build a pacer from command line style options
+    if mode == "fixed":
+        return FixedPause(pause)
+    if mode == "fast":
+        return NoPacing()
+    if mode == "realtime":
+        return RealTimePacer(speed)
+    if mode == "rate":
+        return TokenBucketPacer(rate, burst)
+    raise ValueError(f"Unknown pace mode {mode}, expected one of {PACE_MODES}")
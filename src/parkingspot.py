@@ -4,8 +4,6 @@
 # By Aussie Schnore
 
 import argparse
-from awscrt import io, mqtt, auth, http
-from awsiot import mqtt_connection_builder
 import sys
 import threading
 import time
@@ -13,15 +11,31 @@ from uuid import uuid4
 import json
 
 # Import parking spots simulation
-from parky_sim import Parking, parking_config, percent_occupied_table
+from parky_sim import (DEFAULT_START, SECONDS_PER_HOUR, Parking, parking_config, percent_occupied_table,
+                       partition_lots)
+from pacing import PACE_MODES, make_pacer
+from publisher import QUEUE_POLICIES, MqttPublisher, QueuedPublisher, ShardedPublisher
+from encoder import BACKENDS, SpotEncoder
+from sinks import MQTT_SINKS, SINK_KINDS, make_sink, parse_sink, run_to_sink
+from eventlog import log_parking_config, replay
+from metrics import SimMetrics
+from checkpoint import Checkpointer
+from parky_events import DWELL_DISTRIBUTIONS, EventParking
+from simtime import parse_time
+from lotconfig import SIZE_DISTRIBUTIONS, load_lots, lot_sizes, synthetic_city
+from lotreport import REPORT_MODES, LotReporter
+from transports import (DEFAULT_PORTS, LOG_LEVELS, aws_connections, fake_connections, local_connections,
+                        qos_at_least_once)
 
 # This simualtion of the traffic a group of IoT Parking meters might produce
 # uses the Message Broker for AWS IoT to send messages
 # through an MQTT connection. On startup, the device connects to the server,
 # and begins publishing messages to that topic.
+# The events can instead go to any of the sinks in sinks.py (--sink). The
+# AWS SDK is only loaded for the MQTT sinks, see transports.py.
 
 parser = argparse.ArgumentParser(description="Send and receive messages through and MQTT connection.")
-parser.add_argument('--endpoint', required=True, help="Your AWS IoT custom endpoint, not including a port. " +
+parser.add_argument('--endpoint', help="Your AWS IoT custom endpoint, not including a port. " +
                                                       "Ex: \"abcd123456wxyz-ats.iot.us-east-1.amazonaws.com\"")
 parser.add_argument('--port', type=int, help="Specify port. AWS IoT supports 443 and 8883.")
 parser.add_argument('--cert', help="File path to your client certificate, in PEM format.")
@@ -33,6 +47,9 @@ parser.add_argument('--client-id', default="test-" + str(uuid4()), help="Client
 parser.add_argument('--topic', default="test/topic", help="Topic publish messages to.")
 parser.add_argument('--hours', default=10, type=float, help="Number of hours to simulate (10 hours default)" +
                                                           "Specify 0 to 24 simulate hours")
+parser.add_argument('--start', default=str(DEFAULT_START), help="When the simulation starts, an epoch " +
+    "timestamp or a local date/time like 2019-10-14T17:00. It starts straight at that time's occupancy.")
+parser.add_argument('--end', help="When the simulation ends, same forms as --start, instead of --hours")
 parser.add_argument('--use-websocket', default=False, action='store_true',
     help="To use a websocket instead of raw mqtt. If you " +
     "specify this option you must specify a region for signing.")
@@ -40,94 +57,242 @@ parser.add_argument('--signing-region', default='us-east-1', help="If you specif
     "is the region that will be used for computing the Sigv4 signature")
 parser.add_argument('--proxy-host', help="Hostname of proxy to connect to.")
 parser.add_argument('--proxy-port', type=int, default=8080, help="Port of proxy to connect to.")
-parser.add_argument('--verbosity', choices=[x.name for x in io.LogLevel], default=io.LogLevel.NoLogs.name,
-    help='Logging level')
+parser.add_argument('--timezone', help="Time zone the simulated city is in, e.g. America/Chicago. " +
+    "Defaults to the host's local zone")
+parser.add_argument('--report-interval', default=60, type=int, help="Minutes between the regular status " +
+    "report each meter sends")
+parser.add_argument('--config', help="Read the lots from this .jsonl or .csv file (optionally .gz) instead " +
+    "of the built in parking_config, see lotconfig.py")
+parser.add_argument('--synthetic-meters', type=int, help="Simulate a generated city with this many meters " +
+    "instead of the built in parking_config")
+parser.add_argument('--city-seed', default=0, type=int, help="Seed of the generated city with --synthetic-meters")
+parser.add_argument('--city-sizes', choices=SIZE_DISTRIBUTIONS, default="lognormal", help="Lot size " +
+    "distribution of the generated city")
+parser.add_argument('--report-mode', choices=REPORT_MODES, default="meter", help="Regular status reports: " +
+    "one message per meter, one occupancy bitmap message per lot, or per lot deltas against the last report")
+parser.add_argument('--keyframe-every', default=24, type=int, help="With --report-mode delta, send the full " +
+    "bitmap every this many reports of a lot")
+parser.add_argument('--engine', choices=["minute", "event"], default="minute", help="Simulation engine: " +
+    "the original minute by minute Grow/Shrink/Swap model, or discrete events with per car dwell times")
+parser.add_argument('--dwell', choices=DWELL_DISTRIBUTIONS, default="lognormal", help="Dwell time distribution " +
+    "with --engine event")
+parser.add_argument('--mean-dwell', default=90.0, type=float, help="Mean minutes a car stays with --engine event")
+parser.add_argument('--checkpoint', help="Snapshot the simulation state to this file as the run goes " +
+    "(minute engine only)")
+parser.add_argument('--checkpoint-minutes', default=60, type=int, help="Simulated minutes between snapshots")
+parser.add_argument('--resume', default=False, action='store_true', help="Carry on from the --checkpoint " +
+    "snapshot if there is one instead of starting from the beginning")
+parser.add_argument('--pace', choices=PACE_MODES, default="fixed", help="How events are paced: fixed pause " +
+    "between events (original behaviour), fast as possible, realtime replay of simulated time, or a rate limit")
+parser.add_argument('--pause', default=0.01, type=float, help="Seconds to sleep between events with --pace fixed")
+parser.add_argument('--speed', default=1.0, type=float, help="Multiple of real time to replay at with --pace realtime")
+parser.add_argument('--rate', default=100.0, type=float, help="Events per second with --pace rate")
+parser.add_argument('--window', default=100, type=int, help="Maximum number of publishes waiting on a PUBACK " +
+    "before the simulation is held back")
+parser.add_argument('--batch', default=1, type=int, help="Pack up to this many events into one message " +
+    "(sent as a JSON array when greater than 1)")
+parser.add_argument('--batch-bytes', default=128 * 1024, type=int, help="Maximum payload size of a batched message")
+parser.add_argument('--linger', default=0.0, type=float, help="Seconds a partly filled batch may wait for more events")
+parser.add_argument('--encoder', choices=BACKENDS, default="auto", help="Message encoding: compact JSON " +
+    "through orjson when installed (auto), the json module, orjson, or msgpack")
+parser.add_argument('--sink', help="Where the events go: stdout[:csv], null, file:<path> (e.g. " +
+    "file:events.ndjson.gz, file:events.csv.zst or file:events.parquet), mqtt-aws://<endpoint>[:port] or " +
+    "mqtt-local://<host>[:port] for a plain MQTT broker. Defaults to mqtt-aws with --endpoint. " +
+    f"One of {SINK_KINDS}")
+parser.add_argument('--replay', help="Publish the events recorded in this event log (.evlog, see --sink) " +
+    "instead of running the simulation. Paced by --pace, e.g. --pace realtime --speed 60")
+parser.add_argument('--connections', default=1, type=int, help="Number of MQTT client connections to spread " +
+    "the parking lots over. Each uses its own client ID, <client-id>-<n>")
+parser.add_argument('--publish-workers', default=0, type=int, help="Publish from this many worker threads fed " +
+    "through bounded queues so slow publishes don't stall the simulation (0 publishes inline)")
+parser.add_argument('--queue-size', default=10000, type=int, help="Events the publish queues hold in total")
+parser.add_argument('--queue-policy', choices=QUEUE_POLICIES, default="block", help="What to do when a publish " +
+    "queue is full: wait for room or drop the oldest waiting event")
+parser.add_argument('--fake-broker', default=False, action='store_true', help="Publish to an in-process broker " +
+    "stand-in instead of AWS IoT, no endpoint or credentials needed")
+parser.add_argument('--fake-ack-delay', default=0.0, type=float, help="Seconds the in-process broker takes to ack")
+parser.add_argument('--stats-interval', default=0.0, type=float, help="Print a JSON stats line (phase times, " +
+    "events by source, lag behind simulated time, publish latency) to stderr every this many seconds")
+parser.add_argument('--metrics-file', help="Keep the run metrics in this file in Prometheus text format")
+parser.add_argument('--metrics-port', type=int, help="Serve the run metrics in Prometheus text format on " +
+    "this port at /metrics")
+parser.add_argument('--verbosity', choices=LOG_LEVELS, default="NoLogs", help='Logging level of the AWS SDK')
 
-# Using globals to simplify sample code
-args = parser.parse_args()
 
-io.init_logging(getattr(io.LogLevel, args.verbosity), 'stderr')
-
-
-# Callback when connection is accidentally lost.
-def on_connection_interrupted(connection, error, **kwargs):
-    print("Connection interrupted. error: {}".format(error))
+def parse_args(argv=None):
+    args = parser.parse_args(argv)
+    if args.sink:
+        try:
+            args.sink_kind, args.sink_target = parse_sink(args.sink)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.endpoint:
+        args.sink_kind, args.sink_target = "mqtt-aws", (args.endpoint, args.port)
+    elif args.fake_broker:
+        args.sink_kind, args.sink_target = "mqtt-local", None
+    else:
+        parser.error("Say where the events go with --sink (e.g. --sink stdout, --sink file:events.csv or " +
+                     "--sink mqtt-aws://<endpoint>), --endpoint or --fake-broker")
+    if args.connections < 1:
+        parser.error("--connections must be at least 1")
+    if args.publish_workers < 0:
+        parser.error("--publish-workers can't be negative")
+    if args.checkpoint and args.engine != "minute":
+        parser.error("--checkpoint only works with --engine minute")
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint")
+    if args.report_mode != "meter" and (args.engine != "minute" or args.sink_kind not in MQTT_SINKS):
+        parser.error("--report-mode lot and delta only work with --engine minute, publishing over MQTT")
+    if args.replay and args.sink_kind not in MQTT_SINKS:
+        parser.error("--replay publishes over MQTT, use an mqtt sink, --endpoint or --fake-broker")
+    if args.config and args.synthetic_meters:
+        parser.error("--config and --synthetic-meters can't be used together")
+    return args
 
 
 # Call back to publish parking spot mqtt messages
-def parking_callback(mqtt_connection, obj, ml_hours, source):
+def parking_callback(publisher, obj, ml_hours, source):
     print("Send message", ml_hours)
-    message_json = json.dumps(obj)
-    mqtt_connection.publish(
-        topic=args.topic,
-        payload=message_json,
-        qos=mqtt.QoS.AT_LEAST_ONCE)
+    publisher.publish(obj)
+
+
+# The lots to simulate, streamed from --config or generated with
+# --synthetic-meters. A fresh iterator on every call, Parking only reads it once.
+def lot_source():
+    if args.config:
+        return load_lots(args.config)
+    if args.synthetic_meters:
+        return synthetic_city(args.synthetic_meters, args.city_seed, args.city_sizes)
+    return parking_config
+
+
+# Build the simulation with the engine picked on the command line
+def make_parking(conn, ext_callback, pacer=None, metrics=None):
+    if args.engine == "event":
+        return EventParking(conn, lot_source(), percent_occupied_table, timestamp, ext_callback, pacer=pacer,
+                            tz=args.timezone, report_interval=args.report_interval, metrics=metrics,
+                            dwell=args.dwell, mean_dwell=args.mean_dwell)
+    checkpoint = Checkpointer(args.checkpoint, args.checkpoint_minutes) if args.checkpoint else None
+    lot_reports = LotReporter(args.report_mode, args.keyframe_every) if args.report_mode != "meter" else None
+    parking = Parking(conn, lot_source(), percent_occupied_table, timestamp, ext_callback, pacer=pacer,
+                      tz=args.timezone, report_interval=args.report_interval, metrics=metrics, checkpoint=checkpoint,
+                      lot_reports=lot_reports)
+    if args.resume:
+        minute = checkpoint.restore(parking)
+        if minute is None:
+            print("No snapshot at {}, starting from the beginning".format(args.checkpoint))
+        else:
+            print("Resuming from {} at simulated minute {}".format(args.checkpoint, minute))
+    return parking
+
+
+# Connections for the MQTT sink picked on the command line, only loading
+# the transport it needs
+def make_connections(client_ids):
+    if args.fake_broker:
+        return fake_connections(client_ids, args.fake_ack_delay)
+    host, port = args.sink_target
+    if args.sink_kind == "mqtt-local":
+        return local_connections(host, port or DEFAULT_PORTS["mqtt-local"], client_ids, args.verbosity)
+    return aws_connections(host, port or args.port, client_ids, cert=args.cert, key=args.key, root_ca=args.root_ca,
+                           use_websocket=args.use_websocket, signing_region=args.signing_region,
+                           proxy_host=args.proxy_host, proxy_port=args.proxy_port, verbosity=args.verbosity)
 
 
 if __name__ == '__main__':
-    # Spin up resources
-    event_loop_group = io.EventLoopGroup(1)
-    host_resolver = io.DefaultHostResolver(event_loop_group)
-    client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
-
-    proxy_options = None
-    if (args.proxy_host):
-        proxy_options = http.HttpProxyOptions(host_name=args.proxy_host, port=args.proxy_port)
-
-    if args.use_websocket == True:
-        credentials_provider = auth.AwsCredentialsProvider.new_default_chain(client_bootstrap)
-        mqtt_connection = mqtt_connection_builder.websockets_with_default_aws_signing(
-            endpoint=args.endpoint,
-            client_bootstrap=client_bootstrap,
-            region=args.signing_region,
-            credentials_provider=credentials_provider,
-            http_proxy_options=proxy_options,
-            ca_filepath=args.root_ca,
-            on_connection_interrupted=on_connection_interrupted,
-            client_id=args.client_id,
-            clean_session=False,
-            keep_alive_secs=30)
+    # Using globals to simplify sample code
+    args = parse_args()
+
+    # Time for simulation to start, and with --end how long it runs
+    timestamp = parse_time(args.start, args.timezone)
+    if args.end:
+        args.hours = (parse_time(args.end, args.timezone) - timestamp) / SECONDS_PER_HOUR
+        if args.hours <= 0:
+            parser.error("--end must be after --start")
+
+    if args.sink_kind not in MQTT_SINKS:
+        # Straight to the sink, no MQTT connection or pacing
+        parking = make_parking(None, None)
+        events, seconds = run_to_sink(parking, args.hours or 24, make_sink(args.sink))
+        # Keep stdout for the events when they are going there
+        print("Wrote {} events to {} in {:.2f}s ({:.0f} events/s)".format(events, args.sink, seconds,
+                                                                        events / max(seconds, 1e-9)),
+              file=sys.stderr if args.sink_kind == "stdout" else sys.stdout)
+        sys.exit(0)
+
+    if args.connections == 1:
+        client_ids = [args.client_id]
     else:
-        mqtt_connection = mqtt_connection_builder.mtls_from_path(
-            endpoint=args.endpoint,
-            port=args.port,
-            cert_filepath=args.cert,
-            pri_key_filepath=args.key,
-            client_bootstrap=client_bootstrap,
-            ca_filepath=args.root_ca,
-            on_connection_interrupted=on_connection_interrupted,
-            client_id=args.client_id,
-            clean_session=False,
-            keep_alive_secs=30,
-            http_proxy_options=proxy_options)
-
-    print("Connecting to {} with client ID '{}'...".format(
-        args.endpoint, args.client_id))
-
-    connect_future = mqtt_connection.connect()
+        client_ids = ["{}-{}".format(args.client_id, n) for n in range(args.connections)]
+
+    mqtt_connections = make_connections(client_ids)
+
+    print("Connecting to {} with client ID(s) '{}'...".format(
+        "fake broker" if args.fake_broker else args.sink_target[0], "', '".join(client_ids)))
+
+    connect_futures = [mqtt_connection.connect() for mqtt_connection in mqtt_connections]
 
     # Future.result() waits until a result is available
-    connect_future.result()
+    for connect_future in connect_futures:
+        connect_future.result()
     print("Connected!")
 
-    # Time for simulation to start
-    timestamp = 1571005498
-
     # Instance simulation, pass in mqtt_connection and register callback
-    parking = Parking(mqtt_connection, parking_config, percent_occupied_table, timestamp, parking_callback)
+    # One publisher per connection, or per worker thread spread over the
+    # connections
+    publisher_connections = mqtt_connections
+    if args.publish_workers:
+        publisher_connections = [mqtt_connections[n % len(mqtt_connections)] for n in range(args.publish_workers)]
+    qos = qos_at_least_once(fake=args.fake_broker)
+    publishers = [MqttPublisher(mqtt_connection, args.topic, qos, window=args.window,
+                                batch_size=args.batch, batch_bytes=args.batch_bytes, linger=args.linger,
+                                encoder=SpotEncoder(args.encoder))
+                  for mqtt_connection in publisher_connections]
+    if len(publishers) == 1 and not args.publish_workers:
+        publisher = publishers[0]
+    else:
+        # Shard the lots that will actually be sent
+        shard_config = log_parking_config(args.replay) if args.replay else lot_sizes(lot_source())
+        lot_shard = partition_lots(shard_config, len(publishers))
+        if args.publish_workers:
+            publisher = QueuedPublisher(publishers, shard_config, lot_shard, args.queue_size, args.queue_policy)
+        else:
+            publisher = ShardedPublisher(publishers, shard_config, lot_shard)
 
-    if args.hours == 0.0:
-        print ("Simulating parking for fictional 24 hours")
-        hours_to_simulate = 24
+    pacer = make_pacer(args.pace, pause=args.pause, speed=args.speed, rate=args.rate)
+    if args.replay:
+        print ("Replaying {}".format(args.replay))
+        events = replay(args.replay, publisher, pacer, SpotEncoder(args.encoder))
+        print ("Replay of {} events done.".format(events))
     else:
-        print ("Simulating parking for fictional {} hours".format(args.hours))
-        hours_to_simulate = args.hours
-    
-    parking.walk_through_sim(hours_to_simulate)
+        metrics = None
+        if args.stats_interval > 0 or args.metrics_file or args.metrics_port:
+            metrics = SimMetrics(interval=args.stats_interval or 10.0,
+                                 stats_out=sys.stderr if args.stats_interval > 0 else None,
+                                 prom_path=args.metrics_file, publisher=publisher,
+                                 speed=args.speed if args.pace == "realtime" else None)
+            if args.metrics_port:
+                metrics.serve(args.metrics_port)
+        parking = make_parking(publisher, parking_callback, pacer, metrics)
+
+        if args.hours == 0.0:
+            print ("Simulating parking for fictional 24 hours")
+            hours_to_simulate = 24
+        else:
+            print ("Simulating parking for fictional {} hours".format(args.hours))
+            hours_to_simulate = args.hours
 
-    print ("Simulation of parking done.")
+        try:
+            parking.walk_through_sim(hours_to_simulate)
+            print ("Simulation of parking done.")
+        except KeyboardInterrupt:
+            print ("Simulation interrupted, sending what was queued.")
+    # Wait for queued and outstanding publishes before disconnecting
+    publisher.close()
+    print("Publish stats: {}".format(json.dumps(publisher.stats())))
     # Disconnect
     print("Disconnecting...")
-    disconnect_future = mqtt_connection.disconnect()
-    disconnect_future.result()
+    disconnect_futures = [mqtt_connection.disconnect() for mqtt_connection in mqtt_connections]
+    for disconnect_future in disconnect_futures:
+        disconnect_future.result()
     print("Disconnected!")
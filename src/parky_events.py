@@ -0,0 +1,221 @@
+# IoT Parking Meter Simulation - discrete event engine
+# By Aussie Schnore
+#
+# Alternate engine that simulates cars instead of ticking every minute. Cars
+# arrive as a Poisson process whose rate follows percent_occupied_table, take
+# a random vacant spot and stay for a dwell time drawn from a distribution.
+# Departures, the next arrival and the regular reports wait in one heap keyed
+# by timestamp, so the work done is proportional to the number of events, not
+# spots x minutes, and quiet overnight stretches cost next to nothing.
+# Timestamps have one second resolution.
+#
+# The arrival rate is fitted to the table with Little's law: keeping N * p(t)
+# spots occupied with a mean dwell of D takes N * p(t) / D arrivals a minute,
+# plus N * p'(t) while the curve is rising. When the curve falls faster than
+# cars leave on their own the occupancy trails it until departures catch up.
+# With per lot profiles (see profiles.py) every profile gets its own arrivals,
+# fitted to the meters following it, and its cars park in those lots only.
+#
+# EventParking is a drop in alternative to Parking: the same constructor plus
+# the dwell options, the same callback, iter_events and walk_through_sim. It
+# sends Arrive, Depart and Report events instead of Grow/Shrink/Swap.
+
+import heapq
+import math
+
+from parky_sim import Parking, SECONDS_PER_HOUR, SECONDS_PER_MINUTE
+
+DWELL_DISTRIBUTIONS = ["lognormal", "exponential", "fixed"]
+
+# Heap entries are (timestamp, sequence, what) with 'what' the Spot leaving,
+# the profile number of the next arrival or REPORT_TICK. The sequence number
+# breaks ties in the order entries were pushed, so the order of a run is fixed
+# by its seed.
+REPORT_TICK = "report"
+
+
+def make_dwell(rng, distribution="lognormal", mean_minutes=90.0, sigma=0.8):
+    # Function returning dwell times in seconds, drawn from 'rng'. 'sigma' is
+    # the spread of the lognormal, the mean is 'mean_minutes' for all three.
+    if mean_minutes <= 0:
+        raise ValueError(f"mean_minutes must be greater than 0, got {mean_minutes}")
+    mean_seconds = mean_minutes * SECONDS_PER_MINUTE
+    if distribution == "lognormal":
+        mu = math.log(mean_seconds) - sigma * sigma / 2
+        return lambda: rng.lognormvariate(mu, sigma)
+    if distribution == "exponential":
+        return lambda: rng.expovariate(1.0 / mean_seconds)
+    if distribution == "fixed":
+        return lambda: mean_seconds
+    raise ValueError(f"Unknown dwell distribution {distribution}, expected one of {DWELL_DISTRIBUTIONS}")
+
+
+def make_residual(rng, distribution="lognormal", mean_minutes=90.0, sigma=0.8):
+    # Function returning the seconds left for a car already parked when the
+    # run starts. Long stays are more likely to be under way at any given
+    # moment, so the car's whole stay is drawn length biased (for a lognormal
+    # that is mu + sigma^2) and a uniform part of it is left. A warm start at
+    # any time then looks like the middle of a run, not a fresh lot.
+    make_dwell(rng, distribution, mean_minutes, sigma)  # Same checks
+    mean_seconds = mean_minutes * SECONDS_PER_MINUTE
+    if distribution == "lognormal":
+        mu = math.log(mean_seconds) + sigma * sigma / 2
+        return lambda: rng.lognormvariate(mu, sigma) * rng.random()
+    if distribution == "exponential":
+        # Memoryless, what is left has the same distribution
+        return lambda: rng.expovariate(1.0 / mean_seconds)
+    return lambda: mean_seconds * rng.random()
+
+
+class EventParking(Parking):
+    def __init__(self, conn, parking_config, percent_occupied_table, timestamp, ext_callback, seed=None, pacer=None,
+                 tz=None, report_interval=60, metrics=None, profiles=None, dwell="lognormal", mean_dwell=90.0,
+                 dwell_sigma=0.8):
+        super(EventParking, self).__init__(conn, parking_config, percent_occupied_table, timestamp, ext_callback,
+                                           seed=seed, pacer=pacer, tz=tz, report_interval=report_interval,
+                                           metrics=metrics, profiles=profiles)
+        self.mean_dwell = mean_dwell  # Minutes
+        self.dwell = make_dwell(self.random, dwell, mean_dwell, dwell_sigma)
+        self.residual_dwell = make_residual(self.random, dwell, mean_dwell, dwell_sigma)
+        self._make_arrival_rates()
+
+    def _make_arrival_rates(self):
+        # Arrivals per second for every profile and every local minute of the
+        # weekday and the weekend day, each fitted to the meters following it
+        profile_spots = [0] * len(self.profiles)
+        for lot_id, profile in enumerate(self.lot_profile):
+            profile_spots[profile] += self.lot_meters[lot_id]
+        self.arrival_rate = []
+        for profile, spots_cnt in zip(self.profiles, profile_spots):
+            curves = []
+            for curve in profile.curves:
+                pcnt = [pcnt_occupied / 100.0 for pcnt_occupied in curve]
+                rates = []
+                for minute in range(1440):
+                    # Change in the occupied fraction per minute, centred
+                    slope = (pcnt[(minute + 1) % 1440] - pcnt[minute - 1]) / 2
+                    per_minute = spots_cnt * (pcnt[minute] / self.mean_dwell + slope)
+                    rates.append(max(0.0, per_minute) / SECONDS_PER_MINUTE)
+                curves.append(rates)
+            self.arrival_rate.append(curves)
+
+    def _make_vacant_lists(self):
+        # Vacant spots each profile's cars can take. With one profile that is
+        # the Parking wide index, otherwise a swap-remove list per profile
+        # built when the run starts, from then on only arrivals and
+        # departures change the occupancy.
+        if not self.per_lot:
+            self.profile_vacant = [self.index.vacant]
+            return
+        self.profile_vacant = [[] for _ in self.profiles]
+        self.vacant_pos = {}
+        for spot in self.spots:
+            if not spot.isOccupied:
+                self._add_vacant(spot)
+
+    def _add_vacant(self, spot):
+        vacant = self.profile_vacant[self.lot_profile[spot.lot.lot_id]]
+        self.vacant_pos[spot] = len(vacant)
+        vacant.append(spot)
+
+    def _take_vacant(self, profile):
+        # Occupies a random vacant spot of 'profile', None when all are taken
+        vacant = self.profile_vacant[profile]
+        if not vacant:
+            return None
+        spot = self.random.choice(vacant)
+        if self.per_lot:
+            pos = self.vacant_pos.pop(spot)
+            last = vacant.pop()
+            if last is not spot:
+                vacant[pos] = last
+                self.vacant_pos[last] = pos
+        spot.occupy()
+        return spot
+
+    def _next_arrival(self, after, end, profile=0):
+        # Time of the next arrival of 'profile' after 'after' by inverting the
+        # cumulative rate one minute at a time, None if it falls at or past 'end'
+        need = self.random.expovariate(1.0)
+        arrival_rate = self.arrival_rate[profile]
+        timestamp = after
+        while timestamp < end:
+            minute_end = (math.floor(timestamp / SECONDS_PER_MINUTE) + 1) * SECONDS_PER_MINUTE
+            rate = arrival_rate[self.clock.is_weekend(timestamp)][self.clock.minute_of_day(timestamp)]
+            expected = rate * (minute_end - timestamp)
+            if expected >= need:
+                return timestamp + need / rate
+            need -= expected
+            timestamp = minute_end
+        return None
+
+    def _report_group(self, minute_start):
+        # Spots reporting in the minute starting at 'minute_start'
+        slot = self.clock.local_minute(minute_start) % self.report_interval
+        return self.re_report_schedule_list[slot]
+
+    def _iter_spot_events(self, hours_to_simulate):
+        # Yields (timestamp, source, spot) in timestamp order, right after the
+        # spot changes, like Parking._iter_spot_events
+        start = self.start_timestamp
+        end = start + int(hours_to_simulate * SECONDS_PER_HOUR)
+        self._make_vacant_lists()
+        # Cars already parked at the start are part way through their stay
+        heap = [(start + max(1, int(self.residual_dwell())), seq, spot)
+                for seq, spot in enumerate(self.index.occupied)]
+        heapq.heapify(heap)
+        seq = len(heap)
+        # Next arrival of every profile, kept unrounded for the one after
+        arrival_at = []
+        for profile in range(len(self.profiles)):
+            arrival_at.append(self._next_arrival(start, end, profile))
+            if arrival_at[profile] is not None:
+                heapq.heappush(heap, (int(arrival_at[profile]), seq, profile))
+                seq += 1
+        report_minute = start
+        report_group = self._report_group(report_minute)
+        report_position = 0
+        heapq.heappush(heap, (start, seq, REPORT_TICK))
+        seq += 1
+        while heap and heap[0][0] < end:
+            timestamp, _, what = heapq.heappop(heap)
+            if what.__class__ is int:
+                arrival_at[what] = self._next_arrival(arrival_at[what], end, what)
+                if arrival_at[what] is not None:
+                    heapq.heappush(heap, (int(arrival_at[what]), seq, what))
+                    seq += 1
+                # A car that finds every spot taken drives on
+                spot = self._take_vacant(what)
+                if spot is not None:
+                    departure = timestamp + max(1, int(round(self.dwell())))
+                    heapq.heappush(heap, (departure, seq, spot))
+                    seq += 1
+                    yield timestamp, "Arrive", spot
+            elif what is REPORT_TICK:
+                # Send the reports due by this second, the spots of a minute's
+                # group are spread evenly over its 60 seconds
+                group_len = len(report_group)
+                while (report_position < group_len and
+                       report_minute + report_position * SECONDS_PER_MINUTE // group_len <= timestamp):
+                    spot = self.spots[report_group[report_position]]
+                    report_position += 1
+                    yield timestamp, "Report", spot
+                if report_position < group_len:
+                    next_report = report_minute + report_position * SECONDS_PER_MINUTE // group_len
+                else:
+                    # On to the next minute with spots reporting
+                    report_minute += SECONDS_PER_MINUTE
+                    report_group = self._report_group(report_minute)
+                    while not report_group and report_minute < end:
+                        report_minute += SECONDS_PER_MINUTE
+                        report_group = self._report_group(report_minute)
+                    report_position = 0
+                    next_report = report_minute
+                if next_report < end:
+                    heapq.heappush(heap, (next_report, seq, REPORT_TICK))
+                    seq += 1
+            else:
+                what.empty()
+                if self.per_lot:
+                    self._add_vacant(what)
+                yield timestamp, "Depart", what
@@ -0,0 +1,232 @@
+# IoT Parking Meter Simulation - vectorized engine
+# By Aussie Schnore
+#
+# Alternate engine for very large parking systems. Instead of one Spot object
+# per meter the spot state is held as a struct of NumPy arrays (lot id, meter
+# number, occupancy) and each simulated minute is worked out as a handful of
+# batched mask/choice operations. The Grow/Shrink/Report/Swap rules are the
+# same as Parking in parky_sim.py and the callback gets the same messages.
+#
+# The random picks are drawn from a random.Random in the same order as
+# Parking, out of occupied/vacant lists of spot indexes kept with the same
+# swap-remove as OccupancyIndex. random.sample only picks by position, so for
+# the same seed (and a single occupancy table) both engines send exactly the
+# same events. The spot state, reports and messages are worked out on arrays.
+
+import math
+import random
+import time
+
+import numpy as np
+
+from parky_sim import DEFAULT_START, SECONDS_PER_MINUTE, SWAP_LIMIT
+from profiles import OccupancyProfile
+from randomgroup import report_schedule
+from simtime import MilTimeConverter
+
+# Sources, in the order the events of a minute are produced
+GROW = "Grow"
+SHRINK = "Shrink"
+REPORT = "Report"
+SWAP = "Swap"
+
+
+class NumpyParking(object):
+    def __init__(self, conn, parking_config, percent_occupied_table, timestamp, ext_callback, seed=None, pacer=None, tz=None,
+                 report_interval=60):
+        self.conn = conn  # meant to hold the mqtt_connect and to feed it to callback
+        self.percent_occupied_table = percent_occupied_table
+        self.start_timestamp = timestamp
+        self.report_interval = report_interval  # Minutes between regular spot reports
+        self.ext_callback = ext_callback
+        # Local time for the simulation, tz=None uses the host's zone
+        self.clock = MilTimeConverter(tz)
+        # Private random source, the same stream Parking draws from
+        self.random = random.Random(seed)
+        self.pause = 0.01  # Sets the time.sleep value between call_backs
+        self.pacer = pacer  # pacing.* object, when set it replaces the fixed pause
+        self._make_spots(parking_config)
+        self._make_minute_table()
+        self._populate()
+        self._re_report_schedule()
+
+    def timestamp_to_local_mil_time(self, timestamp):
+        # given an epoch timestamp convert to local 24 hour time
+        return self.clock.mil_time(timestamp)
+
+    def _make_spots(self, parking_config):
+        # Lot records are kept once, spots only hold the lot id and meter number
+        self.lot_address = []
+        self.lot_location = []
+        lot_ids = []
+        numbers = []
+        for lot_id, lot in enumerate(parking_config):
+            self.lot_address.append(lot['address'])
+            self.lot_location.append(lot['location'])
+            meter_count = lot['meter_count']
+            lot_ids.append(np.full(meter_count, lot_id, dtype=np.int32))
+            numbers.append(np.arange(1, meter_count + 1, dtype=np.int32))
+        self.lot_id = np.concatenate(lot_ids) if lot_ids else np.zeros(0, dtype=np.int32)
+        self.number = np.concatenate(numbers) if numbers else np.zeros(0, dtype=np.int32)
+        self.spots_cnt = len(self.lot_id)
+        self.occupied = np.zeros(self.spots_cnt, dtype=bool)
+        self.occupied_cnt = 0
+        # Spot indexes on each side, in OccupancyIndex order, and the position
+        # of each spot in its side
+        self.occupied_list = []
+        self.vacant_list = list(range(self.spots_cnt))
+        self.index_pos = list(range(self.spots_cnt))
+
+    def _make_minute_table(self):
+        # Percent occupied for every minute of the weekday and the weekend
+        # day, see profiles.py
+        profile = OccupancyProfile.from_table(self.percent_occupied_table)
+        self.minute_pcnt = np.array(profile.curves, dtype=np.float64)
+
+    def _pcnt_for(self, timestamp):
+        return self.minute_pcnt[self.clock.is_weekend(timestamp), self.clock.minute_of_day(timestamp)]
+
+    def _populate(self):
+        # Given the start time calc the percent occupied that should be
+        # prepopulated and pick that many spots
+        pick_size = int(self.spots_cnt * (self._pcnt_for(self.start_timestamp)/100.0))
+        self._set(self.random.sample(self.vacant_list, pick_size), True)
+
+    def _re_report_schedule(self):
+        # The same schedule Parking builds, as arrays
+        schedule = report_schedule(self.spots_cnt, self.report_interval, self.random)
+        self.re_report_schedule_list = [np.array(group, dtype=np.intp) for group in schedule]
+
+    def percent_occupied(self):
+        # Returns percent occupied
+        return (self.occupied_cnt/self.spots_cnt) * 100.0
+
+    def produce(self, spot_index, timestamp, isOccupied):
+        # Same message layout as Spot.produce
+        lot_id = self.lot_id[spot_index]
+        result = {}
+        result['timestamp'] = int(timestamp)
+        result['isOccupied'] = bool(isOccupied)
+        meter = {}
+        meter['number'] = int(self.number[spot_index])
+        meter['location'] = self.lot_location[lot_id]
+        meter['address'] = self.lot_address[lot_id]
+        result['meter'] = meter
+        return result
+
+    def _move(self, spot_index, src, dst):
+        # Swap-remove the spot from src and append it to dst, as OccupancyIndex
+        pos = self.index_pos[spot_index]
+        last = src.pop()
+        if last != spot_index:
+            src[pos] = last
+            self.index_pos[last] = pos
+        self.index_pos[spot_index] = len(dst)
+        dst.append(spot_index)
+
+    def _set(self, spot_indexes, isOccupied):
+        # Change the state of the listed spots, in order
+        if isOccupied:
+            for spot_index in spot_indexes:
+                self._move(spot_index, self.vacant_list, self.occupied_list)
+        else:
+            for spot_index in spot_indexes:
+                self._move(spot_index, self.occupied_list, self.vacant_list)
+        self.occupied[spot_indexes] = isOccupied
+        self.occupied_cnt = len(self.occupied_list)
+
+    def _minute_occupancy(self, timestamp, mil_hour):
+        # Grow or shrink toward the occupancy curve for this minute
+        pcnt_new = self._pcnt_for(timestamp)
+        spots_should_be_occupied = self.spots_cnt * (pcnt_new/100.0)
+        spots_to_change = math.floor(spots_should_be_occupied - self.occupied_cnt)
+        if spots_to_change >= 1:
+            candidates = self.vacant_list
+            source, isOccupied = GROW, True
+        elif spots_to_change <= -1:
+            candidates = self.occupied_list
+            source, isOccupied = SHRINK, False
+        else:
+            return None
+        count = min(abs(spots_to_change), len(candidates))
+        picked = np.array(self.random.sample(candidates, count), dtype=np.intp)
+        self._set(picked, isOccupied)
+        timestamps = np.full(count, timestamp, dtype=np.int64)
+        states = np.full(count, isOccupied, dtype=bool)
+        return source, timestamps, picked, states
+
+    def _minute_re_report(self, timestamp, mil_hour):
+        slot = self.clock.local_minute(timestamp) % self.report_interval
+        reporting = self.re_report_schedule_list[slot]
+        timestamps = np.full(len(reporting), timestamp, dtype=np.int64)
+        return REPORT, timestamps, reporting, self.occupied[reporting]
+
+    def _minute_swaps(self, timestamp):
+        # Empty and fill the same number of spots at distinct seconds of the
+        # minute, alternating empty/fill exactly like Parking._swap_full_empty
+        number_to_swap = int(self.occupied_cnt * 0.1)
+        if number_to_swap <= 0:
+            return None
+        number_empty = self.spots_cnt - self.occupied_cnt
+        number_can_swap = min(self.occupied_cnt, number_empty, number_to_swap, SWAP_LIMIT)
+        spots_to_empty = self.random.sample(self.occupied_list, number_can_swap)
+        spots_to_fill = self.random.sample(self.vacant_list, number_can_swap)
+        seconds_to_swap = np.array(sorted(self.random.sample(range(58), number_can_swap * 2)), dtype=np.int64)
+        # Each pair empties the last spot left to empty, then fills the last
+        # spot left to fill
+        spot_indexes = np.empty(number_can_swap * 2, dtype=np.intp)
+        spot_indexes[0::2] = spots_to_empty[::-1]
+        spot_indexes[1::2] = spots_to_fill[::-1]
+        states = np.zeros(number_can_swap * 2, dtype=bool)
+        states[1::2] = True
+        for spot_index, isOccupied in zip(spot_indexes.tolist(), states.tolist()):
+            self._set([spot_index], isOccupied)
+        return SWAP, timestamp + seconds_to_swap, spot_indexes, states
+
+    def iter_batches(self, hours_to_simulate):
+        # Yields (source, timestamps, spot_indexes, states) arrays, one batch per
+        # rule per minute, without building any message objects
+        walk_minutes = int(hours_to_simulate * 60)
+        for minute in range(walk_minutes):
+            walk_current_epoch = self.start_timestamp + (minute * SECONDS_PER_MINUTE)
+            mil_hour = self.timestamp_to_local_mil_time(walk_current_epoch)
+            batch = self._minute_occupancy(walk_current_epoch, mil_hour)
+            if batch is not None:
+                yield batch
+            yield self._minute_re_report(walk_current_epoch, mil_hour)
+            batch = self._minute_swaps(walk_current_epoch)
+            if batch is not None:
+                yield batch
+
+    def _call_back(self, obj, mil_hour, source=""):
+        if self.pacer is None:
+            self.ext_callback(self.conn, obj, mil_hour, source)
+            time.sleep(self.pause)
+        else:
+            self.pacer.wait(obj['timestamp'])
+            self.ext_callback(self.conn, obj, mil_hour, source)
+
+    def iter_events(self, hours_to_simulate):
+        # Lazily yields (timestamp, source, payload) like Parking.iter_events
+        for source, timestamps, spot_indexes, states in self.iter_batches(hours_to_simulate):
+            for timestamp, spot_index, isOccupied in zip(timestamps.tolist(), spot_indexes.tolist(), states.tolist()):
+                yield timestamp, source, self.produce(spot_index, timestamp, isOccupied)
+
+    def walk_through_sim(self, hours_to_simulate):
+        # Emits every event through the callback like Parking.walk_through_sim
+        for timestamp, source, obj in self.iter_events(hours_to_simulate):
+            self._call_back(obj, self.timestamp_to_local_mil_time(timestamp), source)
+
+
+if __name__ == "__main__":
+    from parky_sim import parking_config, percent_occupied_table
+
+    # Example of usage, count the events a large synthetic system produces
+    timestamp = DEFAULT_START
+    big_config = parking_config * 10000
+    start = time.time()
+    parking = NumpyParking(None, big_config, percent_occupied_table, timestamp, None, seed=1)
+    counts = {}
+    for source, timestamps, spot_indexes, states in parking.iter_batches(24):
+        counts[source] = counts.get(source, 0) + len(spot_indexes)
+    print(f"{parking.spots_cnt} spots, events {counts}, {time.time() - start:.2f}s")
@@ -0,0 +1,128 @@
+# IoT Parking Meter Simulation - multi-process sharded runs
+# By Aussie Schnore
+#
+# Splits the parking lots into shards and simulates each shard with its own
+# Parking instance in a separate process. Every shard writes its events, in
+# timestamp order, to its own file and the files are then k-way merged into a
+# single timestamp ordered stream.
+#
+# Each shard follows the same percent_occupied_table, so the occupancy of all
+# shards together follows the curve too (each shard rounds down on its own, so
+# the total can trail the single process run by less than one spot per shard).
+# The background swaps are capped at SWAP_LIMIT a minute for the whole run,
+# each shard gets a share of the cap by its meter count, so the total swap
+# volume doesn't grow with the shard count.
+# Shard seeds are derived from the run seed and the shard number, so the same
+# seed and shard count reproduce a run exactly.
+
+import argparse
+import concurrent.futures
+import hashlib
+import heapq
+import json
+import os
+import sys
+import time
+
+from pacing import NoPacing
+from parky_sim import (DEFAULT_START, SWAP_LIMIT, Parking, parking_config, percent_occupied_table,
+                       partition_lots)
+from simtime import parse_time
+
+
+def derive_seed(seed, shard):
+    # Stable 64 bit seed for a shard, independent of PYTHONHASHSEED
+    digest = hashlib.sha256(f"{seed}:{shard}".encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def shard_path(work_dir, shard):
+    return os.path.join(work_dir, f"shard-{shard:04d}.tsv")
+
+
+# Per shard sink, one line per event: timestamp, source, mil time and the JSON
+# message, tab separated so the merge can read the timestamp without parsing
+# the JSON
+def _write_event(out, obj, mil_hour, source):
+    out.write(f"{obj['timestamp']}\t{source}\t{mil_hour}\t{json.dumps(obj)}\n")
+
+
+def run_shard(shard, shard_config, table, timestamp, hours, seed, work_dir, tz=None, swap_limit=SWAP_LIMIT):
+    # Runs in a worker process
+    path = shard_path(work_dir, shard)
+    with open(path, "w", buffering=1024 * 1024) as out:
+        parking = Parking(out, shard_config, table, timestamp, _write_event,
+                          seed=derive_seed(seed, shard), pacer=NoPacing(), tz=tz, swap_limit=swap_limit)
+        parking.walk_through_sim(hours)
+    return path
+
+
+def _read_shard(path):
+    with open(path) as f:
+        for line in f:
+            timestamp, source, mil_hour, message = line.rstrip("\n").split("\t", 3)
+            yield int(timestamp), source, int(mil_hour), message
+
+
+def merge_shards(paths):
+    # k-way merge of the shard files. heapq.merge is stable, so events with the
+    # same timestamp come out in shard order and the result is deterministic.
+    return heapq.merge(*[_read_shard(path) for path in paths], key=lambda event: event[0])
+
+
+def run_sharded(config, table, timestamp, hours, shards, seed, work_dir, processes=None, tz=None):
+    # Simulate 'config' split into 'shards' shards over a process pool and
+    # return the per shard event files
+    os.makedirs(work_dir, exist_ok=True)
+    lot_shard = partition_lots(config, shards)
+    shard_configs = [[] for _ in range(shards)]
+    for lot, shard in zip(config, lot_shard):
+        shard_configs[shard].append(lot)
+    # Each shard's share of the swaps a minute, by its meters
+    meters = sum(lot['meter_count'] for lot in config)
+    swap_limits = [SWAP_LIMIT * sum(lot['meter_count'] for lot in shard_config) / max(1, meters)
+                   for shard_config in shard_configs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(run_shard, shard, shard_configs[shard], table, timestamp, hours, seed, work_dir, tz,
+                               swap_limits[shard])
+                   for shard in range(shards) if shard_configs[shard]]
+        return [future.result() for future in futures]
+
+
+def replay_merged(paths, conn, ext_callback):
+    # Feed the merged stream to a callback with the same signature Parking uses
+    for timestamp, source, mil_hour, message in merge_shards(paths):
+        ext_callback(conn, json.loads(message), mil_hour, source)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the parking simulation sharded across processes.")
+    parser.add_argument('--shards', default=os.cpu_count() or 1, type=int, help="Number of shards")
+    parser.add_argument('--processes', default=None, type=int, help="Worker processes (defaults to the core count)")
+    parser.add_argument('--hours', default=24, type=float, help="Number of hours to simulate")
+    parser.add_argument('--start', default=str(DEFAULT_START), help="When the run starts, an epoch timestamp or " +
+                        "a local date/time like 2019-10-14T17:00")
+    parser.add_argument('--seed', default=0, type=int, help="Run seed, shard seeds are derived from it")
+    parser.add_argument('--scale', default=1, type=int, help="Repeat the sample parking_config this many times")
+    parser.add_argument('--timezone', help="Time zone of the simulated city, defaults to the host's zone")
+    parser.add_argument('--work-dir', default="shards", help="Directory for the per shard event files")
+    parser.add_argument('--out', help="Write the merged events here as JSON lines ('-' for stdout)")
+    args = parser.parse_args()
+
+    # Time for simulation to start
+    timestamp = parse_time(args.start, args.timezone)
+
+    start = time.time()
+    paths = run_sharded(parking_config * args.scale, percent_occupied_table, timestamp, args.hours,
+                        args.shards, args.seed, args.work_dir, args.processes, args.timezone)
+    print(f"Simulated {len(paths)} shards in {time.time() - start:.2f}s", file=sys.stderr)
+
+    if args.out:
+        out = sys.stdout if args.out == "-" else open(args.out, "w", buffering=1024 * 1024)
+        events = 0
+        for timestamp, source, mil_hour, message in merge_shards(paths):
+            out.write(message + "\n")
+            events += 1
+        if out is not sys.stdout:
+            out.close()
+        print(f"Merged {events} events in {time.time() - start:.2f}s", file=sys.stderr)
@@ -1,13 +1,16 @@
 # IoT Parking Meter Simulation
 # By Aussie Schnore
 
+import array
+import collections
 import random
-import datetime
 import time
 import math
 from pprint import pprint
 
-from randomgroup import group_list
+from profiles import ProfileResolver, load_numpy, profile_matrix
+from randomgroup import report_schedule
+from simtime import MilTimeConverter, parse_time
 
 parking_config = [
     {
@@ -96,6 +99,18 @@ parking_config = [
 
 SECONDS_PER_HOUR = 60 * 60
 SECONDS_PER_MINUTE = 60
+# Where the example runs start when no --start is given, a Sunday in
+# October 2019
+DEFAULT_START = 1571005498
+# Most spot swaps in one simulated minute, each swap empties and fills a spot
+# at distinct seconds of the minute
+SWAP_LIMIT = 29
+
+# The 'source' of each event, why the message was sent. Arrive and Depart come
+# from the discrete event engine in parky_events.py, LotReport from the lot
+# level reports in lotreport.py. New sources go on the end,
+# event logs store the position.
+EVENT_SOURCES = ["Grow", "Shrink", "Report", "Swap", "Arrive", "Depart", "LotReport"]
 
 # The percent of the total parking spots occupied each hour starting at 0000 to 2300 local time.
 # Derived from Figure 4 in this document
@@ -127,6 +142,20 @@ percent_occupied_table = [37.54,
                          45.73]
 
 
+def partition_lots(parking_config, shard_cnt):
+    # Spread lots over 'shard_cnt' shards keeping the meter count per shard
+    # even: largest lots first, each to the shard with the fewest meters.
+    # Returns the shard number for each lot in config order.
+    shard_meters = [0] * shard_cnt
+    lot_shard = [0] * len(parking_config)
+    by_size = sorted(range(len(parking_config)), key=lambda i: -parking_config[i]['meter_count'])
+    for lot_index in by_size:
+        shard = shard_meters.index(min(shard_meters))
+        lot_shard[lot_index] = shard
+        shard_meters[shard] += parking_config[lot_index]['meter_count']
+    return lot_shard
+
+
 # Example of object returned by IoT meter system
 # this format is set in the Spot class
 """
@@ -142,20 +171,136 @@ percent_occupied_table = [37.54,
 """
 
 
+# Live index of occupied and empty spots. Each side is kept as an array with
+# swap-remove so a spot can move between the two in O(1) and random picks can
+# be taken straight from the arrays without walking every spot.
+class OccupancyIndex(object):
+    def __init__(self):
+        self.occupied = []
+        self.vacant = []
+
+    def add(self, spot):
+        # Register a spot with the index on the side matching its state
+        side = self.occupied if spot.isOccupied else self.vacant
+        spot.index_pos = len(side)
+        side.append(spot)
+        spot.lot.index = self
+
+    def _move(self, spot, src, dst):
+        # Swap-remove the spot from src and append it to dst
+        pos = spot.index_pos
+        last = src.pop()
+        if last is not spot:
+            src[pos] = last
+            last.index_pos = pos
+        spot.index_pos = len(dst)
+        dst.append(spot)
+
+    def mark_occupied(self, spot):
+        self._move(spot, self.vacant, self.occupied)
+
+    def mark_empty(self, spot):
+        self._move(spot, self.occupied, self.vacant)
+
+    def occupied_count(self):
+        return len(self.occupied)
+
+    def empty_count(self):
+        return len(self.vacant)
+
+
+# Occupied and empty spots of one lot, used when lots follow their own
+# occupancy profiles. Every move is passed on to the Parking wide index
+# ('parent') so both stay in step, and the lot's occupied count is kept in
+# 'counts' for the vectorized target lookup.
+class LotIndex(object):
+    def __init__(self, parent, counts, lot_id):
+        self.parent = parent
+        self.counts = counts
+        self.lot_id = lot_id
+        self.occupied = []
+        self.vacant = []
+
+    def add(self, spot):
+        side = self.occupied if spot.isOccupied else self.vacant
+        spot.lot_pos = len(side)
+        side.append(spot)
+        if spot.isOccupied:
+            self.counts[self.lot_id] += 1
+        self.parent.add(spot)
+        spot.lot.index = self
+
+    def _move(self, spot, src, dst):
+        # Same swap-remove as OccupancyIndex, on the spot's lot_pos
+        pos = spot.lot_pos
+        last = src.pop()
+        if last is not spot:
+            src[pos] = last
+            last.lot_pos = pos
+        spot.lot_pos = len(dst)
+        dst.append(spot)
+
+    def mark_occupied(self, spot):
+        self._move(spot, self.vacant, self.occupied)
+        self.counts[self.lot_id] += 1
+        self.parent.mark_occupied(spot)
+
+    def mark_empty(self, spot):
+        self._move(spot, self.occupied, self.vacant)
+        self.counts[self.lot_id] -= 1
+        self.parent.mark_empty(spot)
+
+    def occupied_count(self):
+        return len(self.occupied)
+
+    def empty_count(self):
+        return len(self.vacant)
+
+
+# Shared record for a parking lot. Every spot in the lot points at the same
+# record rather than holding its own copy of the address and location.
+# encoder.SpotEncoder serializes those fields once per lot.
+class Lot(object):
+    __slots__ = ('lot_id', 'address', 'location', 'index')
+
+    def __init__(self, lot_id, address, location):
+        self.lot_id = lot_id
+        self.address = address
+        self.location = location
+        self.index = None  # OccupancyIndex or LotIndex the lot's spots are registered with
+
+
 # Class that maintains the state of a parking spot and produces
 # the IoT message object
 class Spot(object):
-    def __init__(self, address, location, number, isOccupied):
-        self.address = address
-        self.location = location
+    __slots__ = ('lot', 'number', 'isOccupied', 'index_pos', 'lot_pos')
+
+    def __init__(self, lot, number, isOccupied):
+        self.lot = lot
         self.number = number
         self.isOccupied = isOccupied
+        self.index_pos = -1  # Position in the OccupancyIndex side it is on
+        self.lot_pos = -1  # Position in its LotIndex side, if the lot has one
+
+    @property
+    def address(self):
+        return self.lot.address
+
+    @property
+    def location(self):
+        return self.lot.location
 
     def occupy(self):
-        self.isOccupied = True
+        if not self.isOccupied:
+            self.isOccupied = True
+            if self.lot.index is not None:
+                self.lot.index.mark_occupied(self)
 
     def empty(self):
-        self.isOccupied = False
+        if self.isOccupied:
+            self.isOccupied = False
+            if self.lot.index is not None:
+                self.lot.index.mark_empty(self)
 
     def produce(self, timestamp):
         result = {}
@@ -163,137 +308,168 @@ class Spot(object):
         result['isOccupied'] = self.isOccupied
         meter = {}
         meter['number'] = self.number
-        meter['location'] = self.location
-        meter['address'] = self.address
+        meter['location'] = self.lot.location
+        meter['address'] = self.lot.address
         result['meter'] = meter
         return result
 
 # Class that maintains the state of the entire Parking system
 class Parking(object):
-    def __init__(self, conn, parking_config, percent_occupied_table, timestamp, ext_callback):
+    def __init__(self, conn, parking_config, percent_occupied_table, timestamp, ext_callback, seed=None, pacer=None, tz=None,
+                 report_interval=60, metrics=None, profiles=None, checkpoint=None, lot_reports=None,
+                 swap_limit=SWAP_LIMIT):
         self.parking_config = parking_config
+        # Private random source so a run can be reproduced from its seed
+        self.random = random.Random(seed)
         self.conn = conn  # meant to hold the mqtt_connect and to feed it to callback
         self.percent_occupied_table = percent_occupied_table
         self.start_timestamp = timestamp
+        self.report_interval = report_interval  # Minutes between regular spot reports
+        # Most swaps a minute, a fraction when a shard gets its share (see
+        # parky_shards.py) and is then averaged over the minutes
+        self.swap_limit = swap_limit
         self.ext_callback = ext_callback
-        self.current_percent_occupied,_ = self._percent_occupied_trend_epoch(timestamp)
+        # Local time for the simulation, tz=None uses the host's zone
+        self.clock = MilTimeConverter(tz)
+        self.lots = []
         self.spots = []
         self.spots_cnt = 0
+        self.index = OccupancyIndex()
+        # Occupancy curves, see profiles.py. Lots only get their own index when
+        # some lot doesn't follow percent_occupied_table.
+        self.profile_resolver = ProfileResolver(percent_occupied_table, profiles)
+        self.lot_meters = []
+        self.lot_profile = []
         self._make_spots()
         self._re_report_schedule()
         self.pause = 0.01  # Sets the time.sleep value between call_backs
+        self.pacer = pacer  # pacing.* object, when set it replaces the fixed pause
+        self.metrics = metrics  # metrics.SimMetrics, None runs uninstrumented
+        self.checkpoint = checkpoint  # checkpoint.Checkpointer, None takes no snapshots
+        self.lot_reports = lot_reports  # lotreport.LotReporter, None reports per meter
+        self.next_minute = 0  # First simulated minute not yet started, see checkpoint.py
  
     def timestamp_to_local_mil_time(self, timestamp):
         # given an epoch timestamp convert to local 24 hour time
-        datetime_time = datetime.datetime.fromtimestamp(timestamp)
-        result = (datetime_time.hour * 100) + datetime_time.minute
-        return result
+        return self.clock.mil_time(timestamp)
 
     def _re_report_schedule(self):
         # Calculates when spots should report in.  This reporting is in addition
         # to reporting state change from occupied to empty to occupied
-        report_order = list(range(len(self.spots)))
-        random.shuffle(report_order)
-        # Once per hour starting at minute intervals starting at self.start_timestamp
-        self.re_report_schedule_list = group_list(report_order, 60)
+        # Once per report_interval minutes, spread over the minutes of the interval
+        # The random state it was built from is kept so a snapshot can rebuild it
+        self.schedule_rng_state = self.random.getstate()
+        self.re_report_schedule_list = report_schedule(len(self.spots), self.report_interval, self.random)
+
+    def _reindex(self):
+        # Rebuild the occupancy index with the spots in spot order and every
+        # lot's own index alongside it. Used at startup with per lot profiles.
+        self.index.occupied = []
+        self.index.vacant = []
+        for lot in self.lots:
+            lot.index.occupied = []
+            lot.index.vacant = []
+            self.lot_occupied[lot.lot_id] = 0
+        for spot in self.spots:
+            spot.lot.index.add(spot)
 
     def _call_back(self, obj, mil_hour, source=""):
-        self.ext_callback(self.conn, obj, mil_hour, source)
-        time.sleep(self.pause)
+        if self.pacer is None:
+            self.ext_callback(self.conn, obj, mil_hour, source)
+            time.sleep(self.pause)
+        else:
+            self.pacer.wait(obj['timestamp'])
+            self.ext_callback(self.conn, obj, mil_hour, source)
 
-    def _percent_occupied_trend_epoch(self, timestamp):
-        mil_hour = self.timestamp_to_local_mil_time(timestamp)
-        return self._percent_occupied_trend_hr(mil_hour)
-        
-    def _percent_occupied_trend_hr(self, mil_hour):
-        # Using the 'percent_occupied_table' and based on the time of day
-        # look up what the percent occupancy is for all parking spots
-        if mil_hour < 0 or mil_hour > 2359:
-            # Error
-            # TODO: Raise Exception. For now print out error and exit
-            print(f"ERROR: Function percent_occupied was called with a mil_hour that was out of range {mil_hour}. Exiting...")
-            exit(1)
-        # Interpolate percentage
-        hour, minutes = divmod(mil_hour, 100)
-
-        next_hour = hour + 1
-        if next_hour > 23:
-            # Wrap at midnight case
-            next_hour = 0
-        frac_hour = minutes/60
-        pcnt_start_hour = self.percent_occupied_table[hour]
-        pcnt_end_hour = self.percent_occupied_table[next_hour]
-        pcnt_delta = pcnt_end_hour - pcnt_start_hour
-        pcnt_frac = pcnt_delta * frac_hour
-        pcnt_occupied = pcnt_start_hour + pcnt_frac
-        return pcnt_occupied, pcnt_delta
+    def percent_occupied_target(self, timestamp, profile=0):
+        # Percent of the spots following 'profile' that should be occupied at
+        # 'timestamp', straight from the precomputed per minute curve
+        curve = self.profiles[profile].curves[self.clock.is_weekend(timestamp)]
+        return curve[self.clock.minute_of_day(timestamp)]
 
     def _make_spots(self):
-        # Instances the spot object and sets the initial spot occupancy
-        for lot in self.parking_config:
-            meter_count = lot['meter_count']
+        # Instances the spot object and sets the initial spot occupancy.
+        # parking_config can be any iterable of lot dicts (e.g. the streaming
+        # loaders in lotconfig.py), it is only read once.
+        profile_for = self.profile_resolver.profile_for
+        add = self.index.add
+        for lot_id, lot_config in enumerate(self.parking_config):
+            meter_count = lot_config['meter_count']
+            lot = Lot(lot_id, lot_config['address'], lot_config['location'])
+            self.lots.append(lot)
+            self.lot_meters.append(meter_count)
+            self.lot_profile.append(profile_for(lot_config))
             for i in range(meter_count):
-                address = lot['address']
-                location = lot['location']
                 number = i + 1
                 isOccupied = False
-                spot = Spot(address, location, number, isOccupied)
+                spot = Spot(lot, number, isOccupied)
                 self.spots.append(spot)
-        # Given the current time stamp calc the percent occupied that should
-        # be prepopulated
-        mil_hour = self.timestamp_to_local_mil_time(self.start_timestamp)
-        pcnt_occupied,_ = self._percent_occupied_trend_hr(mil_hour)
+                add(spot)
         pop_size = len(self.spots)
         self.spots_cnt = pop_size
+        self.profiles = self.profile_resolver.profiles
+        self.per_lot = any(self.lot_profile)
+        self.current_percent_occupied = self.percent_occupied_target(self.start_timestamp)
+        self.lot_occupied = array.array('q', bytes(8 * len(self.lots)))
+        # NumPy copies for the vectorized per lot lookup, None without NumPy
+        self.profile_matrix = profile_matrix(self.profiles) if self.per_lot else None
+        if self.profile_matrix is not None:
+            numpy = load_numpy()
+            self.lot_profile_array = numpy.array(self.lot_profile, dtype=numpy.intp)
+            self.lot_meter_array = numpy.array(self.lot_meters, dtype=numpy.float64)
+        if self.per_lot:
+            # Give every lot its own index, then start each lot at its own
+            # profile's occupancy
+            for lot in self.lots:
+                lot.index = LotIndex(self.index, self.lot_occupied, lot.lot_id)
+            self._reindex()
+            for lot_id, change in self._lot_changes(self.start_timestamp):
+                for spot in self.random.sample(self.lots[lot_id].index.vacant, change):
+                    spot.occupy()
+            return
+        # Given the current time stamp calc the percent occupied that should
+        # be prepopulated
+        pcnt_occupied = self.percent_occupied_target(self.start_timestamp)
         pick_size = int(pop_size * (pcnt_occupied/100.0))
         # Pick spots 
-        occ_spots = random.sample(self.spots, pick_size)
+        occ_spots = self.random.sample(self.index.vacant, pick_size)
         for spot in occ_spots:
             # Set spot occupied
             spot.occupy()
 
     def percent_occupied(self):
         # Returns percent occupied
-        pop_size = len(self.spots)
-        occupied = 0
-        for a in self.spots:
-            if a.isOccupied:
-                occupied += 1
-        pcnt_occupied = (occupied/pop_size) * 100.0
+        pcnt_occupied = (self.index.occupied_count()/self.spots_cnt) * 100.0
         return pcnt_occupied
 
-    def _get_full(self):
-        result = []
-        for spot in self.spots:
-            # Set spot occupied
-            if spot.isOccupied:
-                result.append(spot)
-        return(result)
-
-    def _get_empty(self):
-        result = []
-        for spot in self.spots:
-            # Set spot occupied
-            if not spot.isOccupied:
-                result.append(spot)
-        return(result)
+    def _swap_cap(self, timestamp):
+        # Whole swaps allowed in the minute at 'timestamp'. A fractional
+        # swap_limit gives floor((m + 1) * limit) - floor(m * limit) in minute
+        # m, which averages to the limit without keeping any state.
+        minute = (timestamp - self.start_timestamp) // SECONDS_PER_MINUTE
+        return math.floor((minute + 1) * self.swap_limit) - math.floor(minute * self.swap_limit)
 
     def _swap_full_empty(self, number_to_swap, timestamp):
         # Take empty and full spots and swap them to simulate background activity
-        # that doesn't change the occupancy percentage (no more than 29 at a time)
+        # that doesn't change the occupancy percentage (no more than swap_limit at a time)
         # trying to do all the swaps in under a minute
-        full_spots = self._get_full()
+        full_spots = self.index.occupied
         number_full = len(full_spots)
-        empty_spots = self._get_empty()
+        empty_spots = self.index.vacant
         number_empty = len(empty_spots)
         # Calc the number we can swap
         # 29 should be the max as we want to empty a spot and fill it at different
         # times within a one minute window
-        number_can_swap = min([number_full, number_empty, number_to_swap, 29])
-        spots_to_empty = random.sample(full_spots, number_can_swap)
-        spots_to_fill = random.sample(empty_spots, number_can_swap)
+        number_can_swap = min([number_full, number_empty, number_to_swap, self._swap_cap(timestamp)])
+        if self.per_lot:
+            spots_to_empty, spots_to_fill = self._lot_swap_pairs(number_can_swap)
+            number_can_swap = len(spots_to_empty)
+        else:
+            # random.sample returns new lists so the index can change under them
+            spots_to_empty = self.random.sample(full_spots, number_can_swap)
+            spots_to_fill = self.random.sample(empty_spots, number_can_swap)
         # Okay we have 58 seconds to do this lets make it look good
-        seconds_to_swap = random.sample(range(58), number_can_swap * 2)
+        seconds_to_swap = self.random.sample(range(58), number_can_swap * 2)
         seconds_to_swap.sort()
         empty_now = False
         empty_first = False
@@ -308,31 +484,116 @@ class Parking(object):
             if not empty_now:
                 spot_empty = spots_to_fill.pop()
                 spot_empty.occupy()
-                mil_time = self.timestamp_to_local_mil_time(cur_timestamp)
-                self._call_back(spot_empty.produce(cur_timestamp), mil_time, "Swap")
+                yield cur_timestamp, "Swap", spot_empty
                 empty_now = True
             elif empty_now:
 
                 spot_fill = spots_to_empty.pop()
                 spot_fill.empty()
-                mil_time = self.timestamp_to_local_mil_time(cur_timestamp)
-                self._call_back(spot_fill.produce(cur_timestamp), mil_time, "Swap")
+                yield cur_timestamp, "Swap", spot_fill
                 empty_now = False
 
+    def _lot_swap_pairs(self, number_to_swap):
+        # Spots to empty and fill for swaps within lots, so lots following
+        # their own profiles stay on target. Each spot to empty is paired with
+        # a vacant spot of its own lot (the two lists are popped together);
+        # spots in lots with no vacant spot are left out.
+        spots_to_empty = self.random.sample(self.index.occupied, number_to_swap)
+        wanted = collections.Counter(spot.lot for spot in spots_to_empty)
+        vacant = {lot: self.random.sample(lot.index.vacant, min(count, len(lot.index.vacant)))
+                  for lot, count in wanted.items()}
+        paired_empty = []
+        paired_fill = []
+        for spot in spots_to_empty:
+            if vacant[spot.lot]:
+                paired_empty.append(spot)
+                paired_fill.append(vacant[spot.lot].pop())
+        return paired_empty, paired_fill
+
     def _simulate_even_spot_swaps(self, timestamp):
-        spots_currently_occupied = self.spots_cnt * (self.percent_occupied()/100.0)
+        spots_currently_occupied = self.index.occupied_count()
         spots_cnt_to_swap = int(spots_currently_occupied * 0.1)
         if spots_cnt_to_swap > 0:
-            self._swap_full_empty(spots_cnt_to_swap, timestamp)
+            yield from self._swap_full_empty(spots_cnt_to_swap, timestamp)
+
+    def _lot_changes(self, timestamp):
+        # (lot id, spots to fill (+) or empty (-)) for every lot off its
+        # profile's target this minute. Each lot's target is its share of the
+        # meters rounded down or up. Rounding every lot down would lose up to
+        # a spot per lot, a large part of small lots, so the lots rounded up
+        # are picked to make the total the rounded sum of the exact targets:
+        # lots already a spot over their rounded down target stay there when
+        # they can, then the largest fractions go first.
+        minute = self.clock.minute_of_day(timestamp)
+        weekend = self.clock.is_weekend(timestamp)
+        if self.profile_matrix is not None:
+            # One lookup for all lots
+            numpy = load_numpy()
+            pcnt = self.profile_matrix[:, weekend, minute][self.lot_profile_array]
+            should_be_occupied = self.lot_meter_array * (pcnt/100.0)
+            whole = numpy.floor(should_be_occupied)
+            fraction = should_be_occupied - whole
+            occupied = numpy.frombuffer(self.lot_occupied, dtype=numpy.int64)
+            round_up = (fraction > 0) & (occupied > whole)
+            extra = round(math.fsum(fraction.tolist())) - int(numpy.count_nonzero(round_up))
+            if extra < 0:
+                lots = numpy.flatnonzero(round_up)
+                round_up[lots[numpy.argsort(fraction[lots], kind='stable')[:-extra]]] = False
+            elif extra > 0:
+                lots = numpy.flatnonzero((fraction > 0) & ~round_up)
+                round_up[lots[numpy.argsort(-fraction[lots], kind='stable')[:extra]]] = True
+            change = whole.astype(numpy.int64) + round_up - occupied
+            changing = numpy.flatnonzero(change)
+            return zip(changing.tolist(), change[changing].tolist())
+        whole = []
+        fraction = []
+        for lot_id, profile in enumerate(self.lot_profile):
+            should_be_occupied = self.lot_meters[lot_id] * (self.profiles[profile].curves[weekend][minute]/100.0)
+            whole.append(math.floor(should_be_occupied))
+            fraction.append(should_be_occupied - whole[-1])
+        round_up = [fraction[lot_id] > 0 and self.lot_occupied[lot_id] > whole[lot_id] for lot_id in range(len(whole))]
+        extra = round(math.fsum(fraction)) - sum(round_up)
+        if extra < 0:
+            lots = sorted((lot_id for lot_id, up in enumerate(round_up) if up), key=fraction.__getitem__)
+            for lot_id in lots[:-extra]:
+                round_up[lot_id] = False
+        elif extra > 0:
+            lots = sorted((lot_id for lot_id, up in enumerate(round_up) if not up and fraction[lot_id] > 0),
+                          key=lambda lot_id: -fraction[lot_id])
+            for lot_id in lots[:extra]:
+                round_up[lot_id] = True
+        changes = []
+        for lot_id, up in enumerate(round_up):
+            change = whole[lot_id] + up - self.lot_occupied[lot_id]
+            if change != 0:
+                changes.append((lot_id, change))
+        return changes
+
+    def _simulate_lot_occupancy(self, timestamp):
+        # _simulate_spot_occupancy for lots following their own profiles, each
+        # lot grows or shrinks toward its own target
+        for lot_id, change in self._lot_changes(timestamp):
+            index = self.lots[lot_id].index
+            if change > 0:
+                for spot in self.random.sample(index.vacant, min(change, len(index.vacant))):
+                    spot.occupy()
+                    yield timestamp, "Grow", spot
+            else:
+                for spot in self.random.sample(index.occupied, min(-change, len(index.occupied))):
+                    spot.empty()
+                    yield timestamp, "Shrink", spot
 
     def _simulate_spot_occupancy(self, timestamp):
         # Here we make changes to the spot occupancy rate in line with what is 
         # called out in the "percent_occupied_table"
-        pcnt_new, _ = self._percent_occupied_trend_epoch(timestamp)
+        if self.per_lot:
+            yield from self._simulate_lot_occupancy(timestamp)
+            return
+        pcnt_new = self.percent_occupied_target(timestamp)
         # Calc the number of spots that should be occupied
         spots_should_be_occupied = self.spots_cnt * (pcnt_new/100.0)
         # Get the number that are currently occupied
-        spots_currently_occupied = self.spots_cnt * (self.percent_occupied()/100.0)
+        spots_currently_occupied = self.index.occupied_count()
         # Calc the change needed to make 
         spots_to_change = math.floor(spots_should_be_occupied - spots_currently_occupied)
         #print(f"spots_to_change {spots_to_change}")
@@ -343,16 +604,15 @@ class Parking(object):
             # get the number of empty spots to fill
             choose_cnt_to_fill = spots_to_change
             # Get just the empty spots
-            empty_spots = self._get_empty()
+            empty_spots = self.index.vacant
             # Sample those spots
             if len(empty_spots) < choose_cnt_to_fill:
                 # not enough spots left to sample just take what is left
                 choose_cnt_to_fill = len(empty_spots)
-            spots_to_fill = random.sample(empty_spots, choose_cnt_to_fill)
+            spots_to_fill = self.random.sample(empty_spots, choose_cnt_to_fill)
             for spot in spots_to_fill:
-                mil_time = self.timestamp_to_local_mil_time(timestamp)
                 spot.occupy()
-                self._call_back(spot.produce(timestamp), mil_time, "Grow")
+                yield timestamp, "Grow", spot
         elif spots_to_change > -1.0 and spots_to_change < 1.0:
             # Not enough change yet to get even a single spot
             # Another way of saying this is that there may not be 
@@ -363,49 +623,132 @@ class Parking(object):
             # get the number of full spots to empty
             choose_cnt_to_empty = abs(spots_to_change)
             # Get just the full spots
-            full_spots = self._get_full()
+            full_spots = self.index.occupied
             # Sample those spots
             if len(full_spots) < choose_cnt_to_empty:
                 # not enough spots left to sample just take what is left
                 choose_cnt_to_empty = len(full_spots)
-            spots_to_empty = random.sample(full_spots, choose_cnt_to_empty)
+            spots_to_empty = self.random.sample(full_spots, choose_cnt_to_empty)
             for spot in spots_to_empty:
-                mil_time = self.timestamp_to_local_mil_time(timestamp)
                 spot.empty()
-                self._call_back(spot.produce(timestamp), mil_time, "Shrink")
+                yield timestamp, "Shrink", spot
 
     def _simulate_re_report(self, timestamp):
         # Along with reporting when the state of a spot changes, the IoT devices 
         # monitoring the parking lot spots are configured to report in
         # at a regular interval 
-        _, minute_of_the_hour = divmod(self.timestamp_to_local_mil_time(timestamp),100)
-        reporting_now_list = self.re_report_schedule_list[minute_of_the_hour]
+        if self.lot_reports is not None:
+            # One status message per lot instead, see lotreport.py
+            yield from self.lot_reports.reports(self, timestamp)
+            return
+        slot = self.clock.local_minute(timestamp) % self.report_interval
+        reporting_now_list = self.re_report_schedule_list[slot]
         for spot_index in reporting_now_list:
-            if spot_index > -1:
-                obj = self.spots[spot_index].produce(timestamp)
-                mil_time = self.timestamp_to_local_mil_time(timestamp)
-                self._call_back(obj, mil_time, "Report")
-
-
-    def walk_through_sim(self, hours_to_simulate):
-        # Here we call the functions that simulate change in spot occupancy
+            yield timestamp, "Report", self.spots[spot_index]
+
+    def _iter_spot_events(self, hours_to_simulate):
+        # Here we call the functions that simulate change in spot occupancy.
+        # Each yields (timestamp, source, spot) right after the spot changes,
+        # so the spot's state is the one to report as long as the consumer
+        # handles the event before asking for the next one. Minutes already
+        # simulated (next_minute, e.g. after a restored snapshot) are skipped,
+        # hours_to_simulate always counts from start_timestamp.
         walk_minutes = int(hours_to_simulate * 60)
+        simulate_spot_occupancy = self._simulate_spot_occupancy
+        simulate_re_report = self._simulate_re_report
+        simulate_even_spot_swaps = self._simulate_even_spot_swaps
+        if self.metrics is not None:
+            simulate_spot_occupancy = self.metrics.timed_phase("occupancy", simulate_spot_occupancy)
+            simulate_re_report = self.metrics.timed_phase("re_report", simulate_re_report)
+            simulate_even_spot_swaps = self.metrics.timed_phase("swaps", simulate_even_spot_swaps)
         
-        for minute in range(walk_minutes):
+        for minute in range(self.next_minute, walk_minutes):
+            # Every event before this minute has been handled, the point a
+            # snapshot can resume from
+            self.next_minute = minute
+            if self.checkpoint is not None:
+                self.checkpoint.minute_done(self)
+
             # Calc the next timestamp
             walk_current_epoch = self.start_timestamp + (minute * SECONDS_PER_MINUTE)
 
             # Simulates the increase in decrease in parking spot occupancy
-            self._simulate_spot_occupancy(walk_current_epoch)
+            yield from simulate_spot_occupancy(walk_current_epoch)
 
             # Simulates regular node reporting
-            self._simulate_re_report(walk_current_epoch)
+            yield from simulate_re_report(walk_current_epoch)
 
             # Simulates the spots swaps that don't effect the overall occupancy
-            self._simulate_even_spot_swaps(walk_current_epoch)
+            yield from simulate_even_spot_swaps(walk_current_epoch)
+        self.next_minute = max(self.next_minute, walk_minutes)
+
+    def iter_events(self, hours_to_simulate, raw=False):
+        # Pull based alternative to walk_through_sim: lazily yields
+        # (timestamp, source, payload) with payload the Spot.produce() object,
+        # or the Spot itself when raw is True. No callback and no pacing.
+        for timestamp, source, spot in self._iter_spot_events(hours_to_simulate):
+            if raw:
+                yield timestamp, source, spot
+            else:
+                yield timestamp, source, spot.produce(timestamp)
+
+    async def aiter_events(self, hours_to_simulate, raw=False, yield_every=1000):
+        # Async iterator version of iter_events. The simulation itself doesn't
+        # wait on anything, so control is handed back to the event loop every
+        # 'yield_every' events to let other tasks run. asyncio is imported
+        # here as loading it takes longer than a short run.
+        import asyncio
+        count = 0
+        for event in self.iter_events(hours_to_simulate, raw):
+            yield event
+            count += 1
+            if count >= yield_every:
+                count = 0
+                await asyncio.sleep(0)
+
+    def walk_through_sim(self, hours_to_simulate):
+        # Runs the simulation, handing every event to the callback
+        if self.metrics is not None:
+            self._walk_through_sim_measured(hours_to_simulate)
+            return
+        for timestamp, source, spot in self._iter_spot_events(hours_to_simulate):
+            mil_time = self.timestamp_to_local_mil_time(timestamp)
+            self._call_back(spot.produce(timestamp), mil_time, source)
+
+    def _walk_through_sim_measured(self, hours_to_simulate):
+        # walk_through_sim with every event counted in self.metrics. Same as
+        # _call_back, but only the callback itself is timed, not the pacing.
+        metrics = self.metrics
+        clock = metrics.clock
+        metrics.start(self.start_timestamp)
+        for timestamp, source, spot in self._iter_spot_events(hours_to_simulate):
+            mil_time = self.timestamp_to_local_mil_time(timestamp)
+            obj = spot.produce(timestamp)
+            if self.pacer is not None:
+                self.pacer.wait(timestamp)
+            start = clock()
+            self.ext_callback(self.conn, obj, mil_time, source)
+            metrics.event(source, timestamp, clock() - start)
+            if self.pacer is None:
+                time.sleep(self.pause)
+        metrics.finish()
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate parking spot events.")
+    parser.add_argument('--hours', default=24, type=float, help="Number of hours to simulate")
+    parser.add_argument('--start', default=str(DEFAULT_START), help="When the run starts, an epoch timestamp or " +
+                        "a local date/time like 2019-10-14T17:00. The lot starts at that time's occupancy.")
+    parser.add_argument('--end', help="When the run ends, same forms as --start, instead of --hours")
+    parser.add_argument('--seed', default=None, type=int, help="Seed to make the run repeatable")
+    parser.add_argument('--scale', default=1, type=int, help="Repeat the sample parking_config this many times")
+    parser.add_argument('--timezone', help="Time zone of the simulated city, defaults to the host's zone")
+    parser.add_argument('--sink', help="Write the events to a file instead of printing them, " +
+                                       "e.g. file:events.ndjson.gz, file:events.csv or file:events.parquet")
+    args = parser.parse_args()
+
     # Testing Callback
     def just_print(conn, obj, mil_time, source=""):
         print(mil_time, source)
@@ -413,17 +756,22 @@ if __name__ == "__main__":
         #print()
 
     # Example of usage
-    timestamp = 1571005498
+    timestamp = parse_time(args.start, args.timezone)
+    hours_to_simulate = args.hours
+    if args.end:
+        hours_to_simulate = (parse_time(args.end, args.timezone) - timestamp) / SECONDS_PER_HOUR
+        if hours_to_simulate <= 0:
+            parser.error("--end must be after --start")
     # This to data structures are defined in this module but they could be feed from outside
     # parking_config
     # percent_occupied_table
-    parking = Parking(None, parking_config, percent_occupied_table, timestamp, just_print)
-    print()
-    print()
-    hours_to_simulate = 24
-    parking.walk_through_sim(hours_to_simulate)
-
-
-
-
-
+    parking = Parking(None, parking_config * args.scale, percent_occupied_table, timestamp, just_print,
+                      seed=args.seed, tz=args.timezone)
+    if args.sink:
+        from sinks import make_sink, run_to_sink
+        events, seconds = run_to_sink(parking, hours_to_simulate, make_sink(args.sink))
+        print(f"Wrote {events} events to {args.sink} in {seconds:.2f}s ({events / seconds:.0f} events/s)")
+    else:
+        print()
+        print()
+        parking.walk_through_sim(hours_to_simulate)
@@ -0,0 +1,149 @@
+# IoT Parking Meter Simulation - occupancy profiles
+# By Aussie Schnore
+#
+# An occupancy profile is a 24 entry per hour percent occupied table, like
+# percent_occupied_table, optionally with a separate table for weekends. Each
+# table is interpolated once into a 1440 entry per minute curve so the
+# simulation only has to index it.
+#
+# Lots pick a profile by name with a "profile" key in their parking_config
+# entry (looked up in the 'profiles' mapping passed to Parking) or carry their
+# own with an "occupancy" key. A table is either a 24 entry list or
+#   {"weekday": [24 values], "weekend": [24 values]}
+# Lots with neither follow the Parking's percent_occupied_table. load_table()
+# and load_profiles() read a table or a {name: table} mapping from JSON files.
+
+import json
+
+MINUTES_PER_DAY = 24 * 60
+
+_numpy = False  # Not looked for yet, see load_numpy
+
+
+def load_numpy():
+    # The numpy module, or None when it isn't installed. NumPy is only
+    # imported the first time it is asked for, loading it takes longer than a
+    # short run does and most runs never need it.
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+def minute_curve(table):
+    # Percent occupied for every minute of the day, interpolated between the
+    # hourly entries and wrapping at midnight
+    if len(table) != 24:
+        raise ValueError(f"An occupancy table needs 24 hourly entries, got {len(table)}")
+    curve = []
+    for hour in range(24):
+        pcnt_start_hour = table[hour]
+        pcnt_delta = table[(hour + 1) % 24] - pcnt_start_hour
+        for minutes in range(60):
+            curve.append(pcnt_start_hour + pcnt_delta * (minutes / 60))
+    return curve
+
+
+class OccupancyProfile(object):
+    def __init__(self, weekday, weekend=None):
+        # curves[0] is for Monday to Friday, curves[1] for the weekend
+        weekday_curve = minute_curve(weekday)
+        self.curves = [weekday_curve, minute_curve(weekend) if weekend is not None else weekday_curve]
+
+    @classmethod
+    def from_table(cls, table):
+        # Profile from a 24 entry list or a weekday/weekend mapping
+        if isinstance(table, OccupancyProfile):
+            return table
+        if isinstance(table, dict):
+            if 'weekday' not in table:
+                raise ValueError("An occupancy table mapping needs a 'weekday' entry")
+            return cls(table['weekday'], table.get('weekend'))
+        return cls(table)
+
+    def pcnt(self, weekend, minute_of_day):
+        return self.curves[weekend][minute_of_day]
+
+
+class ProfileResolver(object):
+    # Hands out the profile number of each lot as the lots stream past.
+    # Profile 0 is the default, named and inline profiles are only built once
+    # each. Inline tables are matched by value, streamed lots never share the
+    # same table object.
+    def __init__(self, default_table, profiles=None):
+        self.named = profiles or {}
+        self.profiles = [OccupancyProfile.from_table(default_table)]
+        self.by_name = {}
+        self.by_table = {}
+
+    def profile_for(self, lot_config):
+        if 'occupancy' in lot_config:
+            table = lot_config['occupancy']
+            # OccupancyProfile objects are kept in self.profiles, so their id
+            # can't be reused
+            key = id(table) if isinstance(table, OccupancyProfile) else json.dumps(table, sort_keys=True)
+            if key not in self.by_table:
+                self.profiles.append(OccupancyProfile.from_table(table))
+                self.by_table[key] = len(self.profiles) - 1
+            return self.by_table[key]
+        if 'profile' in lot_config:
+            name = lot_config['profile']
+            if name not in self.by_name:
+                if name not in self.named:
+                    print(f"ERROR: Lot {lot_config['address']} uses the unknown occupancy profile {name}")
+                    raise ValueError(f"Unknown occupancy profile {name}")
+                self.profiles.append(OccupancyProfile.from_table(self.named[name]))
+                self.by_name[name] = len(self.profiles) - 1
+            return self.by_name[name]
+        return 0
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            print(f"ERROR: {path} isn't valid JSON")
+            raise ValueError(f"Bad occupancy table file {path}")
+
+
+def _check_table(table, path):
+    # Builds the table's profile once so a bad one is refused up front
+    try:
+        OccupancyProfile.from_table(table)
+    except (TypeError, ValueError) as error:
+        print(f"ERROR: {path} holds a bad occupancy table: {error}")
+        raise ValueError(f"Bad occupancy table in {path}")
+
+
+def load_table(path):
+    # One occupancy table from a JSON file, a 24 entry list or a
+    # weekday/weekend mapping, e.g. to replace percent_occupied_table
+    table = _read_json(path)
+    _check_table(table, path)
+    return table
+
+
+def load_profiles(path):
+    # Named occupancy profiles from a JSON file, {name: table}, for lots with
+    # a "profile" key
+    profiles = _read_json(path)
+    if not isinstance(profiles, dict):
+        print(f"ERROR: {path} should map profile names to occupancy tables")
+        raise ValueError(f"Bad occupancy profiles file {path}")
+    for table in profiles.values():
+        _check_table(table, path)
+    return profiles
+
+
+def profile_matrix(profile_list):
+    # All curves as one (profiles, 2, 1440) array for vectorized lookups,
+    # None without NumPy
+    numpy = load_numpy()
+    if numpy is None:
+        return None
+    return numpy.array([profile.curves for profile in profile_list], dtype=numpy.float64)
@@ -0,0 +1,379 @@
+# IoT Parking Meter Simulation - pipelined MQTT publishing
+# By Aussie Schnore
+#
+# Publishes spot events through an MQTT connection without waiting for each
+# PUBACK in turn. Up to 'window' publishes are kept in flight; when the window
+# is full the oldest one is waited on, which gives the simulation backpressure.
+# Events can optionally be packed several to a message as a JSON array, closed
+# off by count, payload size or linger time. QueuedPublisher moves the
+# publishing onto worker threads behind bounded queues.
+
+import bisect
+import collections
+import json
+import threading
+import time
+
+QUEUE_POLICIES = ["block", "drop-oldest"]
+# Upper bounds in seconds of the ack latency histogram buckets, 5% apart from
+# 10us to about 100s
+ACK_BUCKETS = [0.00001 * 1.05 ** n for n in range(331)]
+
+
+def event_address(obj):
+    # Address of the lot an event belongs to, spot events carry it in
+    # 'meter', lot reports at the top
+    return obj['meter']['address'] if 'meter' in obj else obj['address']
+
+
+def bucket_percentile(counts, pcnt, bounds=ACK_BUCKETS):
+    # Nearest rank percentile of a bucketed histogram, the upper bound of the
+    # bucket holding the value. counts[len(bounds)] holds what is above them.
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = int(round((pcnt / 100.0) * (total - 1)))
+    seen = 0
+    for position, count in enumerate(counts):
+        seen += count
+        if seen > rank:
+            return bounds[min(position, len(bounds) - 1)]
+    return bounds[-1]
+
+
+# Ack latencies of a publisher in fixed buckets, so a run of any length takes
+# the same memory. Percentiles are to within 5%.
+class LatencyHistogram(object):
+    def __init__(self):
+        self.lock = threading.Lock()  # Acks arrive on the connection's threads
+        self.counts = [0] * (len(ACK_BUCKETS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(ACK_BUCKETS, seconds)] += 1
+            self.count += 1
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self):
+        # Copy of the bucket counts, subtract an earlier one for the acks since
+        with self.lock:
+            return list(self.counts)
+
+    def percentile(self, pcnt):
+        return min(bucket_percentile(self.snapshot(), pcnt), self.max)
+
+
+class MqttPublisher(object):
+    def __init__(self, mqtt_connection, topic, qos, window=100, batch_size=1,
+                 batch_bytes=128 * 1024, linger=0.0, encoder=None, clock=time.monotonic):
+        self.mqtt_connection = mqtt_connection
+        self.encoder = encoder  # encoder.SpotEncoder, plain json.dumps when None
+        self.topic = topic
+        self.qos = qos
+        self.window = max(1, window)
+        self.batch_size = max(1, batch_size)
+        self.batch_bytes = batch_bytes
+        self.linger = linger
+        self.clock = clock
+        self.in_flight = collections.deque()
+        self.batch = []
+        self.batch_len = 0
+        self.batch_started = None
+        # Held while the batch or the in flight publishes change, the linger
+        # thread flushes from its own thread
+        self.lock = threading.RLock()
+        self.batch_waiting = threading.Condition(self.lock)
+        self.linger_thread = None
+        self.closed = False
+        # Stats
+        self.events = 0
+        self.messages = 0
+        self.bytes = 0
+        self.failures = 0
+        self.ack_latency = LatencyHistogram()
+        self.started = None
+        self.finished = None
+
+    def publish(self, obj):
+        # Queue one spot event, sending the batch when it is full
+        if self.encoder is None:
+            self.publish_encoded(json.dumps(obj))
+        else:
+            self.publish_encoded(self.encoder.encode(obj))
+
+    def publish_encoded(self, event_json, address=None):
+        # Same as publish for an event that is already JSON text or bytes.
+        # 'address' is only used by ShardedPublisher to pick the shard.
+        with self.lock:
+            if self.started is None:
+                self.started = self.clock()
+            now = self.clock()
+            if self.batch and self.linger > 0 and now - self.batch_started >= self.linger:
+                self.flush()
+            if self.batch and self.batch_len + len(event_json) + 1 > self.batch_bytes:
+                self.flush()
+            if not self.batch:
+                self.batch_started = now
+                if self.linger > 0 and self.batch_size > 1:
+                    self._start_linger()
+            self.batch.append(event_json)
+            self.batch_len += len(event_json) + 1
+            self.events += 1
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+
+    def _start_linger(self):
+        # Wake the linger thread for a new batch, starting it the first time
+        if self.linger_thread is None:
+            self.linger_thread = threading.Thread(target=self._linger_loop, daemon=True)
+            self.linger_thread.start()
+        self.batch_waiting.notify()
+
+    def _linger_loop(self):
+        # Sends a partly filled batch once it is 'linger' seconds old, even
+        # when no more events come (e.g. a quiet stretch under --pace realtime)
+        with self.batch_waiting:
+            while not self.closed:
+                if not self.batch:
+                    self.batch_waiting.wait()
+                    continue
+                wait = self.batch_started + self.linger - self.clock()
+                if wait > 0:
+                    self.batch_waiting.wait(wait)
+                else:
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        print(f"Publish failed: {e}")
+
+    def flush(self):
+        # Send whatever is in the current batch
+        with self.lock:
+            if not self.batch:
+                return
+            if self.batch_size == 1:
+                payload = self.batch[0]
+            elif self.encoder is not None:
+                payload = self.encoder.join(self.batch)
+            elif isinstance(self.batch[0], bytes):
+                payload = b"[" + b",".join(self.batch) + b"]"
+            else:
+                payload = "[" + ",".join(self.batch) + "]"
+            self.batch = []
+            self.batch_len = 0
+            self._send(payload)
+
+    def _send(self, payload):
+        while len(self.in_flight) >= self.window:
+            self._wait_oldest()
+        sent_at = self.clock()
+        future, _ = self.mqtt_connection.publish(
+            topic=self.topic,
+            payload=payload,
+            qos=self.qos)
+        future.add_done_callback(lambda f: self._on_ack(f, sent_at))
+        self.in_flight.append(future)
+        self.messages += 1
+        self.bytes += len(payload)
+
+    def _on_ack(self, future, sent_at):
+        # Runs on the connection's event loop thread when the publish completes
+        if future.exception() is None:
+            self.ack_latency.add(self.clock() - sent_at)
+        else:
+            self.failures += 1
+
+    def _wait_oldest(self):
+        future = self.in_flight.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Publish failed: {e}")
+
+    def close(self):
+        # Send the last batch and wait for every outstanding publish
+        with self.lock:
+            self.closed = True
+            self.batch_waiting.notify()
+            self.flush()
+            while self.in_flight:
+                self._wait_oldest()
+            self.finished = self.clock()
+
+    def stats(self):
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished or self.clock()) - self.started
+        latency = self.ack_latency
+        result = {}
+        result['events'] = self.events
+        result['messages'] = self.messages
+        result['bytes'] = self.bytes
+        result['failures'] = self.failures
+        result['seconds'] = round(elapsed, 3)
+        result['events_per_sec'] = round(self.events / elapsed, 1) if elapsed > 0 else 0.0
+        result['ack_ms_p50'] = round(latency.percentile(50) * 1000, 2)
+        result['ack_ms_p95'] = round(latency.percentile(95) * 1000, 2)
+        result['ack_ms_p99'] = round(latency.percentile(99) * 1000, 2)
+        result['ack_ms_max'] = round(latency.max * 1000, 2)
+        return result
+
+
+# Routes each event to the publisher of the shard that owns its lot, so every
+# shard publishes through its own connection and client ID like a separate
+# device would. Events are told apart by their lot's address, so every lot
+# needs its own.
+class ShardedPublisher(object):
+    def __init__(self, publishers, parking_config, lot_shard):
+        self.publishers = publishers
+        self.address_shard = {}
+        for lot, shard in zip(parking_config, lot_shard):
+            address = lot['address']
+            if address in self.address_shard:
+                print(f"ERROR: More than one lot has the address {address}, lots need their own address to be " +
+                      "spread over connections or publish workers")
+                raise ValueError(f"Duplicate lot address {address}")
+            self.address_shard[address] = shard
+
+    def publish(self, obj):
+        self.publishers[self.address_shard[event_address(obj)]].publish(obj)
+
+    def publish_encoded(self, event_json, address):
+        # Encoded events carry no readable address, so the caller passes it
+        self.publishers[self.address_shard[address]].publish_encoded(event_json)
+
+    def close(self):
+        for publisher in self.publishers:
+            publisher.flush()
+        for publisher in self.publishers:
+            publisher.close()
+
+    def stats(self):
+        shard_stats = [publisher.stats() for publisher in self.publishers]
+        result = {}
+        for key in ['events', 'messages', 'bytes', 'failures']:
+            result[key] = sum(s[key] for s in shard_stats)
+        result['seconds'] = max(s['seconds'] for s in shard_stats)
+        result['events_per_sec'] = round(result['events'] / result['seconds'], 1) if result['seconds'] > 0 else 0.0
+        result['ack_ms_p99_worst'] = max(s['ack_ms_p99'] for s in shard_stats)
+        result['shards'] = shard_stats
+        return result
+
+
+# Bounded FIFO between the simulation and one publisher worker. When it is
+# full 'block' makes put wait for room and 'drop-oldest' throws the oldest
+# waiting event away to make room.
+class PublishQueue(object):
+    def __init__(self, maxsize, policy="block"):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}, expected one of {QUEUE_POLICIES}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.items = collections.deque()
+        lock = threading.Lock()
+        self.not_empty = threading.Condition(lock)
+        self.not_full = threading.Condition(lock)
+        self.closed = False
+        # Stats
+        self.max_depth = 0
+        self.dropped = 0
+        self.blocked_seconds = 0.0  # Time put spent waiting for room
+        self.errors = 0  # Publishes the worker failed to make
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        with self.not_full:
+            if len(self.items) >= self.maxsize:
+                if self.policy == "drop-oldest":
+                    self.items.popleft()
+                    self.dropped += 1
+                else:
+                    start = time.monotonic()
+                    while len(self.items) >= self.maxsize:
+                        self.not_full.wait()
+                    self.blocked_seconds += time.monotonic() - start
+            self.items.append(item)
+            if len(self.items) > self.max_depth:
+                self.max_depth = len(self.items)
+            self.not_empty.notify()
+
+    def get(self):
+        # Next item, waiting for one, or None once closed and drained
+        with self.not_empty:
+            while not self.items and not self.closed:
+                self.not_empty.wait()
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.not_full.notify()
+            return item
+
+    def close(self):
+        # No more puts, get returns None once the queue is empty
+        with self.not_empty:
+            self.closed = True
+            self.not_empty.notify_all()
+
+
+# ShardedPublisher whose shards each publish from their own worker thread,
+# fed through a bounded PublishQueue of up to max_queue / shards events.
+# The simulation only pays for putting an event on a queue, so slow
+# publishes (TLS, proxies, broker throttling) don't hold it up until a queue
+# fills. A lot's events always go through the same worker and stay in order.
+class QueuedPublisher(ShardedPublisher):
+    def __init__(self, publishers, parking_config, lot_shard, max_queue=10000, policy="block"):
+        super(QueuedPublisher, self).__init__(publishers, parking_config, lot_shard)
+        self.queues = [PublishQueue(max_queue // len(publishers), policy) for _ in publishers]
+        self.workers = [threading.Thread(target=self._work, args=(publisher, queue), daemon=True)
+                        for publisher, queue in zip(publishers, self.queues)]
+        for worker in self.workers:
+            worker.start()
+
+    def _work(self, publisher, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            event, address = item
+            try:
+                if address is None:
+                    publisher.publish(event)
+                else:
+                    publisher.publish_encoded(event)
+            except Exception as e:
+                queue.errors += 1
+                print(f"Publish failed: {e}")
+
+    def publish(self, obj):
+        self.queues[self.address_shard[event_address(obj)]].put((obj, None))
+
+    def publish_encoded(self, event_json, address):
+        self.queues[self.address_shard[address]].put((event_json, address))
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self.queues)
+
+    def dropped(self):
+        return sum(queue.dropped for queue in self.queues)
+
+    def close(self):
+        # Let the workers drain their queues, then send the last batches and
+        # wait for the acks
+        for queue in self.queues:
+            queue.close()
+        for worker in self.workers:
+            worker.join()
+        super(QueuedPublisher, self).close()
+
+    def stats(self):
+        result = super(QueuedPublisher, self).stats()
+        result['queue_depth_max'] = max(queue.max_depth for queue in self.queues)
+        result['dropped'] = self.dropped()
+        result['blocked_seconds'] = round(sum(queue.blocked_seconds for queue in self.queues), 3)
+        result['worker_errors'] = sum(queue.errors for queue in self.queues)
+        return result
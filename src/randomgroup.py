@@ -3,49 +3,37 @@
 
 import random
 
-# From stackoverflow
-# https://stackoverflow.com/questions/2065553/get-all-numbers-that-add-up-to-a-number
-def _sum_to_n(n, size, limit=None):
-    """Produce all lists of `size` positive integers in decreasing order
-    that add up to `n`."""
-    if size == 1:
-        yield [n]
-        return
-    if limit is None:
-        limit = n
-    start = (n + size - 1) // size
-    stop = min(limit, n - size + 1) + 1
-    for i in range(start, stop):
-        for tail in _sum_to_n(n - i, size - 1, i):
-            yield [i] + tail
 
-def group_list(report_list, group_cnt):
+def group_list(report_list, group_cnt, rng=random):
     # Given a list of spot indexs group in to 'group_cnt' sublists
+    # 'rng' can be a random.Random instance to make the grouping repeatable
+    # The list is shuffled and cut into 'group_cnt' groups whose sizes differ
+    # by at most one, the larger groups landing on random slots. Runs in
+    # linear time and every entry in the result is a real spot index.
+    report_list = list(report_list)
+    rng.shuffle(report_list)
+    base_size, extra = divmod(len(report_list), group_cnt)
+    larger = set(rng.sample(range(group_cnt), extra))
     report_shedule = []
-    # Padding added to ensure there are enough values to create groups
-    # and to give randomness to how many are sent per time interval
-    padding = (group_cnt * 2) * [-200]
-    report_list = report_list + padding
-    random.shuffle(report_list)
-    list_len = len(report_list)
-    # Find groups 
-    n = list_len
-    size = group_cnt
-    list_of_lists = _sum_to_n(n, size)
-    groupings = next(list_of_lists)
-    # fill groups with index
     index = 0
-    for this_group_size in groupings:
-        this_group = report_list[index:index+this_group_size]
-        report_shedule.append(this_group)
+    for group in range(group_cnt):
+        this_group_size = base_size + 1 if group in larger else base_size
+        report_shedule.append(report_list[index:index+this_group_size])
         index = index+this_group_size
     return(report_shedule)
 
 
+def report_schedule(spot_cnt, interval_minutes, rng=random):
+    # Re-report schedule for 'spot_cnt' spots that each report once every
+    # 'interval_minutes' minutes. Entry n lists the spots reporting at the
+    # minutes where (local minutes since the epoch) % interval_minutes == n,
+    # see MilTimeConverter.local_minute.
+    if interval_minutes < 1:
+        raise ValueError(f"interval_minutes must be at least 1, got {interval_minutes}")
+    return group_list(range(spot_cnt), interval_minutes, rng)
+
 
 if __name__ == "__main__":
     # testing
-    report_list = range(50)
-    random.shuffle(report_list)
-
-    grped_list = group_list(report_list, 60)
+    grped_list = report_schedule(50, 60)
+    print([len(group) for group in grped_list])
@@ -0,0 +1,106 @@
+# IoT Parking Meter Simulation - local time conversion
+# By Aussie Schnore
+#
+# The simulation works in local 24 hour "mil time" (e.g. 1345 for 1:45 pm).
+# Converting every event timestamp with datetime.fromtimestamp is slow, so the
+# UTC offset is looked up once per UTC hour and mil time is worked out with
+# integer arithmetic. An hour that contains a DST change (its first and last
+# second have different offsets) is converted one timestamp at a time.
+
+import datetime
+import time
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+SECONDS_PER_HOUR = 60 * 60
+
+
+def _zone(tz):
+    # tz is a zone name ("America/Chicago"), a tzinfo, or None for the host's
+    # local zone
+    if isinstance(tz, str):
+        if ZoneInfo is None:
+            raise ImportError("Named time zones need Python 3.9+ (zoneinfo)")
+        return ZoneInfo(tz)
+    return tz
+
+
+def parse_time(value, tz=None):
+    # Epoch timestamp from an epoch number or an ISO 8601 date/time such as
+    # 2019-10-14T17:00. A date/time without a UTC offset is local time in
+    # 'tz', the simulated city's zone. A local time that occurs twice when
+    # the clocks go back is the first one, and one skipped when they go
+    # forward is read with the offset from before the change (2:30 becomes
+    # 3:30).
+    value = str(value).strip()
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        print(f"ERROR: Can't read {value} as a time, use an epoch timestamp or e.g. 2019-10-14T17:00")
+        raise ValueError(f"Bad time {value}")
+    if moment.tzinfo is None:
+        zone = _zone(tz)
+        if zone is None:
+            return int(moment.timestamp())
+        moment = moment.replace(tzinfo=zone)
+    return int(moment.timestamp())
+
+
+class MilTimeConverter(object):
+    def __init__(self, tz=None):
+        # tz is a zone name ("America/Chicago"), a tzinfo, or None for the
+        # host's local zone
+        self.tz = _zone(tz)
+        self._hour = None
+        self._offset = None
+        # Last minute converted, events arrive in runs with the same minute
+        self._minute = None
+        self._mil = None
+
+    def utc_offset(self, timestamp):
+        # Seconds east of UTC at 'timestamp'
+        if self.tz is None:
+            return time.localtime(timestamp).tm_gmtoff
+        return int(datetime.datetime.fromtimestamp(timestamp, self.tz).utcoffset().total_seconds())
+
+    def _offset_for(self, timestamp):
+        hour = timestamp // SECONDS_PER_HOUR
+        if hour != self._hour:
+            start = hour * SECONDS_PER_HOUR
+            first = self.utc_offset(start)
+            last = self.utc_offset(start + SECONDS_PER_HOUR - 1)
+            self._hour = hour
+            # None marks an hour with a DST change in it
+            self._offset = first if first == last else None
+        if self._offset is None:
+            return self.utc_offset(timestamp)
+        return self._offset
+
+    def local_minute(self, timestamp):
+        # Minutes since the epoch in local time, keeps counting across midnight
+        return (int(timestamp) + self._offset_for(int(timestamp))) // 60
+
+    def minute_of_day(self, timestamp):
+        # Local minute of the day, 0 to 1439
+        return self.local_minute(timestamp) % 1440
+
+    def is_weekend(self, timestamp):
+        # 1 on a local Saturday or Sunday, else 0. Day 0 of the epoch was a
+        # Thursday.
+        return 1 if (self.local_minute(timestamp) // 1440 + 3) % 7 >= 5 else 0
+
+    def mil_time(self, timestamp):
+        minute = timestamp // 60
+        if minute != self._minute:
+            hour, minute_of_hour = divmod(self.minute_of_day(timestamp), 60)
+            # An hour with a DST change can't be cached by UTC minute
+            self._minute = minute if self._offset is not None else None
+            self._mil = (hour * 100) + minute_of_hour
+        return self._mil
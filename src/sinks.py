@@ -0,0 +1,279 @@
+# IoT Parking Meter Simulation - file sinks
+# By Aussie Schnore
+#
+# Writes the simulated event stream to disk for offline pipeline testing.
+# Sinks take raw events (timestamp, source, spot) as yielded by
+# Parking.iter_events(hours, raw=True) and write them in large buffered
+# chunks. Formats are picked from the file name:
+#   .ndjson / .jsonl   one JSON message per line
+#   .csv               timestamp,lot_id,meter_number,isOccupied,source
+#   .parquet / .arrow  columnar record batches (needs pyarrow)
+#   .evlog             fixed width binary log for replay, see eventlog.py
+# and a trailing .gz or .zst compresses the text formats (.zst needs the
+# zstandard package).
+#
+# Every destination is picked by a sink URL, see parse_sink:
+#   stdout[:csv]                   NDJSON (or CSV) on standard output
+#   null                           discard, count only
+#   file:<path>                    one of the formats above
+#   mqtt-aws://<endpoint>[:port]   publish to AWS IoT Core
+#   mqtt-local://<host>[:port]     publish to a plain MQTT broker
+# The event sinks are built here, the MQTT ones are connections built by
+# transports.py, which only loads the AWS SDK when one is used.
+
+import array
+import gzip
+import io
+import os
+import sys
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# pyarrow takes longer to load than a short run takes, so it is only
+# imported when a columnar sink is made, see _load_pyarrow
+pyarrow = None
+
+from encoder import SpotEncoder
+from parky_sim import EVENT_SOURCES
+
+BUFFER_SIZE = 1024 * 1024
+SINK_FORMATS = ["ndjson", "csv", "parquet", "arrow", "evlog"]
+SINK_KINDS = ["stdout", "null", "file", "mqtt-aws", "mqtt-local"]
+MQTT_SINKS = ["mqtt-aws", "mqtt-local"]
+
+
+def open_output(path, compression=None):
+    # Binary file object with a large write buffer, compressed when asked.
+    # "-" is standard output, through its own descriptor so closing the sink
+    # leaves sys.stdout open.
+    if path == "-":
+        sys.stdout.flush()
+        raw = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    else:
+        raw = open(path, "wb")
+    if compression == "gz":
+        return io.BufferedWriter(gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6), BUFFER_SIZE), raw
+    if compression == "zst":
+        if zstandard is None:
+            raw.close()
+            raise ImportError("zstd compression needs the zstandard package (pip install zstandard)")
+        return io.BufferedWriter(zstandard.ZstdCompressor().stream_writer(raw), BUFFER_SIZE), raw
+    return io.BufferedWriter(raw, BUFFER_SIZE), raw
+
+
+def parse_file_name(path):
+    # Returns (format, compression) from the file name
+    name = path.lower()
+    compression = None
+    for suffix in ("gz", "zst"):
+        if name.endswith("." + suffix):
+            compression = suffix
+            name = name[:-len(suffix) - 1]
+    if name.endswith(".ndjson") or name.endswith(".jsonl") or name.endswith(".json"):
+        return "ndjson", compression
+    if name.endswith(".csv"):
+        return "csv", compression
+    if name.endswith(".parquet"):
+        return "parquet", compression
+    if name.endswith(".arrow") or name.endswith(".feather"):
+        return "arrow", compression
+    if name.endswith(".evlog"):
+        return "evlog", compression
+    raise ValueError(f"Can't tell the sink format of {path}, expected one of {SINK_FORMATS}")
+
+
+# Text sinks gather lines and hand them to the buffered writer in chunks
+class _TextSink(object):
+    def __init__(self, path, compression=None, chunk_events=4096):
+        self.out, self.raw = open_output(path, compression)
+        self.chunk_events = chunk_events
+        self.lines = []
+        self.events = 0
+
+    def write(self, timestamp, source, spot):
+        self.lines.append(self._line(timestamp, source, spot))
+        if len(self.lines) >= self.chunk_events:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.out.write(b"".join(self.lines))
+            self.events += len(self.lines)
+            self.lines = []
+
+    def close(self):
+        self.flush()
+        self.out.close()
+        if not self.raw.closed:
+            self.raw.close()
+
+
+class NdjsonSink(_TextSink):
+    def __init__(self, path, compression=None, encoder=None):
+        super(NdjsonSink, self).__init__(path, compression)
+        self.encoder = encoder or SpotEncoder("auto")
+
+    def _line(self, timestamp, source, spot):
+        return self.encoder.encode_spot(spot, timestamp) + b"\n"
+
+
+class CsvSink(_TextSink):
+    def __init__(self, path, compression=None):
+        super(CsvSink, self).__init__(path, compression)
+        self.out.write(b"timestamp,lot_id,meter_number,isOccupied,source\n")
+        self.sources = {source: source.encode() for source in EVENT_SOURCES}
+
+    def _line(self, timestamp, source, spot):
+        return b"%d,%d,%d,%d,%s\n" % (timestamp, spot.lot.lot_id, spot.number, spot.isOccupied,
+                                       self.sources.get(source) or source.encode())
+
+
+def _load_pyarrow():
+    global pyarrow
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet/Arrow output needs the pyarrow package (pip install pyarrow)")
+
+
+def _column(values, arrow_type, rows):
+    # Wrap a typed array.array's buffer as an Arrow array without copying
+    return pyarrow.Array.from_buffers(arrow_type, rows, [None, pyarrow.py_buffer(values)])
+
+
+# Columnar sink, events are gathered into typed arrays and written as one
+# record batch every 'batch_rows' events
+class ColumnarSink(object):
+    def __init__(self, path, file_format="parquet", batch_rows=256 * 1024):
+        _load_pyarrow()
+        self.file_format = file_format
+        self.batch_rows = batch_rows
+        self.source_codes = {source: code for code, source in enumerate(EVENT_SOURCES)}
+        self.source_names = list(EVENT_SOURCES)
+        self.schema = pyarrow.schema([
+            ("timestamp", pyarrow.int64()),
+            ("lot_id", pyarrow.int32()),
+            ("meter_number", pyarrow.int32()),
+            ("isOccupied", pyarrow.bool_()),
+            ("source", pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        ])
+        if file_format == "parquet":
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(path, self.schema)
+        self.events = 0
+        self._reset()
+
+    def _reset(self):
+        self.timestamps = array.array('q')
+        self.lot_ids = array.array('i')
+        self.numbers = array.array('i')
+        self.occupied = array.array('b')
+        self.sources = array.array('b')
+
+    def write(self, timestamp, source, spot):
+        # The source dictionary is fixed for the file, see EVENT_SOURCES
+        code = self.source_codes[source]
+        self.timestamps.append(timestamp)
+        self.lot_ids.append(spot.lot.lot_id)
+        self.numbers.append(spot.number)
+        self.occupied.append(spot.isOccupied)
+        self.sources.append(code)
+        if len(self.timestamps) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        rows = len(self.timestamps)
+        if rows == 0:
+            return
+        columns = [
+            _column(self.timestamps, pyarrow.int64(), rows),
+            _column(self.lot_ids, pyarrow.int32(), rows),
+            _column(self.numbers, pyarrow.int32(), rows),
+            _column(self.occupied, pyarrow.int8(), rows).cast(pyarrow.bool_()),
+            pyarrow.DictionaryArray.from_arrays(_column(self.sources, pyarrow.int8(), rows),
+                                                pyarrow.array(self.source_names, type=pyarrow.string())),
+        ]
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(columns, schema=self.schema))
+        self.events += rows
+        self._reset()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def make_file_sink(path):
+    file_format, compression = parse_file_name(path)
+    if file_format == "ndjson":
+        return NdjsonSink(path, compression)
+    if file_format == "csv":
+        return CsvSink(path, compression)
+    if compression is not None:
+        raise ValueError(f"{file_format} files can't be compressed, drop the .{compression} suffix")
+    if file_format == "evlog":
+        from eventlog import EventLogWriter
+        return EventLogWriter(path)
+    return ColumnarSink(path, file_format)
+
+
+class NullSink(object):
+    # Throws the events away, for measuring the simulation on its own
+    def __init__(self):
+        self.events = 0
+
+    def write(self, timestamp, source, spot):
+        self.events += 1
+
+    def close(self):
+        pass
+
+
+def parse_sink(spec):
+    # (kind, target) from a sink URL: the path for file, the format for
+    # stdout, (host, port or None) for the MQTT sinks, None for null
+    kind, _, target = spec.partition(":")
+    if kind not in SINK_KINDS:
+        raise ValueError(f"Unknown sink {spec}, expected one of {SINK_KINDS}")
+    if kind == "file":
+        if not target:
+            raise ValueError("The file sink needs a path, e.g. file:events.ndjson.gz")
+        return kind, target
+    if kind == "stdout":
+        if target not in ("", "ndjson", "csv"):
+            raise ValueError(f"stdout can take ndjson or csv, not {target}")
+        return kind, target or "ndjson"
+    if kind == "null":
+        return kind, None
+    host, _, port = target[2:].rstrip("/").partition(":") if target.startswith("//") else ("", "", "")
+    if not host:
+        raise ValueError(f"The {kind} sink needs a host, e.g. {kind}://localhost")
+    return kind, (host, int(port) if port else None)
+
+
+def make_sink(spec):
+    # Event sink from a "--sink" value, e.g. file:events.ndjson.gz or null
+    kind, target = parse_sink(spec)
+    if kind == "file":
+        return make_file_sink(target)
+    if kind == "stdout":
+        return CsvSink("-") if target == "csv" else NdjsonSink("-")
+    if kind == "null":
+        return NullSink()
+    raise ValueError(f"{kind} publishes over MQTT, build its connections with transports.py")
+
+
+def run_to_sink(parking, hours_to_simulate, sink):
+    # Stream a whole simulation into 'sink', returns (events, seconds)
+    start = time.perf_counter()
+    write = sink.write
+    for timestamp, source, spot in parking.iter_events(hours_to_simulate, raw=True):
+        write(timestamp, source, spot)
+    sink.close()
+    return sink.events, time.perf_counter() - start
@@ -0,0 +1,112 @@
+# IoT Parking Meter Simulation - MQTT transports
+# By Aussie Schnore
+#
+# Builds the MQTT connections for the mqtt-aws and mqtt-local sinks (see
+# sinks.py). The AWS IoT Device SDK (awscrt, awsiot) is only imported when
+# one of them is actually used, so runs that print, discard or write files,
+# or publish to the in-process fake broker, start without loading the native
+# library and work without the SDK installed.
+#
+#   mqtt-aws://<endpoint>[:port]   AWS IoT Core, mutual TLS (or websockets
+#                                  with SigV4 signing), port 8883 by default
+#   mqtt-local://<host>[:port]     a plain MQTT broker such as mosquitto, no
+#                                  TLS or credentials, port 1883 by default
+
+import os
+
+from fake_mqtt import FakeBroker, FakeMqttConnection
+
+TRANSPORTS = ["mqtt-aws", "mqtt-local"]
+DEFAULT_PORTS = {"mqtt-aws": 8883, "mqtt-local": 1883}
+# awscrt io.LogLevel names, listed here so the command line can be parsed
+# without importing awscrt
+LOG_LEVELS = ["NoLogs", "Fatal", "Error", "Warn", "Info", "Debug", "Trace"]
+# MQTT QoS 1, what the fake broker is given in place of mqtt.QoS.AT_LEAST_ONCE
+AT_LEAST_ONCE = 1
+
+
+def _load_sdk():
+    try:
+        from awscrt import io, mqtt
+    except ImportError:
+        print("ERROR: The mqtt-aws and mqtt-local sinks need the AWS IoT Device SDK (pip install awsiotsdk)")
+        raise
+    return io, mqtt
+
+
+def _client_bootstrap(connection_cnt, verbosity):
+    # One event loop thread per connection up to the core count
+    io, _ = _load_sdk()
+    io.init_logging(getattr(io.LogLevel, verbosity), 'stderr')
+    event_loop_group = io.EventLoopGroup(min(connection_cnt, os.cpu_count() or 1))
+    host_resolver = io.DefaultHostResolver(event_loop_group)
+    return io.ClientBootstrap(event_loop_group, host_resolver)
+
+
+# Callback when connection is accidentally lost.
+def on_connection_interrupted(connection, error, **kwargs):
+    print("Connection interrupted. error: {}".format(error))
+
+
+def aws_connections(endpoint, port, client_ids, cert=None, key=None, root_ca=None, use_websocket=False,
+                    signing_region='us-east-1', proxy_host=None, proxy_port=8080, verbosity="NoLogs"):
+    # Connections to AWS IoT Core, one per client ID
+    _load_sdk()
+    from awscrt import auth, http
+    from awsiot import mqtt_connection_builder
+    client_bootstrap = _client_bootstrap(len(client_ids), verbosity)
+    proxy_options = None
+    if proxy_host:
+        proxy_options = http.HttpProxyOptions(host_name=proxy_host, port=proxy_port)
+    connections = []
+    for client_id in client_ids:
+        if use_websocket:
+            credentials_provider = auth.AwsCredentialsProvider.new_default_chain(client_bootstrap)
+            connections.append(mqtt_connection_builder.websockets_with_default_aws_signing(
+                endpoint=endpoint,
+                client_bootstrap=client_bootstrap,
+                region=signing_region,
+                credentials_provider=credentials_provider,
+                http_proxy_options=proxy_options,
+                ca_filepath=root_ca,
+                on_connection_interrupted=on_connection_interrupted,
+                client_id=client_id,
+                clean_session=False,
+                keep_alive_secs=30))
+        else:
+            connections.append(mqtt_connection_builder.mtls_from_path(
+                endpoint=endpoint,
+                port=port,
+                cert_filepath=cert,
+                pri_key_filepath=key,
+                client_bootstrap=client_bootstrap,
+                ca_filepath=root_ca,
+                on_connection_interrupted=on_connection_interrupted,
+                client_id=client_id,
+                clean_session=False,
+                keep_alive_secs=30,
+                http_proxy_options=proxy_options))
+    return connections
+
+
+def local_connections(host, port, client_ids, verbosity="NoLogs"):
+    # Plain MQTT connections to a broker without TLS, one per client ID
+    _, mqtt = _load_sdk()
+    client = mqtt.Client(_client_bootstrap(len(client_ids), verbosity))
+    return [mqtt.Connection(client=client, host_name=host, port=port, client_id=client_id, clean_session=True,
+                            keep_alive_secs=30, on_connection_interrupted=on_connection_interrupted)
+            for client_id in client_ids]
+
+
+def fake_connections(client_ids, ack_delay=0.0):
+    # Connections to one shared in-process FakeBroker
+    broker = FakeBroker()
+    return [FakeMqttConnection(broker, client_id, ack_delay=ack_delay) for client_id in client_ids]
+
+
+def qos_at_least_once(fake=False):
+    # QoS 1 in the form the connections expect
+    if fake:
+        return AT_LEAST_ONCE
+    _, mqtt = _load_sdk()
+    return mqtt.QoS.AT_LEAST_ONCE
@@ -0,0 +1,53 @@
+# IoT Parking Meter Simulation - benchmark suite smoke test
+# By Aussie Schnore
+
+import collections
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+def test_suite_records_every_benchmark(tmp_path):
+    # A tiny run of the whole suite, checked through its --json records
+    results = tmp_path / "results.jsonl"
+    subprocess.run([sys.executable, "bench.py", "suite", "--spots", "200", "--hours", "0.2", "--events", "2000",
+                    "--sinks", "null,memory,file,mqtt-fake", "--json", str(results)],
+                   cwd=SRC, check=True, stdout=subprocess.DEVNULL)
+    records = collections.defaultdict(list)
+    for line in results.read_text().splitlines():
+        record = json.loads(line)
+        records[record['benchmark']].append(record)
+    assert set(records) == {"walk", "group-list", "encode", "publish", "spot-memory"}
+
+    # Every sink gets the same seeded run
+    walks = records['walk']
+    assert sorted(walk['sink'] for walk in walks) == ["file", "memory", "mqtt-fake", "null"]
+    assert len({walk['events'] for walk in walks}) == 1
+    assert walks[0]['events'] > 0
+    assert all(walk['peak_rss_kb'] > 0 for walk in walks)
+
+    assert {(record['impl'], record['interval']) for record in records['group-list']} == {
+        ("legacy", 60), ("direct", 5), ("direct", 15), ("direct", 60)}
+
+    # The encoders write the same compact JSON whatever the backend
+    encode_sizes = {record['method']: record['bytes_per_event'] for record in records['encode']}
+    json_sizes = {size for method, size in encode_sizes.items() if method in ("encoder-json", "encoder-orjson")}
+    assert len(json_sizes) == 1
+    assert json_sizes.pop() < encode_sizes['produce+dumps']
+
+    for record in records['publish']:
+        assert record['events'] == 2000
+        assert record['failures'] == 0
+        assert record['messages'] == 2000 // record['batch']
+
+    assert {record['layout'] for record in records['spot-memory']} == {"dict", "slots"}
+
+
+def test_unknown_sink_is_refused():
+    result = subprocess.run([sys.executable, "bench.py", "walk", "--sinks", "kafka"], cwd=SRC,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    assert result.returncode != 0
+    assert b"Unknown sink kafka" in result.stdout
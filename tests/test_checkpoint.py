@@ -0,0 +1,60 @@
+# IoT Parking Meter Simulation - snapshot and resume tests
+# By Aussie Schnore
+
+import pytest
+
+from checkpoint import Checkpointer, load_snapshot
+from parky_sim import DEFAULT_START, Parking, parking_config, percent_occupied_table
+
+HOURS = 5
+
+
+def _config(per_lot):
+    config = [dict(lot) for lot in parking_config * 10]
+    if per_lot:
+        for n, lot in enumerate(config[::3]):
+            lot['occupancy'] = [(hour * 7 + n) % 90 for hour in range(24)]
+    return config
+
+
+def _parking(config, checkpoint=None):
+    return Parking(None, config, percent_occupied_table, DEFAULT_START, None, seed=9, tz="America/Chicago",
+                   checkpoint=checkpoint)
+
+
+def _events(parking):
+    # (minute, timestamp, source, message) of every event
+    return [(parking.next_minute, timestamp, source, message)
+            for timestamp, source, message in parking.iter_events(HOURS)]
+
+
+@pytest.mark.parametrize("per_lot", [False, True])
+def test_snapshots_dont_change_the_run(tmp_path, per_lot):
+    config = _config(per_lot)
+    path = str(tmp_path / "state.snap")
+    checkpoint = Checkpointer(path, interval_minutes=90)
+    expected = _events(_parking(config))
+    assert _events(_parking(config, checkpoint)) == expected
+    assert checkpoint.snapshots == 3
+
+
+@pytest.mark.parametrize("per_lot", [False, True])
+def test_resume_matches_the_rest_of_the_run(tmp_path, per_lot):
+    config = _config(per_lot)
+    path = str(tmp_path / "state.snap")
+    checkpoint = Checkpointer(path, interval_minutes=90)
+    original = _events(_parking(config, checkpoint))
+
+    resumed = _parking(config)
+    minute = load_snapshot(resumed, path)
+    assert minute == 270
+    assert _events(resumed) == [event for event in original if event[0] >= minute]
+
+
+def test_snapshot_of_other_config_is_refused(tmp_path):
+    path = str(tmp_path / "state.snap")
+    parking = _parking(_config(False), Checkpointer(path, interval_minutes=60))
+    for _ in parking.iter_events(2):
+        pass
+    with pytest.raises(ValueError):
+        load_snapshot(_parking(_config(True)), path)
@@ -0,0 +1,29 @@
+# IoT Parking Meter Simulation - spot event encoding tests
+# By Aussie Schnore
+
+import json
+
+import pytest
+
+from encoder import SpotEncoder, orjson
+from parky_sim import Lot, Spot
+
+BACKENDS = ["json"] + (["orjson"] if orjson is not None else [])
+
+
+def _compact(obj):
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_lots_sharing_an_address(backend):
+    # Each lot keeps its own location though they share the address
+    lots = [Lot(0, "1 Main St, XYZ, AB", ["-75.5712", "-130.5355"]),
+            Lot(1, "1 Main St, XYZ, AB", ["-75.6000", "-130.6000"])]
+    spots = [Spot(lot, number, number % 2 == 0) for lot in lots for number in (1, 2)]
+    encoder = SpotEncoder(backend)
+    for timestamp in (1571005498, 1571005558):
+        for spot in spots:
+            expected = _compact(spot.produce(timestamp))
+            assert encoder.encode(spot.produce(timestamp)) == expected
+            assert encoder.encode_spot(spot, timestamp) == expected
@@ -0,0 +1,33 @@
+# IoT Parking Meter Simulation - engine equivalence tests
+# By Aussie Schnore
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from parky_numpy import NumpyParking  # noqa: E402
+from parky_sim import DEFAULT_START, Parking, parking_config, percent_occupied_table  # noqa: E402
+
+
+@pytest.mark.parametrize("seed, scale, hours", [(0, 1, 30), (7, 20, 30), (3, 100, 6)])
+def test_numpy_engine_matches_parking(seed, scale, hours):
+    # Same seed, same events in the same order
+    config = parking_config * scale
+    expected = Parking(None, config, percent_occupied_table, DEFAULT_START, None, seed=seed,
+                       tz="America/Chicago").iter_events(hours)
+    actual = NumpyParking(None, config, percent_occupied_table, DEFAULT_START, None, seed=seed,
+                          tz="America/Chicago").iter_events(hours)
+    assert list(actual) == list(expected)
+
+
+def test_numpy_engine_state_matches_parking():
+    config = parking_config * 20
+    parking = Parking(None, config, percent_occupied_table, DEFAULT_START, None, seed=5, tz="America/Chicago")
+    numpy_parking = NumpyParking(None, config, percent_occupied_table, DEFAULT_START, None, seed=5,
+                                 tz="America/Chicago")
+    for _ in parking.iter_events(12):
+        pass
+    for _ in numpy_parking.iter_events(12):
+        pass
+    assert numpy_parking.occupied.tolist() == [spot.isOccupied for spot in parking.spots]
+    assert numpy_parking.occupied_list == [parking.spots.index(spot) for spot in parking.index.occupied]
@@ -0,0 +1,115 @@
+# IoT Parking Meter Simulation - ensemble mode tests
+# By Aussie Schnore
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from ensemble import OCCUPANCY_BINS, EnsembleStats, _bin_percentile, histogram_percentile, run_replica
+from parky_sim import DEFAULT_START, EVENT_SOURCES, parking_config, percent_occupied_table
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+@pytest.mark.parametrize("engine", ["minute", "event"])
+def test_lots_without_meters(engine):
+    # Lots with a meter_count of 0 are accepted by Parking and the config
+    # loaders, they get no occupancy row
+    config = [dict(lot) for lot in parking_config * 3]
+    config[1]['meter_count'] = 0
+    config[-1]['meter_count'] = 0
+    stats = EnsembleStats(config, DEFAULT_START, 3, tz="America/Chicago")
+    for replica in range(2):
+        stats.add(run_replica(replica, config, percent_occupied_table, DEFAULT_START, 3, seed=1,
+                              tz="America/Chicago", engine=engine))
+    rows = stats.lot_rows()
+    assert [row['lot'] for row in rows] == [lot_id for lot_id, lot in enumerate(config) if lot['meter_count']]
+    assert stats.summary()['replicas'] == 2
+
+
+def test_histogram_percentile():
+    # Nearest rank, rank round(p% of (count - 1)) from the smallest
+    histogram = {value: 1 for value in range(1, 6)}
+    assert [histogram_percentile(histogram, pcnt) for pcnt in (0, 50, 95, 100)] == [1, 3, 5, 5]
+    # Ranks 0-2 are 10, rank 3 is 20: p50 is rank 2, p95 rank 3
+    assert histogram_percentile({20: 1, 10: 3}, 50) == 10
+    assert histogram_percentile({20: 1, 10: 3}, 95) == 20
+    assert histogram_percentile({}, 50) == 0
+
+
+def test_bin_percentile():
+    # 60s in the 0-9% bin, 30s at 20-29% and 10s full
+    bins = [60.0, 0.0, 30.0] + [0.0] * 7 + [10.0]
+    assert [_bin_percentile(bins, pcnt) for pcnt in (50, 60, 70, 90, 95)] == [0, 0, 20, 20, 100]
+    assert _bin_percentile([0.0] * OCCUPANCY_BINS, 50) == 0
+
+
+def test_hour_rows():
+    # One replica of 10 spots over two hours, sending m events in minute m of
+    # the first hour and none in the second, with 5 spots occupied all the
+    # first hour and minute // 6 in the second
+    config = [{'address': "1 Main St", 'meter_count': 4}, {'address': "2 Main St", 'meter_count': 6}]
+    stats = EnsembleStats(config, DEFAULT_START, 2, tz="America/Chicago")
+    events = []
+    for minute in range(120):
+        events += [minute if minute < 60 else 0] + [0] * (len(EVENT_SOURCES) - 1)
+    result = {}
+    result['events'] = events
+    result['occupied'] = [5] * 60 + [minute // 6 for minute in range(60)]
+    result['lot_seconds'] = [0.0] * (2 * OCCUPANCY_BINS)
+    result['peak_second'] = 3
+    result['event_count'] = sum(events)
+    result['seconds'] = 1.0
+    stats.add(result)
+    first, second = stats.hour_rows()
+    # DEFAULT_START is 17:24 CDT
+    assert first == {'hour': 0, 'local_time': "1724",
+                     'events_p50': 30, 'events_p95': 56, 'events_p99': 58, 'events_max': 59,
+                     'occupied_pct_p50': 50.0, 'occupied_pct_p95': 50.0, 'occupied_pct_p99': 50.0}
+    assert second == {'hour': 1, 'local_time': "1824",
+                      'events_p50': 0, 'events_p95': 0, 'events_p99': 0, 'events_max': 0,
+                      'occupied_pct_p50': 50.0, 'occupied_pct_p95': 90.0, 'occupied_pct_p99': 90.0}
+    assert stats.burst_rows()[0] == {'peak_per': "minute", 'p50': 59, 'p95': 59, 'p99': 59, 'max': 59}
+
+
+def _ensemble_summary(tmp_path, *options):
+    out = tmp_path / "summary.json"
+    subprocess.run([sys.executable, "ensemble.py", "--replicas", "2", "--processes", "1", "--hours", "1",
+                    "--timezone", "America/Chicago", "--json", str(out), *options],
+                   cwd=SRC, check=True, stdout=subprocess.DEVNULL)
+    return json.loads(out.read_text())
+
+
+def test_command_line_table_and_profiles(tmp_path):
+    # A flat 10% table, and 90% for the lots using the "busy" profile. The
+    # minute engine starts each lot on its own target.
+    table = tmp_path / "table.json"
+    table.write_text(json.dumps([10.0] * 24))
+    summary = _ensemble_summary(tmp_path, "--scale", "10", "--table", str(table))
+    assert summary['hours'][0]['occupied_pct_p50'] == pytest.approx(10.0, abs=1)
+
+    config = tmp_path / "lots.jsonl"
+    profiles = tmp_path / "profiles.json"
+    lots = [dict(lot) for lot in parking_config * 10]
+    for lot in lots[::2]:
+        lot['profile'] = "busy"
+    config.write_text("".join(json.dumps(lot) + "\n" for lot in lots))
+    profiles.write_text(json.dumps({'busy': {'weekday': [90.0] * 24, 'weekend': [90.0] * 24}}))
+    summary = _ensemble_summary(tmp_path, "--config", str(config), "--table", str(table),
+                                "--profiles", str(profiles))
+    busy = [row['occupied_pct_p50'] for row in summary['lot_occupancy'] if row['lot'] % 2 == 0]
+    quiet = [row['occupied_pct_p50'] for row in summary['lot_occupancy'] if row['lot'] % 2 == 1]
+    assert min(busy) >= 80
+    assert max(quiet) <= 20
+
+
+def test_command_line_bad_table_is_refused(tmp_path):
+    table = tmp_path / "table.json"
+    table.write_text(json.dumps([10.0] * 23))
+    run = subprocess.run([sys.executable, "ensemble.py", "--replicas", "1", "--table", str(table)],
+                         cwd=SRC, capture_output=True, text=True)
+    assert run.returncode != 0
+    assert "bad occupancy table" in run.stdout
@@ -0,0 +1,113 @@
+# IoT Parking Meter Simulation - discrete event engine tests
+# By Aussie Schnore
+
+import math
+import random
+
+import pytest
+
+from lotconfig import synthetic_city
+from parky_events import EventParking, make_dwell, make_residual
+from parky_sim import DEFAULT_START, percent_occupied_table
+
+SAMPLES = 40000
+
+
+def _mean(sample, n=SAMPLES):
+    return sum(sample() for _ in range(n)) / n
+
+
+def _parking(config, table=percent_occupied_table, seed=2, **kwargs):
+    return EventParking(None, config, table, DEFAULT_START, None, seed=seed, tz="America/Chicago", **kwargs)
+
+
+@pytest.mark.parametrize("distribution", ["lognormal", "exponential", "fixed"])
+def test_dwell_mean(distribution):
+    mean = _mean(make_dwell(random.Random(1), distribution, mean_minutes=45.0))
+    assert mean == pytest.approx(45.0 * 60, rel=0.03)
+
+
+@pytest.mark.parametrize("distribution, residual_minutes", [
+    # A uniform part of a length biased stay: E[X^2] / 2E[X]
+    ("lognormal", 45.0 * math.exp(0.8 * 0.8) / 2),
+    # Memoryless
+    ("exponential", 45.0),
+    ("fixed", 45.0 / 2),
+])
+def test_residual_dwell_mean(distribution, residual_minutes):
+    mean = _mean(make_residual(random.Random(1), distribution, mean_minutes=45.0, sigma=0.8))
+    assert mean == pytest.approx(residual_minutes * 60, rel=0.03)
+
+
+@pytest.mark.parametrize("distribution, mean_minutes", [("uniform", 90.0), ("lognormal", 0.0)])
+def test_bad_dwell_is_refused(distribution, mean_minutes):
+    with pytest.raises(ValueError):
+        make_dwell(random.Random(1), distribution, mean_minutes)
+
+
+def test_arrival_rate_follows_littles_law():
+    # A flat 60% held with 30 minute stays takes 0.6 N / 30 arrivals a minute
+    parking = _parking(list(synthetic_city(2000, seed=3)), table=[60.0] * 24, dwell="exponential", mean_dwell=30.0)
+    assert parking.percent_occupied() == 60.0
+    for curve in parking.arrival_rate[0]:
+        assert curve == pytest.approx([2000 * 0.6 / 30 / 60] * 1440)
+    arrivals = sum(1 for _, source, _ in parking.iter_events(6) if source == "Arrive")
+    assert arrivals == pytest.approx(2000 * 0.6 / 30 * 6 * 60, rel=0.05)
+    assert parking.percent_occupied() == pytest.approx(60.0, abs=3)
+
+
+def test_occupancy_tracks_the_table():
+    # Checked every half hour over a day, the fitted arrivals keep the
+    # occupancy close to percent_occupied_table as it rises and falls
+    parking = _parking(list(synthetic_city(3000, seed=3)), dwell="exponential", mean_dwell=30.0)
+    assert parking.percent_occupied() == pytest.approx(parking.percent_occupied_target(DEFAULT_START), abs=0.1)
+    check_at = DEFAULT_START + 30 * 60
+    checks = 0
+    for timestamp, _, _ in parking.iter_events(24):
+        if timestamp >= check_at:
+            assert parking.percent_occupied() == pytest.approx(parking.percent_occupied_target(timestamp), abs=5)
+            check_at += 30 * 60
+            checks += 1
+    assert checks == 47
+
+
+def test_events_are_ordered_and_consistent():
+    # Arrive only takes a vacant spot, Depart only frees an occupied one and
+    # every spot reports once an interval
+    config = list(synthetic_city(500, seed=4))
+    parking = _parking(config, report_interval=15)
+    occupied = {id(spot): spot.isOccupied for spot in parking.spots}
+    reports = dict.fromkeys(occupied, 0)
+    last = DEFAULT_START
+    for timestamp, source, spot in parking.iter_events(3, raw=True):
+        assert last <= timestamp < DEFAULT_START + 3 * 60 * 60
+        last = timestamp
+        if source == "Arrive":
+            assert not occupied[id(spot)]
+            occupied[id(spot)] = True
+        elif source == "Depart":
+            assert occupied[id(spot)]
+            occupied[id(spot)] = False
+        else:
+            reports[id(spot)] += 1
+        assert spot.isOccupied == occupied[id(spot)]
+    assert set(reports.values()) == {3 * 60 // 15}
+
+
+def test_lots_follow_their_own_profiles():
+    # Every profile gets its own arrivals, so half the lots held at 5% (by
+    # name) and the other half at 80% (inline) stay there instead of
+    # following the default table
+    config = list(synthetic_city(3000, seed=3))
+    for lot_id, lot in enumerate(config):
+        if lot_id % 2:
+            lot['profile'] = "quiet"
+        else:
+            lot['occupancy'] = [80.0] * 24
+    parking = _parking(config, profiles={"quiet": [5.0] * 24})
+    for _ in parking.iter_events(12):
+        pass
+    for odd, pcnt in [(1, 5.0), (0, 80.0)]:
+        spots = [spot for spot in parking.spots if spot.lot.lot_id % 2 == odd]
+        occupied = sum(spot.isOccupied for spot in spots)
+        assert 100.0 * occupied / len(spots) == pytest.approx(pcnt, abs=3)
@@ -0,0 +1,62 @@
+# IoT Parking Meter Simulation - publishing over the fake broker
+# By Aussie Schnore
+
+import collections
+import time
+
+from lotconfig import synthetic_city
+from pacing import NoPacing
+from parky_sim import DEFAULT_START, Parking, partition_lots, percent_occupied_table
+from publisher import MqttPublisher, ShardedPublisher, event_address
+from transports import AT_LEAST_ONCE, fake_connections
+
+
+def test_lots_routed_over_connections():
+    # Every event goes out on the connection of the shard its lot is in
+    config = list(synthetic_city(300, seed=1))
+    client_ids = [f"sim-{n}" for n in range(4)]
+    connections = fake_connections(client_ids, ack_delay=0.001)
+    for connection in connections:
+        connection.connect().result()
+    broker = connections[0].broker
+    lot_shard = partition_lots(config, len(connections))
+    publisher = ShardedPublisher([MqttPublisher(connection, "test/topic", AT_LEAST_ONCE, window=20)
+                                  for connection in connections], config, lot_shard)
+    shard_of = {lot['address']: shard for lot, shard in zip(config, lot_shard)}
+    expected = collections.Counter()
+
+    def callback(conn, obj, mil_time, source):
+        expected[client_ids[shard_of[event_address(obj)]]] += 1
+        conn.publish(obj)
+
+    parking = Parking(publisher, config, percent_occupied_table, DEFAULT_START, callback, seed=3, pacer=NoPacing(),
+                      tz="America/Chicago")
+    parking.walk_through_sim(2)
+    publisher.close()
+    for connection in connections:
+        connection.disconnect().result()
+
+    total = sum(expected.values())
+    assert total > 0
+    assert broker.by_client == dict(expected)
+    assert set(broker.by_client) == set(client_ids)
+    assert broker.messages == total
+    stats = publisher.stats()
+    assert stats['events'] == stats['messages'] == total
+    assert stats['failures'] == 0
+
+
+def test_publishes_are_acked_concurrently():
+    # With a window of 50 the acks of 200 publishes overlap, one at a time
+    # they would take 200 x 20ms
+    connection = fake_connections(["sim"], ack_delay=0.02)[0]
+    connection.connect().result()
+    publisher = MqttPublisher(connection, "test/topic", AT_LEAST_ONCE, window=50)
+    start = time.monotonic()
+    for n in range(200):
+        publisher.publish({'n': n, 'meter': {'address': "x"}})
+    publisher.close()
+    elapsed = time.monotonic() - start
+    connection.disconnect().result()
+    assert elapsed < 1.0
+    assert publisher.stats()['ack_ms_p50'] < 100
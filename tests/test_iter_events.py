@@ -0,0 +1,67 @@
+# IoT Parking Meter Simulation - pull based event stream tests
+# By Aussie Schnore
+
+import asyncio
+
+from pacing import NoPacing
+from parky_sim import DEFAULT_START, Parking, parking_config, percent_occupied_table
+
+CONFIG = parking_config * 3
+
+
+def _parking(ext_callback=None):
+    return Parking(None, CONFIG, percent_occupied_table, DEFAULT_START, ext_callback, seed=6, pacer=NoPacing(),
+                   tz="America/Chicago")
+
+
+def _callback_events(hours):
+    events = []
+
+    def callback(conn, obj, mil_time, source):
+        events.append((obj['timestamp'], source, obj))
+
+    _parking(callback).walk_through_sim(hours)
+    return events
+
+
+def test_iter_events_matches_callback():
+    expected = _callback_events(4)
+    assert len(expected) > 0
+    assert list(_parking().iter_events(4)) == expected
+
+
+def test_raw_events_are_spots():
+    # The Spot is handed over as it is right after the event
+    expected = _callback_events(2)
+    raw = [(timestamp, source, spot.produce(timestamp))
+           for timestamp, source, spot in _parking().iter_events(2, raw=True)]
+    assert raw == expected
+
+
+def test_iter_events_is_lazy():
+    # Taking a few events only simulates as far as needed
+    parking = _parking()
+    events = parking.iter_events(24)
+    first = [next(events) for _ in range(5)]
+    assert parking.next_minute == 0
+    assert all(DEFAULT_START <= event[0] < DEFAULT_START + 60 for event in first)
+
+
+def test_aiter_events_matches_iter_events():
+    async def collect():
+        # Another task gets to run while the simulation streams
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0)
+
+        task = asyncio.ensure_future(ticker())
+        events = [event async for event in _parking().aiter_events(4, yield_every=50)]
+        task.cancel()
+        return events, ticks
+
+    events, ticks = asyncio.run(collect())
+    assert events == list(_parking().iter_events(4))
+    assert len(ticks) >= len(events) // 50
@@ -0,0 +1,136 @@
+# IoT Parking Meter Simulation - lot config file and synthetic city tests
+# By Aussie Schnore
+
+import json
+import math
+import os
+import subprocess
+import sys
+
+import pytest
+
+from lotconfig import CITY_CENTER, KM_PER_DEGREE, config_format, load_lots, lot_sizes, synthetic_city, write_lots
+from parky_sim import DEFAULT_START, Parking, percent_occupied_table
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+PROFILES = {"downtown": 3, "suburb": 1}
+
+
+@pytest.mark.parametrize("name", ["city.jsonl", "city.ndjson.gz", "city.csv", "city.csv.gz"])
+def test_write_and_load_round_trip(tmp_path, name):
+    lots = list(synthetic_city(2000, seed=1, profiles=PROFILES))
+    path = str(tmp_path / name)
+    assert write_lots(iter(lots), path) == (len(lots), 2000)
+    assert list(load_lots(path)) == lots
+
+
+def test_loaded_lots_give_the_same_run(tmp_path):
+    path = str(tmp_path / "city.jsonl.gz")
+    write_lots(synthetic_city(1000, seed=2), path)
+    runs = [list(Parking(None, config, percent_occupied_table, DEFAULT_START, None, seed=3,
+                         tz="America/Chicago").iter_events(2))
+            for config in (list(synthetic_city(1000, seed=2)), load_lots(path))]
+    assert runs[0] == runs[1]
+
+
+@pytest.mark.parametrize("name, lines", [
+    ("lots.jsonl", ['{"address": "1 Main St", "meter_count": 3}', '{"address": "2 Main St"}']),
+    ("lots.csv", ["address,latitude,longitude,meter_count", "1 Main St,41.1,-87.1,3", "2 Main St,41.2,-87.2,many"]),
+])
+def test_bad_lot_is_refused_when_reached(tmp_path, name, lines):
+    # Lots are read one at a time, the good lot comes out before the bad one
+    # is found
+    path = tmp_path / name
+    path.write_text("\n".join(lines) + "\n")
+    lots = load_lots(str(path))
+    assert next(lots)['meter_count'] == 3
+    with pytest.raises(ValueError):
+        next(lots)
+
+
+def test_config_format():
+    assert config_format("CITY.JSONL.GZ") == "jsonl"
+    assert config_format("city.csv") == "csv"
+    with pytest.raises(ValueError):
+        config_format("city.json")
+
+
+def test_jsonl_defaults(tmp_path):
+    # A missing location becomes ["0", "0"], blank lines are skipped
+    path = tmp_path / "lots.jsonl"
+    path.write_text('{"address": "1 Main St", "meter_count": 3}\n\n{"address": "2 Main St", "meter_count": 1}\n')
+    lots = list(load_lots(str(path)))
+    assert lot_sizes(lots) == [{'address': "1 Main St", 'meter_count': 3}, {'address': "2 Main St", 'meter_count': 1}]
+    assert lots[0]['location'] == ["0", "0"]
+
+
+def test_synthetic_city_is_repeatable():
+    city = list(synthetic_city(5000, seed=4, profiles=PROFILES))
+    assert list(synthetic_city(5000, seed=4, profiles=PROFILES)) == city
+    assert list(synthetic_city(5000, seed=5, profiles=PROFILES)) != city
+    assert len({lot['address'] for lot in city}) == len(city)
+    assert {lot['profile'] for lot in city} == set(PROFILES)
+
+
+@pytest.mark.parametrize("distribution", ["lognormal", "uniform", "fixed"])
+@pytest.mark.parametrize("meters", [1, 7, 100000])
+def test_synthetic_city_meter_total(distribution, meters):
+    sizes = [lot['meter_count'] for lot in synthetic_city(meters, seed=6, size_distribution=distribution)]
+    assert sum(sizes) == meters
+    assert min(sizes) >= 1
+
+
+def test_synthetic_city_lot_sizes():
+    # Every lot but the last, which gets what is left
+    fixed = [lot['meter_count'] for lot in synthetic_city(1000, size_distribution="fixed", mean_size=12.4)]
+    assert set(fixed[:-1]) == {12}
+    assert fixed[-1] == 1000 - 12 * (len(fixed) - 1)
+    uniform = [lot['meter_count'] for lot in synthetic_city(100000, size_distribution="uniform", mean_size=12.0)]
+    assert set(uniform[:-1]) == set(range(1, 24))
+    lognormal = [lot['meter_count'] for lot in synthetic_city(200000, seed=7, mean_size=12.0)]
+    assert sum(lognormal) / len(lognormal) == pytest.approx(12.0, rel=0.05)
+
+
+def test_synthetic_city_stays_within_radius():
+    center_lat, center_lon = CITY_CENTER
+    km_per_lon_degree = KM_PER_DEGREE * math.cos(math.radians(center_lat))
+    for lot in synthetic_city(5000, seed=8, radius_km=3.0):
+        lat, lon = (float(value) for value in lot['location'])
+        distance = math.hypot((lat - center_lat) * KM_PER_DEGREE, (lon - center_lon) * km_per_lon_degree)
+        # The locations are rounded to 4 decimal places, about 10m
+        assert distance <= 3.0 + 0.02
+
+
+@pytest.mark.parametrize("kwargs", [{'size_distribution': "pareto"}, {'mean_size': 0.5}])
+def test_bad_synthetic_city_is_refused(kwargs):
+    with pytest.raises(ValueError):
+        next(synthetic_city(100, **kwargs))
+
+
+def _meters_sent(path):
+    # (address, meter number) of every event in an NDJSON file
+    with open(path) as f:
+        return {(event['meter']['address'], event['meter']['number']) for event in map(json.loads, f)}
+
+
+def test_command_line_config_paths(tmp_path):
+    # lotconfig.py writes a city, parkingspot.py runs it from the file and
+    # generated with --synthetic-meters. An hour of reports covers every meter.
+    city = str(tmp_path / "city.csv.gz")
+    subprocess.run([sys.executable, "lotconfig.py", "--meters", "300", "--seed", "2", "--out", city],
+                   cwd=SRC, check=True, stdout=subprocess.DEVNULL)
+    expected = {(lot['address'], number) for lot in synthetic_city(300, seed=2)
+                for number in range(1, lot['meter_count'] + 1)}
+    assert len(expected) == 300
+    lot_sources = {'config': ["--config", city], 'synthetic': ["--synthetic-meters", "300", "--city-seed", "2"]}
+    for name, lot_args in lot_sources.items():
+        out = str(tmp_path / f"{name}.ndjson")
+        subprocess.run([sys.executable, "parkingspot.py", *lot_args, "--hours", "1", "--sink", f"file:{out}"],
+                       cwd=SRC, check=True, stdout=subprocess.DEVNULL)
+        assert _meters_sent(out) == expected
+
+    both = subprocess.run([sys.executable, "parkingspot.py", "--config", city, "--synthetic-meters", "300",
+                           "--sink", "null"], cwd=SRC, capture_output=True, text=True)
+    assert both.returncode != 0
+    assert "can't be used together" in both.stderr
@@ -0,0 +1,55 @@
+# IoT Parking Meter Simulation - lot level status report tests
+# By Aussie Schnore
+
+import base64
+import collections
+
+import pytest
+
+from lotconfig import synthetic_city
+from lotreport import LotReporter
+from parky_sim import DEFAULT_START, Parking, percent_occupied_table
+
+
+def _occupancy(parking, lot):
+    first = sum(parking.lot_meters[:lot.lot_id])
+    return [spot.isOccupied for spot in parking.spots[first:first + parking.lot_meters[lot.lot_id]]]
+
+
+def _bitmap_occupancy(message):
+    bits = int.from_bytes(base64.b64decode(message['bitmap']), "little")
+    return [bool(bits >> meter & 1) for meter in range(message['meters'])]
+
+
+@pytest.mark.parametrize("mode", ["lot", "delta"])
+def test_reports_rebuild_lot_occupancy(mode):
+    # Every report, applied to what the earlier ones said, gives the lot's
+    # occupancy at that moment
+    config = list(synthetic_city(3000, seed=2))
+    parking = Parking(None, config, percent_occupied_table, DEFAULT_START, None, seed=4, tz="America/Chicago",
+                      report_interval=5, lot_reports=LotReporter(mode, keyframe_every=6))
+    rebuilt = {}
+    kinds = collections.Counter()
+    for timestamp, source, status in parking.iter_events(6, raw=True):
+        if source != "LotReport":
+            continue
+        lot = status.lot
+        message = status.produce(timestamp)
+        if 'bitmap' in message:
+            rebuilt[lot.lot_id] = _bitmap_occupancy(message)
+            if mode == "delta" and message['seq'] % 6 != 0:
+                kinds['fallback'] += 1
+        else:
+            occupancy = rebuilt[lot.lot_id]
+            for number in message['changed']:
+                occupancy[number - 1] = not occupancy[number - 1]
+            kinds['delta'] += 1
+        assert rebuilt[lot.lot_id] == _occupancy(parking, lot)
+        assert message['occupied'] == sum(rebuilt[lot.lot_id])
+        assert message['meters'] == parking.lot_meters[lot.lot_id]
+        kinds['reports'] += 1
+    # Every lot reports once every 5 minutes
+    assert kinds['reports'] == len(config) * 6 * 60 // 5
+    if mode == "delta":
+        assert kinds['delta'] > 0
+        assert kinds['fallback'] > 0
@@ -0,0 +1,107 @@
+# IoT Parking Meter Simulation - run metrics tests
+# By Aussie Schnore
+
+import collections
+import io
+import json
+import re
+import urllib.request
+
+from metrics import SimMetrics
+from pacing import NoPacing
+from parky_sim import DEFAULT_START, Parking, parking_config, percent_occupied_table
+from publisher import MqttPublisher
+from transports import AT_LEAST_ONCE, fake_connections
+
+SAMPLE = re.compile(r'^([a-z0-9_]+)(\{([a-z]+)="([^"]*)"\})? (\S+)$')
+TYPE_SUFFIXES = {'counter': ("",), 'gauge': ("",), 'histogram': ("_bucket", "_sum", "_count")}
+
+
+def _parse(text):
+    # {metric name: {label value or None: value}} from exposition text, with
+    # every sample checked against the TYPE line of its family
+    types = {}
+    samples = collections.defaultdict(dict)
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, family, metric_type = line.split(" ")
+            assert metric_type in TYPE_SUFFIXES, line
+            assert family not in types, line
+            types[family] = metric_type
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name, _, label, label_value, value = match.groups()
+        family = [family for family in types if any(name == family + suffix
+                                                    for suffix in TYPE_SUFFIXES[types[family]])]
+        assert family, f"{name} has no TYPE line"
+        if label is not None:
+            assert (label, types[family[0]]) in [("source", "counter"), ("phase", "counter"), ("le", "histogram")]
+        samples[name][label_value] = float(value)
+    return types, samples
+
+
+def _run(publisher=None, connection=None):
+    stats_out = io.StringIO()
+    metrics = SimMetrics(interval=0, stats_out=stats_out, publisher=publisher)
+    sources = collections.Counter()
+
+    def callback(conn, obj, mil_time, source):
+        sources[source] += 1
+        if conn is not None:
+            conn.publish(obj)
+
+    parking = Parking(publisher, parking_config * 2, percent_occupied_table, DEFAULT_START, callback, seed=2,
+                      pacer=NoPacing(), tz="America/Chicago", metrics=metrics)
+    parking.walk_through_sim(2)
+    if publisher is not None:
+        publisher.close()
+        metrics.report()
+    return metrics, sources, stats_out.getvalue()
+
+
+def test_exposition_types_and_counters():
+    metrics, sources, stats = _run()
+    types, samples = _parse(metrics.prom_text)
+    assert types == {
+        'parky_events_total': "counter",
+        'parky_phase_seconds_total': "counter",
+        'parky_callback_seconds': "histogram",
+        'parky_sim_seconds': "gauge",
+        'parky_wall_seconds': "gauge",
+    }
+    total = sum(sources.values())
+    assert {source: int(count) for source, count in samples['parky_events_total'].items() if count} == sources
+    assert samples['parky_callback_seconds_count'][None] == total
+    buckets = list(samples['parky_callback_seconds_bucket'].values())
+    assert buckets == sorted(buckets)
+    assert samples['parky_callback_seconds_bucket']['+Inf'] == total
+    assert set(samples['parky_phase_seconds_total']) == {"occupancy", "re_report", "swaps", "callback"}
+    # One JSON stats line at the end, with the same counts
+    lines = stats.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['events'] == total
+
+
+def test_exposition_with_publisher():
+    connection = fake_connections(["sim"])[0]
+    connection.connect().result()
+    publisher = MqttPublisher(connection, "test/topic", AT_LEAST_ONCE, window=10)
+    metrics, sources, _ = _run(publisher)
+    connection.disconnect().result()
+    types, samples = _parse(metrics.prom_text)
+    assert types['parky_publish_ack_ms_p50'] == "gauge"
+    assert types['parky_publish_ack_ms_p99'] == "gauge"
+    assert types['parky_publish_failures_total'] == "counter"
+    assert samples['parky_publish_failures_total'][None] == 0
+    assert samples['parky_publish_in_flight'][None] == 0
+
+
+def test_metrics_served_over_http():
+    metrics, _, _ = _run()
+    server = metrics.serve(0, "127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.read().decode() == metrics.prom_text
+    finally:
+        server.shutdown()
@@ -0,0 +1,93 @@
+# IoT Parking Meter Simulation - event pacing tests
+# By Aussie Schnore
+
+import pytest
+
+from pacing import FixedPause, NoPacing, RealTimePacer, TokenBucketPacer, make_pacer
+
+
+class _FakeClock(object):
+    # Wall clock that only moves when slept on, each sleep running
+    # 'oversleep' seconds longer than asked
+    def __init__(self, oversleep=0.0):
+        self.now = 100.0
+        self.oversleep = oversleep
+        self.slept = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds + self.oversleep
+
+
+def test_realtime_pacer_follows_simulated_time():
+    fake = _FakeClock()
+    pacer = RealTimePacer(speed=60, clock=fake.clock, sleep=fake.sleep)
+    start = fake.now
+    for timestamp in [1000, 1000, 1060, 1090, 1090, 1600]:
+        pacer.wait(timestamp)
+        # Each event goes out when its simulated time comes due at 60x
+        assert fake.now == pytest.approx(start + (timestamp - 1000) / 60)
+    assert len(fake.slept) == 3
+
+
+def test_realtime_pacer_doesnt_wait_when_behind():
+    fake = _FakeClock()
+    pacer = RealTimePacer(speed=1, clock=fake.clock, sleep=fake.sleep)
+    pacer.wait(1000)
+    fake.now += 30  # The callback took longer than simulated time moved on
+    pacer.wait(1010)
+    assert fake.slept == []
+    with pytest.raises(ValueError):
+        RealTimePacer(speed=0)
+
+
+def test_token_bucket_burst_then_rate():
+    fake = _FakeClock()
+    pacer = TokenBucketPacer(rate=10, burst=5, clock=fake.clock, sleep=fake.sleep)
+    for _ in range(5):
+        pacer.wait(0)
+    # The burst goes out at once
+    assert fake.slept == []
+    pacer.wait(0)
+    assert fake.slept == [pytest.approx(0.1)]
+    for _ in range(94):
+        pacer.wait(0)
+    # 5 in the burst then 95 at 10 a second
+    assert fake.now - 100.0 == pytest.approx(9.5)
+
+
+def test_token_bucket_refills_while_idle():
+    fake = _FakeClock()
+    pacer = TokenBucketPacer(rate=10, burst=3, clock=fake.clock, sleep=fake.sleep)
+    for _ in range(3):
+        pacer.wait(0)
+    fake.now += 60  # Idle long enough to fill the bucket, but no more
+    for _ in range(3):
+        pacer.wait(0)
+    assert fake.slept == []
+    pacer.wait(0)
+    assert len(fake.slept) == 1
+
+
+def test_token_bucket_credits_oversleep():
+    # Sleeps running 50ms over must not slow the long run rate down: the
+    # extra time is credited as tokens
+    fake = _FakeClock(oversleep=0.05)
+    pacer = TokenBucketPacer(rate=100, burst=10, clock=fake.clock, sleep=fake.sleep)
+    for _ in range(1010):
+        pacer.wait(0)
+    assert 1000 / (fake.now - 100.0) == pytest.approx(100, rel=0.02)
+
+
+def test_make_pacer():
+    assert isinstance(make_pacer("fast"), NoPacing)
+    assert make_pacer("fixed", pause=0.5).pause == 0.5
+    assert make_pacer("realtime", speed=30).speed == 30
+    pacer = make_pacer("rate", rate=50, burst=4)
+    assert (pacer.rate, pacer.burst) == (50, 4)
+    assert isinstance(make_pacer("fixed"), FixedPause)
+    with pytest.raises(ValueError):
+        make_pacer("warp")
@@ -0,0 +1,125 @@
+# IoT Parking Meter Simulation - sharded and queued publisher tests
+# By Aussie Schnore
+
+import collections
+import json
+import threading
+import time
+
+import pytest
+
+from fake_mqtt import FakeBroker, FakeMqttConnection
+from publisher import MqttPublisher, PublishQueue, QueuedPublisher, ShardedPublisher
+from transports import AT_LEAST_ONCE
+
+LOTS = [{'address': f"{n} Test St"} for n in range(4)]
+
+
+class _RecordingConnection(FakeMqttConnection):
+    # Fake connection that keeps the payloads it was sent
+    def __init__(self, broker, client_id, ack_delay):
+        super(_RecordingConnection, self).__init__(broker, client_id, ack_delay=ack_delay)
+        self.payloads = []
+
+    def publish(self, topic, payload, qos, retain=False):
+        self.payloads.append(json.loads(payload))
+        return super(_RecordingConnection, self).publish(topic, payload, qos, retain)
+
+
+def _queued_publisher(policy, max_queue, ack_delay=0.002):
+    # Two shards, each publishing one event at a time with a slow ack
+    broker = FakeBroker()
+    connections = [_RecordingConnection(broker, f"sim-{n}", ack_delay) for n in range(2)]
+    for connection in connections:
+        connection.connect().result()
+    publishers = [MqttPublisher(connection, "test/topic", AT_LEAST_ONCE, window=1) for connection in connections]
+    return QueuedPublisher(publishers, LOTS, [0, 1, 0, 1], max_queue=max_queue, policy=policy), connections
+
+
+def _publish_all(publisher, per_lot):
+    for n in range(per_lot):
+        for lot in LOTS:
+            publisher.publish({'n': n, 'meter': {'address': lot['address']}})
+
+
+def _received(connections):
+    # Numbers received for each lot, in the order they arrived
+    by_lot = collections.defaultdict(list)
+    for connection in connections:
+        for payload in connection.payloads:
+            by_lot[payload['meter']['address']].append(payload['n'])
+    return by_lot
+
+
+def test_drop_oldest_queue_discards_oldest():
+    queue = PublishQueue(3, "drop-oldest")
+    for n in range(5):
+        queue.put(n)
+    assert list(queue.items) == [2, 3, 4]
+    assert queue.dropped == 2
+    queue.close()
+    assert [queue.get() for _ in range(4)] == [2, 3, 4, None]
+
+
+def test_block_queue_waits_for_room():
+    queue = PublishQueue(2, "block")
+    queue.put(0)
+    queue.put(1)
+    putter = threading.Thread(target=queue.put, args=(2,))
+    putter.start()
+    putter.join(0.05)
+    assert putter.is_alive()
+    assert queue.get() == 0
+    putter.join(1.0)
+    assert not putter.is_alive()
+    assert list(queue.items) == [1, 2]
+    assert queue.blocked_seconds > 0
+
+
+def test_drop_oldest_publisher_drops_and_counts():
+    publisher, connections = _queued_publisher("drop-oldest", max_queue=8)
+    _publish_all(publisher, 50)
+    publisher.close()
+    for connection in connections:
+        connection.disconnect().result()
+    stats = publisher.stats()
+    received = _received(connections)
+    assert stats['dropped'] > 0
+    assert stats['dropped'] + stats['events'] == 50 * len(LOTS)
+    assert sum(len(numbers) for numbers in received.values()) == stats['events']
+    for lot in LOTS:
+        numbers = received[lot['address']]
+        # Older events go first, what is left stays in order and the newest
+        # always gets through
+        assert numbers == sorted(numbers)
+        assert numbers[-1] == 49
+        assert len(numbers) < 50
+
+
+def test_block_publisher_keeps_every_event_in_order():
+    publisher, connections = _queued_publisher("block", max_queue=8)
+    start = time.monotonic()
+    _publish_all(publisher, 50)
+    put_seconds = time.monotonic() - start
+    # close() drains the queues before returning
+    publisher.close()
+    assert publisher.queue_depth() == 0
+    for connection in connections:
+        connection.disconnect().result()
+    stats = publisher.stats()
+    assert stats['dropped'] == 0
+    assert stats['events'] == 50 * len(LOTS)
+    assert stats['blocked_seconds'] > 0
+    assert stats['queue_depth_max'] <= 4
+    # 200 events at 2ms an ack over two workers can't be queued without waiting
+    assert put_seconds > 0.1
+    received = _received(connections)
+    for lot in LOTS:
+        assert received[lot['address']] == list(range(50))
+
+
+def test_duplicate_addresses_are_refused():
+    # Lots sharing an address can't be routed to their own shards
+    publishers = [MqttPublisher(None, "test/topic", AT_LEAST_ONCE) for _ in range(2)]
+    with pytest.raises(ValueError):
+        ShardedPublisher(publishers, LOTS + LOTS[:1], [0, 1, 0, 1, 1])
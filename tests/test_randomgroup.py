@@ -0,0 +1,36 @@
+# IoT Parking Meter Simulation - re-report schedule tests
+# By Aussie Schnore
+
+import random
+import sys
+
+import pytest
+
+from randomgroup import group_list, report_schedule
+
+
+@pytest.mark.parametrize("spot_cnt", [0, 1, 7, 59, 60, 61, 1000, 12345])
+@pytest.mark.parametrize("interval", [1, 5, 15, 60])
+def test_every_spot_reports_once(spot_cnt, interval):
+    schedule = report_schedule(spot_cnt, interval, random.Random(spot_cnt))
+    assert len(schedule) == interval
+    assert sorted(spot for group in schedule for spot in group) == list(range(spot_cnt))
+    sizes = [len(group) for group in schedule]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_schedule_is_repeatable():
+    assert report_schedule(1000, 15, random.Random(4)) == report_schedule(1000, 15, random.Random(4))
+
+
+def test_many_groups_dont_recurse():
+    # The recursive partition needed a stack frame per group
+    group_cnt = sys.getrecursionlimit() * 2
+    schedule = group_list(range(group_cnt * 3 + 1), group_cnt, random.Random(0))
+    assert len(schedule) == group_cnt
+    assert sorted(len(group) for group in schedule) == [3] * (group_cnt - 1) + [4]
+
+
+def test_interval_must_be_positive():
+    with pytest.raises(ValueError):
+        report_schedule(10, 0)
@@ -0,0 +1,77 @@
+# IoT Parking Meter Simulation - local time conversion tests
+# By Aussie Schnore
+
+import datetime
+
+import pytest
+
+from simtime import MilTimeConverter, parse_time
+
+zoneinfo = pytest.importorskip("zoneinfo")
+
+# Local days with a DST change: (zone, date the clocks go forward, date they go back)
+DST_DAYS = [
+    ("America/Chicago", "2023-03-12", "2023-11-05"),
+    # Half hour standard offset, +9:30 and +10:30
+    ("Australia/Adelaide", "2023-10-01", "2023-04-02"),
+    # Half hour DST shift, +10:30 and +11:00
+    ("Australia/Lord_Howe", "2023-10-01", "2023-04-02"),
+]
+
+
+def _day_cases():
+    for zone, spring, fall in DST_DAYS:
+        yield zone, spring
+        yield zone, fall
+
+
+@pytest.mark.parametrize("zone, day", list(_day_cases()))
+def test_mil_time_matches_fromtimestamp_across_dst(zone, day):
+    # Every minute (and a second within it) from the local midnight before to
+    # the one after the change, converted in order as the simulation does
+    tz = zoneinfo.ZoneInfo(zone)
+    start = int(datetime.datetime.fromisoformat(day).replace(tzinfo=tz).timestamp()) - 60 * 60
+    converter = MilTimeConverter(zone)
+    for timestamp in range(start, start + 26 * 60 * 60, 60):
+        for ts in (timestamp, timestamp + 37):
+            local = datetime.datetime.fromtimestamp(ts, tz)
+            assert converter.mil_time(ts) == local.hour * 100 + local.minute, (zone, ts)
+            assert converter.minute_of_day(ts) == local.hour * 60 + local.minute, (zone, ts)
+            assert converter.is_weekend(ts) == (1 if local.weekday() >= 5 else 0), (zone, ts)
+
+
+def _epoch(text):
+    return int(datetime.datetime.fromisoformat(text).timestamp())
+
+
+def test_parse_epoch():
+    assert parse_time(1571005498) == 1571005498
+    assert parse_time(" 1571005498 ", "America/Chicago") == 1571005498
+
+
+def test_parse_local_time():
+    # 17:00 CDT is 22:00 UTC
+    assert parse_time("2019-10-14T17:00", "America/Chicago") == _epoch("2019-10-14T22:00+00:00")
+    assert parse_time("2019-10-14 17:00:30", "America/Chicago") == _epoch("2019-10-14T22:00:30+00:00")
+    # A date alone is local midnight
+    assert parse_time("2019-10-14", "Australia/Adelaide") == _epoch("2019-10-13T13:30+00:00")
+    # An explicit offset wins over the zone
+    assert parse_time("2019-10-14T17:00+02:00", "America/Chicago") == _epoch("2019-10-14T15:00+00:00")
+
+
+def test_parse_ambiguous_local_time():
+    # 1:30 happens twice on 2023-11-05 in Chicago, the first (CDT) is taken
+    assert parse_time("2023-11-05T01:30", "America/Chicago") == _epoch("2023-11-05T06:30+00:00")
+
+
+def test_parse_skipped_local_time():
+    # 2:30 doesn't happen on 2023-03-12 in Chicago, it is read as CST, 3:30 CDT
+    timestamp = parse_time("2023-03-12T02:30", "America/Chicago")
+    assert timestamp == _epoch("2023-03-12T08:30+00:00")
+    assert MilTimeConverter("America/Chicago").mil_time(timestamp) == 330
+
+
+@pytest.mark.parametrize("value", ["", "tomorrow", "2019-13-01T00:00", "2019-10-14T25:00", "1571005498.5"])
+def test_parse_bad_time(value):
+    with pytest.raises(ValueError):
+        parse_time(value, "America/Chicago")
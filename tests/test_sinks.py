@@ -0,0 +1,118 @@
+# IoT Parking Meter Simulation - file sink tests
+# By Aussie Schnore
+
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from parky_sim import DEFAULT_START, Parking, parking_config, percent_occupied_table
+from sinks import make_file_sink, make_sink, parse_file_name, parse_sink, run_to_sink
+
+HOURS = 3
+
+
+def _parking():
+    return Parking(None, parking_config * 2, percent_occupied_table, DEFAULT_START, None, seed=8,
+                   tz="America/Chicago")
+
+
+def _expected():
+    # (message, lot id, source) of every event of the run
+    return [(spot.produce(timestamp), spot.lot.lot_id, source)
+            for timestamp, source, spot in _parking().iter_events(HOURS, raw=True)]
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("events.ndjson", ("ndjson", None)),
+    ("events.jsonl.gz", ("ndjson", "gz")),
+    ("EVENTS.CSV.ZST", ("csv", "zst")),
+    ("events.parquet", ("parquet", None)),
+    ("events.feather", ("arrow", None)),
+    ("events.evlog", ("evlog", None)),
+])
+def test_parse_file_name(name, expected):
+    assert parse_file_name(name) == expected
+
+
+def test_parse_file_name_unknown():
+    with pytest.raises(ValueError):
+        parse_file_name("events.txt")
+    with pytest.raises(ValueError):
+        make_file_sink("events.evlog.gz")
+
+
+@pytest.mark.parametrize("name", ["events.ndjson", "events.jsonl.gz"])
+def test_ndjson_sink(tmp_path, name):
+    path = tmp_path / name
+    events, _ = run_to_sink(_parking(), HOURS, make_file_sink(str(path)))
+    data = path.read_bytes()
+    if name.endswith(".gz"):
+        data = gzip.decompress(data)
+    expected = _expected()
+    assert events == len(expected)
+    assert [json.loads(line) for line in data.splitlines()] == [message for message, _, _ in expected]
+
+
+def test_csv_sink(tmp_path):
+    path = tmp_path / "events.csv"
+    run_to_sink(_parking(), HOURS, make_file_sink(str(path)))
+    rows = list(csv.DictReader(io.StringIO(path.read_text())))
+    assert [(int(row['timestamp']), int(row['lot_id']), int(row['meter_number']), row['isOccupied'] == "1",
+             row['source']) for row in rows] == [
+        (message['timestamp'], lot_id, message['meter']['number'], message['isOccupied'], source)
+        for message, lot_id, source in _expected()]
+
+
+def test_zst_sink(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = tmp_path / "events.ndjson.zst"
+    run_to_sink(_parking(), HOURS, make_file_sink(str(path)))
+    with zstandard.ZstdDecompressor().stream_reader(path.open("rb")) as reader:
+        lines = reader.read().splitlines()
+    assert [json.loads(line) for line in lines] == [message for message, _, _ in _expected()]
+
+
+@pytest.mark.parametrize("name", ["events.parquet", "events.arrow"])
+def test_columnar_sink(tmp_path, name):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+    path = tmp_path / name
+    sink = make_file_sink(str(path))
+    sink.batch_rows = 500  # Several record batches
+    run_to_sink(_parking(), HOURS, sink)
+    if name.endswith(".parquet"):
+        table = pyarrow.parquet.read_table(str(path))
+    else:
+        table = pyarrow.ipc.open_file(str(path)).read_all()
+    assert list(zip(table.column("timestamp").to_pylist(), table.column("lot_id").to_pylist(),
+                    table.column("meter_number").to_pylist(), table.column("isOccupied").to_pylist(),
+                    table.column("source").to_pylist())) == [
+        (message['timestamp'], lot_id, message['meter']['number'], message['isOccupied'], source)
+        for message, lot_id, source in _expected()]
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("stdout", ("stdout", "ndjson")),
+    ("stdout:csv", ("stdout", "csv")),
+    ("null", ("null", None)),
+    ("file:out/events.csv.gz", ("file", "out/events.csv.gz")),
+    ("mqtt-local://broker", ("mqtt-local", ("broker", None))),
+    ("mqtt-aws://example.iot.amazonaws.com:8883/", ("mqtt-aws", ("example.iot.amazonaws.com", 8883))),
+])
+def test_parse_sink(spec, expected):
+    assert parse_sink(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["kafka://broker", "file:", "stdout:parquet", "mqtt-local:broker"])
+def test_parse_bad_sink(spec):
+    with pytest.raises(ValueError):
+        parse_sink(spec)
+
+
+def test_null_sink_counts():
+    events, _ = run_to_sink(_parking(), HOURS, make_sink("null"))
+    assert events == len(_expected())